@@ -1,12 +1,44 @@
 from django.contrib import admin
-from .models import Card, Prompt, Profile, Duel, Participant
+from django.db import transaction
+from .models import Blob, Card, ChunkedUpload, MediaJob, Prompt, Profile, Duel, Participant
+from .signals import duels_deleted
 
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('name', 'password', 'results_available', 'voting_enabled', 'random_prompts_mode', 'created_at')
-    list_editable = ('results_available', 'voting_enabled', 'random_prompts_mode')
+    list_display = ('name', 'password', 'results_available', 'voting_enabled', 'random_prompts_mode', 'matchmaking_mode', 'created_at')
+    list_editable = ('results_available', 'voting_enabled', 'random_prompts_mode', 'matchmaking_mode')
 
 admin.site.register(Card)
 admin.site.register(Prompt)
 admin.site.register(Profile, ProfileAdmin)
-admin.site.register(Duel)
-admin.site.register(Participant)
\ No newline at end of file
+admin.site.register(Participant)
+
+class DuelAdmin(admin.ModelAdmin):
+    # Duels have no post_delete receiver, so deletions report themselves here
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            duels_deleted([(obj.profile_id, obj.created_at)])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            deleted = list(queryset.values_list('profile_id', 'created_at'))
+            super().delete_queryset(request, queryset)
+            duels_deleted(deleted)
+
+admin.site.register(Duel, DuelAdmin)
+
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ('card', 'kind', 'status', 'attempts', 'updated_at')
+    list_filter = ('status', 'kind')
+
+admin.site.register(MediaJob, MediaJobAdmin)
+
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'uploader', 'offset', 'size', 'updated_at')
+
+admin.site.register(ChunkedUpload, ChunkedUploadAdmin)
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+
+admin.site.register(Blob, BlobAdmin)
@@ -0,0 +1,89 @@
+"""
+Conditional GET and response caching for profile read views.
+
+Every write to a profile's cards, duels and participants bumps
+Profile.data_version (see core.signals). Read views derive a strong ETag from
+that version, answer If-None-Match with 304 before running any rating code,
+and cache their rendered response per (view, profile, version, parameters).
+Concurrent misses for the same response are rendered once (core.singleflight).
+
+A view that renders data which can lag behind the profile (the results
+snapshots of core.results) sets response.data_version to the version it
+rendered. A response behind the current version is neither cached nor given
+an ETag, so it is not served as current until the next write.
+
+Pages render the session's pending messages (base.html), which no cached
+response may carry, so requests with messages to show bypass the cache.
+"""
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from functools import wraps
+from .models import Profile
+from .singleflight import single_flight
+import hashlib
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+
+def versioned_response(*params, session_required=True):
+    """
+    Decorates a view taking profile_id. `params` are the GET parameters that
+    change the response (e.g. 'filter_by'). With session_required, requests
+    whose session is not logged into the profile go straight to the view so it
+    can redirect them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, profile_id, **kwargs):
+            if request.method != 'GET' or get_messages(request):
+                return view(request, profile_id, **kwargs)
+            if session_required and request.session.get('profile_id') != profile_id:
+                return view(request, profile_id, **kwargs)
+
+            version = Profile.objects.filter(id=profile_id).values_list('data_version', flat=True).first()
+            if version is None:
+                return view(request, profile_id, **kwargs)
+
+            key = ':'.join(
+                [view.__name__, str(profile_id), str(version)] +
+                [f'{name}={value}' for name, value in sorted(kwargs.items())] +
+                [f'{name}={request.GET.get(name, "")}' for name in params]
+            )
+            etag = quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                own = []
+
+                def shareable(response):
+                    return (
+                        response.status_code == 200 and not response.streaming and
+                        getattr(response, 'data_version', version) == version
+                    )
+
+                def render():
+                    own.append(view(request, profile_id, **kwargs))
+                    if not shareable(own[0]):
+                        return None
+                    return (own[0].content, own[0]['Content-Type'])
+
+                # Concurrent requests for the same representation render it once
+                cached = single_flight(f'response:{key}', render, RESPONSE_CACHE_TIMEOUT)
+                if own:
+                    response = own[0]
+                    if not shareable(response):
+                        return response
+                elif cached is None:
+                    # The leader's response (e.g. a redirect) was not shareable
+                    return view(request, profile_id, **kwargs)
+                else:
+                    content, content_type = cached
+                    response = HttpResponse(content, content_type=content_type)
+
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,186 @@
+"""
+Periodic rating checkpoints.
+
+ELO replays are strictly sequential, so the state after the first N duels of a
+profile never changes unless one of those duels is deleted. Every
+CHECKPOINT_INTERVAL duels the state (ratings, won/lost, judge vote counts) is
+stored together with a trace of the ratings after each duel in the block.
+Replays resume from the latest checkpoint, and history is read back from the
+traces, so a dashboard refresh only replays the duels that arrived since.
+
+Checkpoints are deleted by core.signals when a card or duel in their range is
+deleted, and by rebuild_profile_ratings.
+"""
+from array import array
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from .elo import build_duel_arrays, replay, np
+from .models import Card, Duel, RatingCheckpoint
+from .utils import INITIAL_RATING
+import zlib
+
+CHECKPOINT_INTERVAL = 500
+
+# Duels younger than this are never checkpointed, so a duel whose transaction
+# commits late cannot end up before an existing checkpoint.
+CHECKPOINT_LAG = timedelta(seconds=60)
+
+
+def _pack(arrays):
+    lengths = array('q', [len(a) for a in arrays])
+    return zlib.compress(b''.join([lengths.tobytes()] + [a.tobytes() for a in arrays]))
+
+def _unpack(blob, typecodes):
+    data = zlib.decompress(bytes(blob))
+    lengths = array('q')
+    lengths.frombytes(data[:8 * len(typecodes)])
+
+    arrays = []
+    offset = 8 * len(typecodes)
+    for typecode, length in zip(typecodes, lengths):
+        a = array(typecode)
+        size = a.itemsize * length
+        a.frombytes(data[offset:offset + size])
+        offset += size
+        arrays.append(a)
+    return arrays
+
+def _trace_points(checkpoint, tracked, history):
+    """
+    Appends the points of the tracked card ids from a checkpoint's trace.
+    """
+    winners, losers, w_ratings, l_ratings = _unpack(checkpoint.trace, 'qqdd')
+    offset = checkpoint.duel_count - len(winners) + 1
+
+    if np is not None:
+        winners = np.frombuffer(winners, dtype=np.int64)
+        losers = np.frombuffer(losers, dtype=np.int64)
+        for card_id in tracked:
+            points = [(int(i), w_ratings[i]) for i in np.flatnonzero(winners == card_id)]
+            points += [(int(i), l_ratings[i]) for i in np.flatnonzero(losers == card_id)]
+            points.sort(key=lambda point: point[0])
+            history[card_id].extend({'x': i + offset, 'y': y} for i, y in points)
+        return
+
+    for i, (w, l) in enumerate(zip(winners, losers)):
+        if w in tracked:
+            history[w].append({'x': i + offset, 'y': w_ratings[i]})
+        if l in tracked:
+            history[l].append({'x': i + offset, 'y': l_ratings[i]})
+
+def _save_checkpoint(profile, duel_count, rows, card_ids, state, judge_counts, trace):
+    ratings, won, lost = state
+    last_duel_id, last_created_at = rows[-1][0], rows[-1][1]
+
+    winners = array('q')
+    losers = array('q')
+    w_ratings = array('d')
+    l_ratings = array('d')
+    for (_, _, winner_id, loser_id, _), (w_rating, l_rating) in zip(rows, trace):
+        if w_rating is None:
+            # Skipped duel: card id 0 never matches a tracked card
+            winner_id = loser_id = 0
+            w_rating = l_rating = INITIAL_RATING
+        winners.append(winner_id)
+        losers.append(loser_id)
+        w_ratings.append(w_rating)
+        l_ratings.append(l_rating)
+
+    RatingCheckpoint.objects.bulk_create([RatingCheckpoint(
+        profile=profile,
+        duel_count=duel_count,
+        last_duel_id=last_duel_id,
+        last_created_at=last_created_at,
+        state=_pack([
+            array('q', card_ids), array('d', ratings), array('q', won), array('q', lost),
+            array('q', judge_counts.keys()), array('q', judge_counts.values()),
+        ]),
+        trace=_pack([winners, losers, w_ratings, l_ratings]),
+    )], ignore_conflicts=True)
+
+def invalidate_checkpoints(profile_id, since):
+    """
+    Deletes the checkpoints of a profile whose range includes anything created at or after `since`.
+    """
+    if profile_id is not None:
+        RatingCheckpoint.objects.filter(profile_id=profile_id, last_created_at__gte=since).delete()
+
+def replay_profile(profile, history_for=None, since=None):
+    """
+    Same result as core.utils.replay_elo over all duels of the profile, but
+    resumes from the latest checkpoint so only newer duels are replayed.
+    Full blocks of CHECKPOINT_INTERVAL settled duels are checkpointed on the way.
+    With since, history only holds the points after that duel index, and only
+    the checkpoint traces covering them are read.
+    Returns (ratings, history) like replay_elo.
+    """
+    card_ids = list(Card.objects.filter(profile=profile).order_by('id').values_list('id', flat=True))
+    card_index = {card_id: i for i, card_id in enumerate(card_ids)}
+    tracked = {card_id for card_id in (history_for or ()) if card_id in card_index}
+    if since is None:
+        history = {card_id: [{'x': 0, 'y': INITIAL_RATING}] for card_id in tracked}
+    else:
+        history = {card_id: [] for card_id in tracked}
+
+    checkpoints = RatingCheckpoint.objects.filter(profile=profile).order_by('duel_count')
+    latest = checkpoints.defer('trace').last()
+    if tracked and latest is not None:
+        for checkpoint in checkpoints.filter(duel_count__gt=since or 0, duel_count__lte=latest.duel_count):
+            _trace_points(checkpoint, tracked, history)
+
+    duels = Duel.objects.filter(profile=profile).order_by('created_at', 'id')
+    state = None
+    judge_counts = {}
+    offset = 0
+
+    if latest is not None:
+        cp_ids, cp_ratings, cp_won, cp_lost, judge_ids, votes = _unpack(latest.state, 'qdqqqq')
+        resumed = {card_id: i for i, card_id in enumerate(cp_ids)}
+        state = (
+            [cp_ratings[resumed[c]] if c in resumed else INITIAL_RATING for c in card_ids],
+            [cp_won[resumed[c]] if c in resumed else 0 for c in card_ids],
+            [cp_lost[resumed[c]] if c in resumed else 0 for c in card_ids],
+        )
+        judge_counts = dict(zip(judge_ids, votes))
+        offset = latest.duel_count
+        duels = duels.filter(
+            Q(created_at__gt=latest.last_created_at) |
+            Q(created_at=latest.last_created_at, id__gt=latest.last_duel_id)
+        )
+
+    rows = list(duels.values_list('id', 'created_at', 'winner_id', 'loser_id', 'judge_id'))
+    tracked_idx = {card_index[card_id] for card_id in tracked}
+    settled = timezone.now() - CHECKPOINT_LAG
+
+    start = 0
+    while start < len(rows):
+        block = rows[start:start + CHECKPOINT_INTERVAL]
+        checkpoint = len(block) == CHECKPOINT_INTERVAL and block[-1][1] < settled
+        trace = [] if checkpoint else None
+
+        arrays = build_duel_arrays(card_ids, [row[2:] for row in block], judge_counts=judge_counts)
+        ratings, won, lost, points = replay(arrays, history_for=tracked_idx, start=state, offset=offset, trace=trace)
+        state = (ratings, won, lost)
+        judge_counts = arrays.judge_counts
+        offset += len(block)
+        start += len(block)
+
+        if checkpoint:
+            _save_checkpoint(profile, offset, block, card_ids, state, judge_counts, trace)
+        for i, card_points in points.items():
+            history[card_ids[i]].extend({'x': x, 'y': y} for x, y in card_points)
+
+    if since is not None:
+        for card_id, points in history.items():
+            history[card_id] = [point for point in points if point['x'] > since]
+
+    if state is None:
+        state = ([INITIAL_RATING] * len(card_ids), [0] * len(card_ids), [0] * len(card_ids))
+    ratings, won, lost = state
+
+    ratings = {
+        card_id: {'rating': ratings[i], 'won': won[i], 'lost': lost[i]}
+        for i, card_id in enumerate(card_ids)
+    }
+    return ratings, history
@@ -0,0 +1,257 @@
+"""
+Array-backed ELO replay.
+
+Card and judge ids are mapped to dense integer indices so the replay runs over
+flat lists instead of dicts of dicts; that is where most of the speedup over
+calculate_elo comes from. The rating update depends on the previous duel and
+stays a sequential Python loop. Only the per-duel K-factors (Vote Volume
+Normalization) are precomputed in one vectorized pass when NumPy is available.
+
+Duels are passed as plain (winner_id, loser_id, judge_id) tuples, e.g.
+Duel.objects.values_list('winner_id', 'loser_id', 'judge_id'), so no model
+instances have to be built.
+
+The update uses the arithmetic of core.utils.elo_delta, so results are
+bit-identical to core.utils.calculate_elo / calculate_elo_history and to the
+persisted ratings.
+"""
+from collections import namedtuple
+from .utils import INITIAL_RATING, K_FACTOR, judge_weight
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - pure Python fallback below
+    np = None
+
+DuelArrays = namedtuple('DuelArrays', ['card_ids', 'winner_idx', 'loser_idx', 'k', 'judge_counts'])
+
+
+def _duel_k_numpy(judge_idx, prior_votes, k_factor):
+    judge_idx = np.asarray(judge_idx, dtype=np.int64)
+    prior_votes = np.asarray(prior_votes, dtype=np.int64)
+    k = np.full(len(judge_idx), float(k_factor))
+
+    judged = judge_idx >= 0
+    judges = judge_idx[judged]
+    if not len(judges):
+        return k.tolist(), prior_votes.tolist()
+
+    # Votes cast by the judge so far, including this one
+    counts = np.bincount(judges, minlength=len(prior_votes))
+    order = np.argsort(judges, kind='stable')
+    starts = np.cumsum(counts) - counts
+    running = np.empty(len(judges), dtype=np.int64)
+    running[order] = np.arange(len(judges)) - np.repeat(starts, counts) + 1
+    judge_votes = np.concatenate([prior_votes, np.zeros(len(counts) - len(prior_votes), dtype=np.int64)])[judges] + running
+
+    # Judged votes and distinct judges seen so far
+    total_votes = prior_votes.sum() + np.arange(1, len(judges) + 1)
+    judge_total = len(prior_votes) + np.cumsum(judge_votes == 1)
+
+    avg_votes = total_votes / judge_total
+    weight = np.clip(avg_votes / judge_votes, 0.5, 2.5)
+    k[judged] = k_factor * weight
+
+    counts[:len(prior_votes)] += prior_votes
+    return k.tolist(), counts.tolist()
+
+def _duel_k_python(judge_idx, prior_votes, k_factor):
+    k = []
+    judge_counts = list(prior_votes)
+    total_votes = sum(judge_counts)
+    for j in judge_idx:
+        if j < 0:
+            k.append(k_factor)
+            continue
+        if j == len(judge_counts):
+            judge_counts.append(0)
+        judge_counts[j] += 1
+        total_votes += 1
+        k.append(k_factor * judge_weight(judge_counts[j], total_votes, len(judge_counts)))
+    return k, judge_counts
+
+def _index(card_ids, duel_rows, judge_index):
+    card_index = {card_id: i for i, card_id in enumerate(card_ids)}
+
+    winner_idx = []
+    loser_idx = []
+    judge_idx = []
+    for winner_id, loser_id, judge_id in duel_rows:
+        winner_idx.append(card_index.get(winner_id, -1))
+        loser_idx.append(card_index.get(loser_id, -1))
+        if judge_id:
+            judge_idx.append(judge_index.setdefault(judge_id, len(judge_index)))
+        else:
+            judge_idx.append(-1)
+
+    return winner_idx, loser_idx, judge_idx
+
+def build_duel_arrays(card_ids, duel_rows, k_factor=K_FACTOR, judge_counts=None):
+    """
+    Maps duels to dense card indices and precomputes the K-factor of every duel.
+    Duels involving cards outside card_ids get index -1: they are skipped by the
+    replay but still count towards the judge's vote volume.
+    judge_counts ({judge_id: votes}) resumes the vote volumes of earlier duels;
+    the returned arrays carry the counts after these duels.
+    """
+    card_ids = list(card_ids)
+    judge_counts = judge_counts or {}
+    judge_index = {judge_id: i for i, judge_id in enumerate(judge_counts)}
+    winner_idx, loser_idx, judge_idx = _index(card_ids, duel_rows, judge_index)
+
+    if np is not None:
+        k, votes = _duel_k_numpy(judge_idx, list(judge_counts.values()), k_factor)
+    else:
+        k, votes = _duel_k_python(judge_idx, list(judge_counts.values()), k_factor)
+
+    return DuelArrays(card_ids, winner_idx, loser_idx, k, dict(zip(judge_index, votes)))
+
+def replay(arrays, initial_rating=INITIAL_RATING, history_for=None, start=None, offset=0, trace=None):
+    """
+    Runs the sequential ELO update over prepared DuelArrays.
+    Returns (ratings, won, lost, history) where the first three are lists aligned
+    with arrays.card_ids. history maps each index in history_for to a list of
+    (duel_number, rating) tuples; it is empty when history_for is None.
+    start resumes from earlier (ratings, won, lost) lists, with duel numbers
+    continuing after offset. If trace is a list, the winner's and loser's
+    rating after every duel is appended to it (None for skipped duels).
+    """
+    n = len(arrays.card_ids)
+    if start is not None:
+        ratings, won, lost = (list(values) for values in start)
+    else:
+        ratings = [initial_rating] * n
+        won = [0] * n
+        lost = [0] * n
+
+    tracked = set(history_for or ())
+    history = {i: [] for i in tracked}
+
+    if not tracked and trace is None:
+        for w, l, k in zip(arrays.winner_idx, arrays.loser_idx, arrays.k):
+            if w < 0 or l < 0:
+                continue
+            won[w] += 1
+            lost[l] += 1
+            w_rating = ratings[w]
+            l_rating = ratings[l]
+            ratings[w] = w_rating + k * (1 - 1 / (1 + 10 ** ((l_rating - w_rating) / 400)))
+            ratings[l] = l_rating + k * (0 - 1 / (1 + 10 ** ((w_rating - l_rating) / 400)))
+        return ratings, won, lost, history
+
+    for i, (w, l, k) in enumerate(zip(arrays.winner_idx, arrays.loser_idx, arrays.k), offset + 1):
+        if w < 0 or l < 0:
+            if trace is not None:
+                trace.append((None, None))
+            continue
+
+        won[w] += 1
+        lost[l] += 1
+
+        expected_winner = 1 / (1 + 10 ** ((ratings[l] - ratings[w]) / 400))
+        expected_loser = 1 / (1 + 10 ** ((ratings[w] - ratings[l]) / 400))
+        ratings[w] += k * (1 - expected_winner)
+        ratings[l] += k * (0 - expected_loser)
+
+        if trace is not None:
+            trace.append((ratings[w], ratings[l]))
+        if w in tracked:
+            history[w].append((i, ratings[w]))
+        if l in tracked:
+            history[l].append((i, ratings[l]))
+
+    return ratings, won, lost, history
+
+def calculate_elo_arrays(card_ids, duel_rows, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
+    """
+    Same result as core.utils.calculate_elo, from card ids and duel tuples.
+    Returns a dictionary: {card_id: {'rating': float, 'won': int, 'lost': int}}
+    """
+    arrays = build_duel_arrays(card_ids, duel_rows, k_factor)
+    ratings, won, lost, _ = replay(arrays, initial_rating)
+    return {
+        card_id: {'rating': ratings[i], 'won': won[i], 'lost': lost[i]}
+        for i, card_id in enumerate(arrays.card_ids)
+    }
+
+def calculate_elo_history_arrays(card_ids, duel_rows, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
+    """
+    Same result as core.utils.calculate_elo_history, from card ids and duel tuples.
+    Returns a dictionary: {card_id: [{'x': duel_number, 'y': rating}, ...]}
+    """
+    arrays = build_duel_arrays(card_ids, duel_rows, k_factor)
+    _, _, _, history = replay(arrays, initial_rating, history_for=range(len(arrays.card_ids)))
+    return {
+        card_id: [{'x': x, 'y': y} for x, y in history[i]]
+        for i, card_id in enumerate(arrays.card_ids)
+    }
+
+GENDER_SEGMENTS = {'M': 'men', 'F': 'women'}
+
+SegmentRatings = namedtuple('SegmentRatings', ['card_ids', 'segments'])
+
+
+class _Segment:
+    __slots__ = ('ratings', 'won', 'lost', 'judge_counts', 'total_votes')
+
+    def __init__(self, n, initial_rating):
+        self.ratings = [initial_rating] * n
+        self.won = [0] * n
+        self.lost = [0] * n
+        self.judge_counts = {}
+        self.total_votes = 0
+
+def replay_segments(card_ids, duel_rows, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
+    """
+    Replays the duel log once while keeping parallel ratings for every judge
+    segment: 'all', 'men', 'women' and one segment per judge id.
+    Each segment normalizes vote volume over its own judges, so a segment gives
+    the same result as calculate_elo over just that segment's duels.
+    duel_rows are (winner_id, loser_id, judge_id, judge_gender) tuples.
+    Returns SegmentRatings(card_ids, {segment: (ratings, won, lost)}) with lists
+    aligned to card_ids.
+    """
+    card_ids = list(card_ids)
+    card_index = {card_id: i for i, card_id in enumerate(card_ids)}
+    n = len(card_ids)
+
+    state = {'all': _Segment(n, initial_rating)}
+
+    def segment(key):
+        seg = state.get(key)
+        if seg is None:
+            seg = state[key] = _Segment(n, initial_rating)
+        return seg
+
+    for winner_id, loser_id, judge_id, gender in duel_rows:
+        w = card_index.get(winner_id, -1)
+        l = card_index.get(loser_id, -1)
+
+        segs = [state['all']]
+        if judge_id:
+            if gender in GENDER_SEGMENTS:
+                segs.append(segment(GENDER_SEGMENTS[gender]))
+            segs.append(segment(judge_id))
+
+        for seg in segs:
+            k = k_factor
+            if judge_id:
+                seg.judge_counts[judge_id] = seg.judge_counts.get(judge_id, 0) + 1
+                seg.total_votes += 1
+                k = k_factor * judge_weight(seg.judge_counts[judge_id], seg.total_votes, len(seg.judge_counts))
+
+            if w < 0 or l < 0:
+                continue
+
+            seg.won[w] += 1
+            seg.lost[l] += 1
+
+            ratings = seg.ratings
+            expected_winner = 1 / (1 + 10 ** ((ratings[l] - ratings[w]) / 400))
+            expected_loser = 1 / (1 + 10 ** ((ratings[w] - ratings[l]) / 400))
+            ratings[w] += k * (1 - expected_winner)
+            ratings[l] += k * (0 - expected_loser)
+
+    return SegmentRatings(card_ids, {
+        key: (seg.ratings, seg.won, seg.lost) for key, seg in state.items()
+    })
@@ -0,0 +1,106 @@
+"""
+In-process publish/subscribe for live dashboard updates.
+
+Writes to cards and duels publish one update per change (see core.signals);
+every open dashboard stream of the profile receives the same payload, so the
+counters and ratings are computed once per change instead of once per poll
+per screen. Subscribers live on an asyncio event loop (the ASGI server's);
+publishers may run in any thread.
+
+Only streams served by the same process are notified. Run a single ASGI
+process for the dashboard, or the pages fall back to polling.
+"""
+from django.db.models import Count, Q
+from .models import Card, CardRating, Duel
+import asyncio
+import threading
+
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, broker, profile_id, loop):
+        self.broker = broker
+        self.profile_id = profile_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def _put(self, message):
+        if self.queue.full():
+            # Slow consumer: drop the oldest update, newer counters supersede it
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, profile_id):
+        """
+        Subscribes the running event loop to the updates of a profile.
+        """
+        subscription = Subscription(self, profile_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(profile_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.profile_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.profile_id, None)
+
+    def has_subscribers(self, profile_id):
+        with self._lock:
+            return bool(self._subscriptions.get(profile_id))
+
+    def publish(self, profile_id, event, data):
+        """
+        Delivers (event, data) to every subscription of the profile. Thread-safe.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(profile_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, (event, data))
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(subscription)
+
+broker = Broker()
+
+
+def dashboard_counts(profile_id):
+    counts = Card.objects.filter(profile_id=profile_id).aggregate(
+        image_count=Count('id', filter=Q(prompt__isnull=True)),
+        prompt_count=Count('id', filter=Q(prompt__isnull=False)),
+    )
+    counts['duel_count'] = Duel.objects.filter(profile_id=profile_id).count()
+    return counts
+
+def publish_update(profile_id, duels=()):
+    """
+    Computes the dashboard update of a profile once and sends it to all its streams.
+    For new duels the update also carries the new ratings of their cards, as
+    chart points at the latest duel index.
+    """
+    if profile_id is None or not broker.has_subscribers(profile_id):
+        return
+
+    data = dashboard_counts(profile_id)
+    if duels:
+        card_ids = {card_id for duel in duels for card_id in (duel.winner_id, duel.loser_id)}
+        ratings = CardRating.objects.filter(card_id__in=card_ids).values_list('card_id', 'rating')
+        data['points'] = [
+            {'id': card_id, 'x': data['duel_count'], 'y': round(rating, 1)}
+            for card_id, rating in ratings
+        ]
+    broker.publish(profile_id, 'update', data)
@@ -0,0 +1,146 @@
+"""
+Keyset-paginated leaderboards for the stats page.
+
+Pages are ordered by one of SORTS (descending, ties broken by card id) and
+continue after a cursor "<value>:<card_id>:<rank>" naming the last row shown,
+so a page costs the same however deep into the leaderboard it is.
+
+Unfiltered leaderboards seek directly on the persisted CardRating rows in
+SQL. Judge filters ('men', 'women', a participant id) have no persisted
+ratings; their order is built once from the cached segment replay, cached per
+profile data version and sought with bisect.
+"""
+from bisect import bisect_right
+from django.core.cache import cache
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from django.http import Http404
+from .models import Card, CardRating
+from .ratings import get_filtered_ratings
+
+PAGE_SIZE = 25
+
+SORTS = {
+    'rating': 'Elo',
+    'won': 'Flest seire',
+    'lost': 'Flest tap',
+    'weight': 'Sannsynlighet',
+}
+
+ORDER_CACHE_TIMEOUT = 60 * 60
+
+
+def selection_weight(won, lost):
+    """
+    Laplace-smoothed win rate, as a percentage.
+    """
+    return (won + 1) / (won + lost + 2) * 100
+
+
+def parse_cursor(after):
+    """
+    (value, card_id, rank) of a cursor, or None for the first page.
+    """
+    if not after:
+        return None
+    try:
+        value, card_id, rank = after.split(':')
+        return float(value), int(card_id), int(rank)
+    except ValueError:
+        raise Http404("Ugyldig side.")
+
+
+def format_cursor(value, card_id, rank):
+    return f'{value!r}:{card_id}:{rank}'
+
+
+def leaderboard_page(profile, card_type, segment='all', sort='rating', after=None):
+    """
+    One page of the leaderboard of a card type ('image' or 'prompt').
+    Returns (cards, next_cursor); the cards carry rank, elo_rating, won_count,
+    lost_count and selection_weight, and next_cursor is None on the last page.
+    """
+    if sort not in SORTS:
+        sort = 'rating'
+    cursor = parse_cursor(after)
+    if segment == 'all':
+        rows = _persisted_page(profile, card_type, sort, cursor)
+    else:
+        rows = _segment_page(profile, card_type, segment, sort, cursor)
+
+    rank = cursor[2] if cursor else 0
+    cards = []
+    for card, rating, won, lost in rows[:PAGE_SIZE]:
+        rank += 1
+        card.rank = rank
+        card.elo_rating = rating
+        card.won_count = won
+        card.lost_count = lost
+        card.selection_weight = selection_weight(won, lost)
+        cards.append(card)
+
+    next_cursor = None
+    if len(rows) > PAGE_SIZE:
+        last = cards[-1]
+        value = {
+            'rating': last.elo_rating,
+            'won': last.won_count,
+            'lost': last.lost_count,
+            'weight': _weight_key(last.won_count, last.lost_count),
+        }[sort]
+        next_cursor = format_cursor(float(value), last.id, rank)
+    return cards, next_cursor
+
+
+def _weight_key(won, lost):
+    # Same expression as the SQL annotation below, so cursors compare exactly
+    return (won + 1.0) / (won + lost + 2)
+
+
+def _persisted_page(profile, card_type, sort, cursor):
+    """
+    PAGE_SIZE + 1 rows after the cursor, straight from CardRating in one query.
+    """
+    ratings = (
+        CardRating.objects
+        .filter(profile=profile, card__prompt__isnull=(card_type == 'image'))
+        .select_related('card__prompt')
+        .annotate(weight=Cast(F('won') + 1, FloatField()) / (F('won') + F('lost') + 2))
+    )
+    if cursor:
+        value, card_id, _ = cursor
+        ratings = ratings.filter(Q(**{f'{sort}__lt': value}) | Q(**{sort: value, 'card_id__gt': card_id}))
+    ratings = ratings.order_by(f'-{sort}', 'card_id')[:PAGE_SIZE + 1]
+    return [(r.card, r.rating, r.won, r.lost) for r in ratings]
+
+
+def _segment_order(profile, card_type, segment, sort):
+    """
+    Sorted [(-value, card_id, rating, won, lost)] of a judge segment, cached per
+    profile data version.
+    """
+    key = f'leaderboard:{profile.id}:{profile.data_version}:{segment}:{card_type}:{sort}'
+    order = cache.get(key)
+    if order is None:
+        card_ids = Card.objects.filter(profile=profile, prompt__isnull=(card_type == 'image')).values_list('id', flat=True)
+        ratings = get_filtered_ratings(profile, segment)
+        order = []
+        for card_id in card_ids:
+            r = ratings.get(card_id, {'rating': 1200.0, 'won': 0, 'lost': 0})
+            rating, won, lost = float(r['rating']), int(r['won']), int(r['lost'])
+            value = {'rating': rating, 'won': won, 'lost': lost, 'weight': _weight_key(won, lost)}[sort]
+            order.append((-value, card_id, rating, won, lost))
+        order.sort()
+        cache.set(key, order, ORDER_CACHE_TIMEOUT)
+    return order
+
+
+def _segment_page(profile, card_type, segment, sort, cursor):
+    order = _segment_order(profile, card_type, segment, sort)
+    start = 0
+    if cursor:
+        value, card_id, _ = cursor
+        start = bisect_right(order, (-value, card_id, float('inf')))
+    rows = order[start:start + PAGE_SIZE + 1]
+    cards = Card.objects.select_related('prompt').in_bulk([row[1] for row in rows])
+    return [(cards[row[1]], row[2], row[3], row[4]) for row in rows if row[1] in cards]
@@ -0,0 +1,77 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import connections
+from core.media import render_renditions
+from core.models import Card
+import django
+import os
+
+
+def init_worker():
+    # Spawned workers set Django up themselves; forked ones must not share the parent's connections
+    django.setup()
+    connections.close_all()
+
+
+def backfill_card(card_id):
+    """
+    Renders the renditions of one card in a worker process. Returns
+    (card_id, error or None).
+    """
+    card = Card.objects.filter(id=card_id).first()
+    if card is None or not card.image:
+        return card_id, None
+    try:
+        replaced = render_renditions(card)
+        card.save(update_fields=['renditions'])
+        for name in replaced:
+            card.image.storage.delete(name)
+    except Exception as error:
+        return card_id, repr(error)
+    return card_id, None
+
+
+class Command(BaseCommand):
+    help = 'Renders the thumbnail, medium and large WebP/JPEG renditions of existing card images in parallel worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes.')
+        parser.add_argument('--profile', type=int, help='Only backfill the cards of this profile.')
+        parser.add_argument('--force', action='store_true', help='Also re-render cards that already have renditions.')
+
+    def run(self, card_ids, workers):
+        """
+        Yields (card_id, error) as cards finish. With a single worker the cards
+        are rendered in this process.
+        """
+        if workers <= 1:
+            for card_id in card_ids:
+                yield backfill_card(card_id)
+            return
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            futures = [pool.submit(backfill_card, card_id) for card_id in card_ids]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def handle(self, *args, **options):
+        cards = Card.objects.filter(processing_status='ready').exclude(image='').exclude(image__isnull=True)
+        if options['profile']:
+            cards = cards.filter(profile_id=options['profile'])
+        if not options['force']:
+            cards = cards.filter(renditions={})
+        card_ids = list(cards.order_by('id').values_list('id', flat=True))
+        if not card_ids:
+            self.stdout.write(self.style.SUCCESS('No cards need renditions.'))
+            return
+
+        self.stdout.write(f'Rendering {len(card_ids)} cards with {options["workers"]} workers...')
+        failed = 0
+        for done, (card_id, error) in enumerate(self.run(card_ids, options['workers']), 1):
+            if error:
+                failed += 1
+                self.stderr.write(f'  Card {card_id}: {error}')
+            if done % 100 == 0:
+                self.stdout.write(f'  {done}/{len(card_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfill complete: {len(card_ids) - failed} cards rendered, {failed} failed.'))
@@ -0,0 +1,126 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from core.management.scratch import scratch_database
+from core.models import Card, CardRating, Duel, Participant, Profile
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a profile with synthetic duels and compares query plans and timings of the hot duel queries '
+        'through winner__profile without the composite indexes (before) and through Duel.profile (after). '
+        'Seeded profiles are written to a temporary database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duels', type=int, default=500_000, help='Duels in the benchmarked profile.')
+        parser.add_argument('--background-duels', type=int, default=100_000, help='Duels in another profile, so filtering matters.')
+        parser.add_argument('--cards', type=int, default=300, help='Number of cards per profile.')
+        parser.add_argument('--judges', type=int, default=150, help='Number of judges per profile.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per query; the best time is reported.')
+        parser.add_argument('--profile', type=int, help='Benchmark an existing profile in the project database instead of seeding one.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def seed(self, name, duels, options, rng):
+        profile = Profile.objects.create(name=name)
+        judges = Participant.objects.bulk_create([
+            Participant(profile=profile, name=f'Judge {i}', gender=rng.choice('MFO'))
+            for i in range(options['judges'])
+        ])
+        cards = Card.objects.bulk_create([Card(profile=profile, answer=f'Card {i}') for i in range(options['cards'])])
+        CardRating.objects.bulk_create([CardRating(card=card, profile=profile) for card in cards])
+
+        card_ids = [card.id for card in cards]
+        judge_ids = [judge.id for judge in judges] + [None]
+        start = timezone.now() - timedelta(seconds=duels)
+        table = Duel._meta.db_table
+        with connection.cursor() as cursor:
+            for offset in range(0, duels, 10_000):
+                rows = []
+                for i in range(offset, min(offset + 10_000, duels)):
+                    winner_id, loser_id = rng.sample(card_ids, 2)
+                    rows.append((profile.id, winner_id, loser_id, rng.choice(judge_ids), start + timedelta(seconds=i)))
+                cursor.executemany(
+                    f'INSERT INTO {table} (profile_id, winner_id, loser_id, judge_id, created_at) VALUES (%s, %s, %s, %s, %s)',
+                    rows
+                )
+        return profile
+
+    def queries(self, profile, path):
+        """
+        (name, queryset) pairs of the hot duel queries, filtering the profile through `path`.
+        """
+        duels = Duel.objects.filter(**{path: profile})
+        rows = duels.order_by('created_at', 'id').values_list('winner_id', 'loser_id', 'judge_id')
+        since = duels.order_by('-created_at').values_list('created_at', flat=True)[1000]
+        card = Card.objects.filter(profile=profile).first()
+        return [
+            ('duel count', duels),
+            ('replay rows', rows),
+            ('duels since checkpoint', rows.filter(created_at__gt=since)),
+            ('judge votes', duels.filter(judge__isnull=False).values_list('judge_id').annotate(votes=Count('id')).order_by()),
+            ('card duels', Duel.objects.filter(Q(winner=card) | Q(loser=card)).order_by('created_at').values_list('id', 'judge_id')),
+        ]
+
+    def measure(self, profile, path, options):
+        results = {}
+        for name, queryset in self.queries(profile, path):
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                if name == 'duel count':
+                    queryset.count()
+                else:
+                    list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            results[name] = (min(timings), queryset.explain())
+        return results
+
+    def handle(self, *args, **options):
+        if options['profile']:
+            profile = Profile.objects.filter(id=options['profile']).first()
+            if profile is None:
+                raise CommandError(f'Profile {options["profile"]} does not exist.')
+            self.benchmark(profile, options)
+            return
+
+        # The seeded profiles go into a throwaway database, not the project's
+        rng = random.Random(options['seed'])
+        with scratch_database():
+            self.stdout.write(f'Seeding {options["duels"]} + {options["background_duels"]} duels...')
+            with transaction.atomic():
+                self.seed('Benchmark (background)', options['background_duels'], options, rng)
+                profile = self.seed('Benchmark', options['duels'], options, rng)
+            self.benchmark(profile, options)
+
+    def benchmark(self, profile, options):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        # Before: the join through Card, with the old single-column indexes on
+        # winner and loser instead of the composite ones. The schema is changed
+        # inside a transaction that is rolled back.
+        table = connection.ops.quote_name(Duel._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for index in Duel._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+                for column in ('winner_id', 'loser_id'):
+                    cursor.execute(f'CREATE INDEX bench_duel_{column} ON {table} ({column})')
+                cursor.execute('ANALYZE')
+            before = self.measure(profile, 'winner__profile', options)
+            transaction.set_rollback(True)
+
+        after = self.measure(profile, 'profile', options)
+
+        for name, (before_time, before_plan) in before.items():
+            after_time, after_plan = after[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            self.stdout.write(f'  before {before_time * 1000:9.1f} ms')
+            self.stdout.write('    ' + before_plan.replace('\n', '\n    '))
+            self.stdout.write(f'  after  {after_time * 1000:9.1f} ms   ({before_time / after_time:.1f}x)')
+            self.stdout.write('    ' + after_plan.replace('\n', '\n    '))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.elo import calculate_elo_arrays, np
+from core.utils import calculate_elo
+from types import SimpleNamespace
+import random
+import time
+
+class Command(BaseCommand):
+    help = 'Benchmarks the array-backed ELO replay against calculate_elo on synthetic duels.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='Numbers of duels to replay.')
+        parser.add_argument('--cards', type=int, default=300, help='Number of cards.')
+        parser.add_argument('--judges', type=int, default=150, help='Number of judges.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        card_ids = list(range(1, options['cards'] + 1))
+        judge_ids = list(range(1, options['judges'] + 1)) + [None]
+        cards = [SimpleNamespace(id=card_id) for card_id in card_ids]
+
+        self.stdout.write(f'NumPy: {"yes" if np is not None else "no (pure Python fallback)"}')
+        self.stdout.write(f'{"duels":>10} {"calculate_elo":>15} {"arrays":>10} {"speedup":>8}')
+
+        for size in options['sizes']:
+            rows = []
+            for _ in range(size):
+                winner_id, loser_id = rng.sample(card_ids, 2)
+                rows.append((winner_id, loser_id, rng.choice(judge_ids)))
+            duels = [SimpleNamespace(winner_id=w, loser_id=l, judge_id=j) for w, l, j in rows]
+
+            start = time.perf_counter()
+            expected = calculate_elo(cards, duels)
+            reference_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = calculate_elo_arrays(card_ids, rows)
+            arrays_time = time.perf_counter() - start
+
+            if result != expected:
+                raise CommandError(f'Results differ from calculate_elo at {size} duels.')
+
+            self.stdout.write(
+                f'{size:>10} {reference_time:>14.3f}s {arrays_time:>9.3f}s {reference_time / arrays_time:>7.1f}x'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Results are bit-identical to calculate_elo.'))
@@ -1,43 +1,100 @@
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from core.models import Prompt
-import os
+from core.prompts import invalidate_prompt_ids
+import gzip
+import io
+import sys
+
+GZIP_MAGIC = b'\x1f\x8b'
+MAX_LENGTH = Prompt._meta.get_field('text').max_length
+
 
 class Command(BaseCommand):
-    help = 'Reads a text file line by line and creates Prompt objects for each non-blank line.'
+    help = (
+        'Reads a text file line by line and creates a Prompt for each new non-blank line. '
+        'Use "-" to read from stdin; gzip-compressed input is detected automatically.'
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('file_path', type=str, help='The path to the text file containing prompts, one per line.')
+        parser.add_argument('file_path', type=str, help='The path to the text file containing prompts, one per line, or "-" for stdin.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Prompts inserted per bulk insert.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be imported without writing anything.')
+
+    def open_input(self, file_path):
+        """
+        The input as a text stream, decompressing gzip data.
+        """
+        if file_path == '-':
+            raw = sys.stdin.buffer
+        else:
+            try:
+                raw = open(file_path, 'rb')
+            except OSError as error:
+                raise CommandError(f'Could not open "{file_path}": {error.strerror}.')
+        try:
+            raw = io.BufferedReader(raw) if not hasattr(raw, 'peek') else raw
+            if raw.peek(2)[:2] == GZIP_MAGIC:
+                raw = gzip.GzipFile(fileobj=raw)
+            return io.TextIOWrapper(raw, encoding='utf-8')
+        except BaseException:
+            if file_path != '-':
+                raw.close()
+            raise
 
     def handle(self, *args, **options):
         file_path = options['file_path']
+        dry_run = options['dry_run']
 
-        if not os.path.exists(file_path):
-            raise CommandError(f'File "{file_path}" does not exist.')
-        
-        self.stdout.write(self.style.SUCCESS(f'Attempting to import prompts from "{file_path}"...'))
-
-        prompts_created_count = 0
-        prompts_skipped_count = 0
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                prompt_text = line.strip()
-                
-                if not prompt_text:
-                    prompts_skipped_count += 1
-                    continue
-                
-                # Check if prompt already exists
-                obj, created = Prompt.objects.get_or_create(text=prompt_text)
-                
-                if created:
-                    self.stdout.write(f'  Created prompt: "{prompt_text}"')
-                    prompts_created_count += 1
-                else:
-                    self.stdout.write(f'  Skipped existing prompt: "{prompt_text}"')
-                    prompts_skipped_count += 1
+        source = 'stdin' if file_path == '-' else f'"{file_path}"'
+        self.stdout.write(self.style.SUCCESS(f'Attempting to import prompts from {source}...'))
 
+        # One query for every existing prompt; each line is then a set lookup
+        seen = set(Prompt.objects.values_list('text', flat=True))
+        counts = {'created': 0, 'existing': 0, 'duplicate': 0, 'blank': 0, 'too_long': 0}
+        new_texts = set()
+        chunk = []
+
+        try:
+            with self.open_input(file_path) as stream, transaction.atomic():
+                for line in stream:
+                    prompt_text = line.strip()
+                    if not prompt_text:
+                        counts['blank'] += 1
+                    elif len(prompt_text) > MAX_LENGTH:
+                        counts['too_long'] += 1
+                    elif prompt_text in new_texts:
+                        counts['duplicate'] += 1
+                    elif prompt_text in seen:
+                        counts['existing'] += 1
+                    else:
+                        new_texts.add(prompt_text)
+                        chunk.append(prompt_text)
+                        if len(chunk) >= options['chunk_size']:
+                            self.insert(chunk, counts, dry_run, options['verbosity'])
+                            chunk = []
+                self.insert(chunk, counts, dry_run, options['verbosity'])
+                if not dry_run:
+                    transaction.on_commit(invalidate_prompt_ids)
+        except (UnicodeDecodeError, EOFError, gzip.BadGzipFile) as error:
+            raise CommandError(f'Could not read {source}: {error}. Nothing was imported.')
+
+        action = 'would be created' if dry_run else 'created'
         self.stdout.write(self.style.SUCCESS(
-            f'\nImport complete: {prompts_created_count} prompts created, '
-            f'{prompts_skipped_count} prompts skipped (already existed or blank lines).'
+            f'\n{"Dry run" if dry_run else "Import"} complete: {counts["created"]} prompts {action}, '
+            f'{counts["existing"]} already existed, {counts["duplicate"]} duplicate lines, '
+            f'{counts["blank"]} blank lines, {counts["too_long"]} longer than {MAX_LENGTH} characters skipped.'
         ))
+
+    def insert(self, texts, counts, dry_run, verbosity):
+        if texts and not dry_run:
+            # Prompts someone else added since the existing ones were read
+            added = set(Prompt.objects.filter(text__in=texts).values_list('text', flat=True))
+            counts['existing'] += len(added)
+            texts = [text for text in texts if text not in added]
+            # Rows inserted concurrently by someone else are still skipped by the unique index
+            Prompt.objects.bulk_create([Prompt(text=text) for text in texts], ignore_conflicts=True)
+        if verbosity >= 2:
+            for text in texts:
+                self.stdout.write(f'  Created prompt: "{text}"')
+        counts['created'] += len(texts)
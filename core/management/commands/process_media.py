@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.media import process_pending, requeue_stale
+from core.models import MediaJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the queued media processing jobs (HEIC conversion) in this process, e.g. after a restart '
+        'or from cron. Jobs running for longer than the stale limit are requeued first; failed jobs waiting '
+        'to be retried are left until they are due.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also requeue jobs that ran out of attempts.')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale()
+        if options['retry_failed']:
+            requeued += MediaJob.objects.filter(status='failed').update(status='queued', attempts=0, run_after=timezone.now())
+        processed = process_pending()
+        failed = MediaJob.objects.filter(status='failed').count()
+        self.stdout.write(self.style.SUCCESS(
+            f'{processed} jobs processed ({requeued} requeued), {failed} failed jobs in the table.'
+        ))
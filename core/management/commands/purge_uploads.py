@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.uploads import UPLOAD_EXPIRY, purge_abandoned
+
+
+class Command(BaseCommand):
+    help = f'Deletes chunked uploads idle for longer than {UPLOAD_EXPIRY} together with their partial files, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        purged = purge_abandoned()
+        self.stdout.write(self.style.SUCCESS(f'{purged} abandoned uploads deleted.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Profile
+from core.ratings import rebuild_profile_ratings
+
+class Command(BaseCommand):
+    help = 'Replays all duels from scratch and rebuilds the persisted ELO ratings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', type=int, help='Only rebuild the profile with this id.')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.all()
+        if options['profile'] is not None:
+            profiles = profiles.filter(id=options['profile'])
+            if not profiles.exists():
+                raise CommandError(f'Profile {options["profile"]} does not exist.')
+
+        for profile in profiles:
+            ratings = rebuild_profile_ratings(profile)
+            self.stdout.write(f'  Rebuilt "{profile.name}": {len(ratings)} cards')
+
+        self.stdout.write(self.style.SUCCESS('Ratings rebuilt.'))
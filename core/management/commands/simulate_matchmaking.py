@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand
+from core.sampler import CardPool
+from core.utils import elo_delta, judge_weight, INITIAL_RATING, K_FACTOR
+import random
+import statistics
+
+STRATEGIES = ['win_rate', 'information']
+
+
+def kendall_tau(xs, ys):
+    """
+    Kendall's tau-a between two equally long score lists.
+    """
+    n = len(xs)
+    score = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            product = (xs[i] - xs[j]) * (ys[i] - ys[j])
+            score += (product > 0) - (product < 0)
+    return score / (n * (n - 1) / 2)
+
+
+class Command(BaseCommand):
+    help = 'Simulates synthetic judges and reports how many duels each matchmaking strategy needs to reach a target Kendall tau.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=60, help='Number of cards.')
+        parser.add_argument('--judges', type=int, default=25, help='Number of judges.')
+        parser.add_argument('--target', type=float, default=0.8, help='Kendall tau against the true ranking to reach.')
+        parser.add_argument('--max-duels', type=int, default=10_000, help='Give up after this many duels.')
+        parser.add_argument('--check-every', type=int, default=20, help='Duels between two Kendall tau checks.')
+        parser.add_argument('--runs', type=int, default=5, help='Simulations per strategy.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def simulate(self, strategy, seed, options):
+        rng = random.Random(seed)
+        card_ids = list(range(1, options['cards'] + 1))
+
+        # Ground truth in ELO points. Judges differ in how noisy they are and in
+        # how much they vote, so the vote volume normalization is exercised too.
+        strength = {card_id: rng.gauss(0, 200) for card_id in card_ids}
+        judges = list(range(1, options['judges'] + 1))
+        noise = {judge: rng.uniform(1, 2) for judge in judges}
+        activity = [rng.paretovariate(1.5) for judge in judges]
+
+        pool = CardPool()
+        ratings = {card_id: INITIAL_RATING for card_id in card_ids}
+        won = dict.fromkeys(card_ids, 0)
+        lost = dict.fromkeys(card_ids, 0)
+        for card_id in card_ids:
+            pool.set(card_id, INITIAL_RATING, 0, 0)
+
+        votes = {}
+        truth = [strength[card_id] for card_id in card_ids]
+
+        for duel in range(1, options['max_duels'] + 1):
+            a, b = pool.draw_pair(strategy, rng)
+            judge = rng.choices(judges, weights=activity)[0]
+            p = 1 / (1 + 10 ** ((strength[b] - strength[a]) / (400 * noise[judge])))
+            winner, loser = (a, b) if rng.random() < p else (b, a)
+
+            votes[judge] = votes.get(judge, 0) + 1
+            k = K_FACTOR * judge_weight(votes[judge], duel, len(votes))
+            w_delta, l_delta = elo_delta(ratings[winner], ratings[loser], k)
+            ratings[winner] += w_delta
+            ratings[loser] += l_delta
+            won[winner] += 1
+            lost[loser] += 1
+            for card_id in (winner, loser):
+                pool.set(card_id, ratings[card_id], won[card_id], lost[card_id])
+
+            if duel % options['check_every'] == 0:
+                tau = kendall_tau([ratings[card_id] for card_id in card_ids], truth)
+                if tau >= options['target']:
+                    return duel
+        return None
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{options["cards"]} cards, {options["judges"]} judges, target tau {options["target"]}, '
+            f'{options["runs"]} runs per strategy'
+        )
+        self.stdout.write(f'{"strategy":>12} {"median":>8} {"mean":>8} {"min":>8} {"max":>8} {"missed":>7}')
+
+        for strategy in STRATEGIES:
+            results = [
+                self.simulate(strategy, options['seed'] + run, options)
+                for run in range(options['runs'])
+            ]
+            reached = [duels for duels in results if duels is not None]
+            missed = len(results) - len(reached)
+            if not reached:
+                self.stdout.write(f'{strategy:>12} {"-":>8} {"-":>8} {"-":>8} {"-":>8} {missed:>7}')
+                continue
+            self.stdout.write(
+                f'{strategy:>12} {statistics.median(reached):>8.0f} {statistics.mean(reached):>8.0f} '
+                f'{min(reached):>8} {max(reached):>8} {missed:>7}'
+            )
@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from core.management.scratch import scratch_database
+from core.models import Card, Duel, Participant, Profile
+from core.writer import record_vote
+import random
+import statistics
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Stress-tests vote ingestion with concurrent voter threads and reports throughput, '
+        'p50/p99 latency and errors for direct Duel.objects.create and the batched writer. '
+        'Runs against a temporary database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, nargs='+', default=[50, 200, 500], help='Concurrent voter counts.')
+        parser.add_argument('--votes', type=int, default=20, help='Votes per voter.')
+        parser.add_argument('--cards', type=int, default=100, help='Number of cards.')
+        parser.add_argument('--modes', nargs='+', choices=['direct', 'writer'], default=['direct', 'writer'])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def vote(self, mode, profile, winner, loser, judge):
+        if mode == 'direct':
+            Duel.objects.create(profile=profile, winner=winner, loser=loser, judge=judge)
+        else:
+            record_vote(profile, winner, loser, judge)
+
+    def run_level(self, mode, profile, cards, judges, options):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(len(judges))
+
+        def voter(judge, rng):
+            mine = []
+            failed = []
+            try:
+                start_barrier.wait()
+                for _ in range(options['votes']):
+                    winner, loser = rng.sample(cards, 2)
+                    start = time.perf_counter()
+                    try:
+                        self.vote(mode, profile, winner, loser, judge)
+                    except DatabaseError as error:
+                        failed.append(error)
+                    else:
+                        mine.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(mine)
+                    errors.extend(failed)
+
+        threads = [
+            threading.Thread(target=voter, args=(judge, random.Random(options['seed'] + i)))
+            for i, judge in enumerate(judges)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return latencies, errors, elapsed
+
+    def handle(self, *args, **options):
+        # The voters and their votes go into a throwaway database, not the project's
+        with scratch_database():
+            self.stress(options)
+
+    def stress(self, options):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0] if connection.vendor == 'sqlite' else '-'
+        self.stdout.write(f'{connection.vendor}, journal_mode={journal_mode}, {options["votes"]} votes per voter')
+        self.stdout.write(f'{"mode":>7} {"voters":>7} {"votes/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+
+        for voters in options['voters']:
+            profile = Profile.objects.create(name=f'Stress test ({voters} voters)')
+            judges = Participant.objects.bulk_create([
+                Participant(profile=profile, name=f'Voter {i}') for i in range(voters)
+            ])
+            cards = [Card.objects.create(profile=profile, answer=f'Card {i}') for i in range(options['cards'])]
+
+            for mode in options['modes']:
+                latencies, errors, elapsed = self.run_level(mode, profile, cards, judges, options)
+                if latencies:
+                    latencies.sort()
+                    p50 = statistics.median(latencies) * 1000
+                    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                    self.stdout.write(
+                        f'{mode:>7} {voters:>7} {len(latencies) / elapsed:>9.0f} {p50:>8.1f} {p99:>8.1f} {len(errors):>7}'
+                    )
+                else:
+                    self.stdout.write(f'{mode:>7} {voters:>7} {0:>9} {"-":>8} {"-":>8} {len(errors):>7}')
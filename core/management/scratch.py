@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+from django.db import connection
+import os
+import shutil
+import tempfile
+
+
+@contextmanager
+def scratch_database():
+    """
+    Points the default connection at a freshly migrated SQLite file in a
+    temporary directory for the duration of the block, and deletes it after.
+    Used by the benchmark commands, so the rows they seed never end up in the
+    project database. The connection options (journal mode, transaction mode)
+    stay the same, so the numbers hold for the real database.
+    """
+    directory = tempfile.mkdtemp()
+    test_settings = connection.settings_dict['TEST']
+    test_name = test_settings['NAME']
+    old_name = connection.settings_dict['NAME']
+    test_settings['NAME'] = os.path.join(directory, 'scratch.sqlite3')
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        test_settings['NAME'] = test_name
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,339 @@
+"""
+Background media processing.
+
+Converting a 12 MP HEIC photo takes seconds and a lot of memory, so uploads
+are stored as they arrive and the work (HEIC conversion, then the resized
+renditions served to phones; a poster frame for videos) is queued as MediaJob rows. A small
+thread pool per process drains the queue; jobs are claimed with a conditional
+UPDATE, so several processes can share the table without running a job twice.
+Cards stay 'pending' (and out of the ranking pools) until their jobs are done,
+and pages show a placeholder meanwhile.
+
+The pool is woken when a job is queued. A failed job is retried after a delay
+that doubles with every attempt. Jobs left behind by a crashed process are
+requeued after STALE_AFTER; `manage.py process_media` drains the queue from
+the command line.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from io import BytesIO
+from PIL import Image, ImageOps
+from .models import Card, MediaJob
+import os
+import subprocess
+import threading
+
+WORKERS = 2
+MAX_ATTEMPTS = 3
+
+# Delay before the second attempt of a failed job, doubled for every further one
+RETRY_DELAY = timedelta(seconds=30)
+
+# How long a job may stay running before it counts as abandoned
+STALE_AFTER = timedelta(minutes=10)
+
+CONVERTED_EXTENSIONS = ('.heic', '.heif')
+
+
+def needs_conversion(card):
+    return bool(card.image) and card.image.name.lower().endswith(CONVERTED_EXTENSIONS)
+
+
+def upload_jobs(card):
+    """
+    Kinds of the jobs to queue for a new card: HEIC uploads are converted
+    first (and get their renditions after), other images get renditions and
+    videos a poster frame.
+    """
+    if card.video:
+        return ['poster']
+    if not card.image:
+        return []
+    if needs_conversion(card):
+        return ['convert_heic']
+    return ['renditions']
+
+
+def convert_heic(card):
+    """
+    Re-encodes a HEIC upload as JPEG. The raw file is deleted once the card is saved.
+    """
+    raw_name = card.image.name
+    with card.image.open('rb') as raw:
+        image = Image.open(raw)
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG')
+    new_name = os.path.splitext(os.path.basename(raw_name))[0] + '.jpg'
+    card.image.save(new_name, ContentFile(buffer.getvalue()), save=False)
+    return [raw_name]
+
+
+# Rendition name -> maximum width; originals are never scaled up
+RENDITION_WIDTHS = {
+    'thumb': 160,
+    'medium': 800,
+    'large': 1600,
+}
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def render_renditions(card):
+    """
+    Stores a WebP and a JPEG of every rendition in the image directory and
+    records them in card.renditions. Returns the files of the renditions replaced.
+    """
+    with card.image.open('rb') as raw:
+        original = ImageOps.exif_transpose(Image.open(raw))
+        original = original.convert('RGB')
+
+    image_field = card._meta.get_field('image')
+    stem = os.path.splitext(os.path.basename(card.image.name))[0]
+    storage = card.image.storage
+    renditions = {}
+    for name, max_width in RENDITION_WIDTHS.items():
+        image = original.copy()
+        image.thumbnail((max_width, max_width * 4))
+        rendition = {'width': image.width}
+        for file_format, extension, options in (
+            ('webp', 'webp', {'quality': WEBP_QUALITY, 'method': 4}),
+            ('jpeg', 'jpg', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}),
+        ):
+            buffer = BytesIO()
+            image.save(buffer, format=file_format.upper(), **options)
+            path = image_field.generate_filename(card, f'{stem}.{name}.{extension}')
+            rendition[file_format] = storage.save(path, ContentFile(buffer.getvalue()))
+        renditions[name] = rendition
+
+    replaced = [
+        path
+        for rendition in card.renditions.values()
+        for file_format, path in rendition.items()
+        if file_format != 'width'
+    ]
+    card.renditions = renditions
+    return replaced
+
+
+# Where in the video the poster frame is taken from, in seconds; clips shorter than this get their first frame
+POSTER_OFFSET = 0.5
+POSTER_TIMEOUT = 60
+
+
+def ffmpeg_poster(path):
+    """
+    The default poster extractor: a JPEG of the frame at POSTER_OFFSET (or the
+    first frame of shorter clips), or None when ffmpeg is not installed.
+    """
+    for offset in (POSTER_OFFSET, 0):
+        command = [
+            'ffmpeg', '-v', 'error', '-ss', str(offset), '-i', path,
+            '-frames:v', '1', '-f', 'image2', '-c:v', 'mjpeg', 'pipe:1',
+        ]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=POSTER_TIMEOUT, check=True)
+        except FileNotFoundError:
+            return None
+        # Seeking past the end of the clip outputs nothing
+        if result.stdout:
+            return result.stdout
+    raise ValueError(f'No frame could be read from {path}.')
+
+
+def extract_poster(card):
+    """
+    Stores a poster frame of the card's video, taken by the function named by
+    settings.POSTER_EXTRACTOR (path of the video -> JPEG bytes or None).
+    Returns the poster replaced.
+    """
+    extractor = import_string(getattr(settings, 'POSTER_EXTRACTOR', 'core.media.ffmpeg_poster'))
+    data = extractor(card.video.path)
+    if not data:
+        return []
+    replaced = [card.poster.name] if card.poster else []
+    stem = os.path.splitext(os.path.basename(card.video.name))[0]
+    card.poster.save(f'{stem}.jpg', ContentFile(data), save=False)
+    return replaced
+
+
+# Job kind -> function(card) processing it and returning files to delete once the card is saved
+HANDLERS = {
+    'convert_heic': convert_heic,
+    'renditions': render_renditions,
+    'poster': extract_poster,
+}
+
+# Jobs queued once a job of the key kind has succeeded
+FOLLOW_UPS = {
+    'convert_heic': ['renditions'],
+}
+
+# Kinds the card cannot be shown without; it stays pending (or fails) with them.
+# Without renditions the templates fall back to the original, without a poster the video's first frame.
+BLOCKING = {'convert_heic'}
+
+
+def enqueue(card, kind):
+    """
+    Queues a job for a saved card; the workers are woken once it commits.
+    """
+    job = MediaJob.objects.create(card=card, kind=kind)
+    transaction.on_commit(processor.wake)
+    return job
+
+
+def requeue_stale():
+    """
+    Puts jobs that have been running for longer than STALE_AFTER back in the queue.
+    """
+    return MediaJob.objects.filter(status='running', updated_at__lt=timezone.now() - STALE_AFTER).update(
+        status='queued', updated_at=timezone.now()
+    )
+
+
+def due_jobs():
+    return MediaJob.objects.filter(status='queued', run_after__lte=timezone.now())
+
+
+def claim_next():
+    """
+    Marks the oldest queued job running and returns it, or None when the queue is empty.
+    """
+    while True:
+        job_id = due_jobs().order_by('created_at', 'id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = MediaJob.objects.filter(id=job_id, status='queued').update(
+            status='running', attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        if claimed:
+            job = MediaJob.objects.select_related('card').filter(id=job_id).first()
+            if job is not None:
+                return job
+            # Deleted with its card right after it was claimed
+        # Claimed by another worker in the meantime
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its outcome on the job and the card.
+    """
+    card = job.card
+    stored = set(card.media_files())
+    try:
+        obsolete = HANDLERS[job.kind](card)
+    except Exception as error:
+        fail(job, error)
+        return False
+
+    try:
+        with transaction.atomic():
+            exists = Card.objects.filter(id=card.id).exists()
+            if exists:
+                MediaJob.objects.filter(id=job.id).update(status='done', error='', updated_at=timezone.now())
+                for kind in FOLLOW_UPS.get(job.kind, []):
+                    enqueue(card, kind)
+                pending = card.media_jobs.filter(status__in=['queued', 'running'], kind__in=BLOCKING).exists()
+                if not pending:
+                    card.processing_status = 'ready'
+                # Saving bumps the profile's data version, refreshing pages and ranking pools
+                card.save(update_fields=['image', 'video', 'poster', 'renditions', 'processing_status'])
+    except DatabaseError as error:
+        # E.g. "database is locked": nothing was recorded, so drop what the job wrote and retry it
+        for name in card.media_files():
+            if name not in stored:
+                card.image.storage.delete(name)
+        fail(job, error)
+        return False
+    if not exists:
+        # Deleted while processing, which released the files it had; drop what the job wrote
+        obsolete = [name for name in card.media_files() if name not in stored]
+    for name in obsolete:
+        card.image.storage.delete(name)
+    return True
+
+
+def fail(job, error):
+    """
+    Queues a failed job again after its retry delay, or after MAX_ATTEMPTS
+    marks it failed, along with the card if the job blocks it.
+    """
+    jobs = MediaJob.objects.filter(id=job.id)
+    if job.attempts < MAX_ATTEMPTS:
+        delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+        jobs.update(status='queued', error=repr(error), run_after=timezone.now() + delay, updated_at=timezone.now())
+        processor.wake_later(delay)
+    else:
+        jobs.update(status='failed', error=repr(error), updated_at=timezone.now())
+        if job.kind in BLOCKING:
+            Card.objects.filter(id=job.card_id).update(processing_status='failed')
+
+
+def process_pending():
+    """
+    Runs queued jobs until none is due. Returns the number of jobs run.
+    """
+    count = 0
+    while (job := claim_next()) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+class MediaProcessor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._draining = 0
+
+    def wake(self):
+        """
+        Starts a drain of the queue on the pool unless every worker is already draining.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='media')
+                self._executor.submit(self._requeue_stale)
+            if self._draining >= WORKERS:
+                return
+            self._draining += 1
+        self._executor.submit(self._drain)
+
+    def wake_later(self, delay):
+        timer = threading.Timer(delay.total_seconds(), self.wake)
+        timer.daemon = True
+        timer.start()
+
+    def _requeue_stale(self):
+        try:
+            if requeue_stale():
+                self.wake()
+        finally:
+            connection.close()
+
+    def _drain(self):
+        queued = False
+        try:
+            try:
+                process_pending()
+            finally:
+                with self._lock:
+                    self._draining -= 1
+            # A job queued while every worker was finishing would otherwise wait for the next wake
+            queued = due_jobs().exists()
+        except DatabaseError:
+            # E.g. "database is locked" while claiming; a job claimed by then is requeued once stale
+            self.wake_later(RETRY_DELAY)
+        finally:
+            connection.close()
+        if queued:
+            self.wake()
+
+processor = MediaProcessor()
@@ -0,0 +1,91 @@
+"""
+Per-request query and latency accounting.
+
+QueryTimingMiddleware records how many SQL queries a request ran, how long
+they took and how much time was spent in Python, and reports it in a
+Server-Timing header (visible in the browser's network panel):
+
+    Server-Timing: db;dur=12.3;desc="14 queries", app;dur=40.1, total;dur=52.4
+
+QueryRecorder does the recording and is also used by the query budget tests.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from contextlib import ExitStack
+import time
+
+
+class QueryRecorder:
+    """
+    Context manager counting the queries run on every database connection of
+    the current thread, and their total duration.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.total_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total_time = time.perf_counter() - self._start
+        self._stack.close()
+
+    @property
+    def python_time(self):
+        return self.total_time - self.sql_time
+
+    def server_timing(self):
+        return (
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries", '
+            f'app;dur={self.python_time * 1000:.1f}, '
+            f'total;dur={self.total_time * 1000:.1f}'
+        )
+
+
+class QueryTimingMiddleware:
+    """
+    Adds the Server-Timing header when settings.SERVER_TIMING is on (default: DEBUG).
+    Async requests (the dashboard stream) only report their total time, as
+    their queries run in other threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'SERVER_TIMING', settings.DEBUG)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        response['Server-Timing'] = recorder.server_timing()
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        if self.enabled:
+            response['Server-Timing'] = f'total;dur={(time.perf_counter() - start) * 1000:.1f}'
+        return response
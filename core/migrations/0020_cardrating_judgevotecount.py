@@ -0,0 +1,97 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+INITIAL_RATING = 1200.0
+K_FACTOR = 32
+
+
+def calculate_elo(cards, duels):
+    """
+    Frozen copy of core.utils.calculate_elo as of this migration, so the
+    backfill replays the same way however the live code changes later.
+    Vote Volume Normalization uses the judge counts known when each vote is cast.
+    """
+    ratings = {card.id: {'rating': INITIAL_RATING, 'won': 0, 'lost': 0} for card in cards}
+    judge_counts = {}
+    total_votes = 0
+
+    for duel in duels:
+        current_k = K_FACTOR
+        if duel.judge_id:
+            judge_counts[duel.judge_id] = judge_counts.get(duel.judge_id, 0) + 1
+            total_votes += 1
+            avg_votes = total_votes / len(judge_counts)
+            weight = avg_votes / judge_counts[duel.judge_id]
+            current_k = K_FACTOR * max(0.5, min(weight, 2.5))
+
+        winner_id = duel.winner_id
+        loser_id = duel.loser_id
+        if winner_id not in ratings or loser_id not in ratings:
+            continue
+
+        ratings[winner_id]['won'] += 1
+        ratings[loser_id]['lost'] += 1
+
+        w_curr = ratings[winner_id]['rating']
+        l_curr = ratings[loser_id]['rating']
+        expected_winner = 1 / (1 + 10 ** ((l_curr - w_curr) / 400))
+        expected_loser = 1 / (1 + 10 ** ((w_curr - l_curr) / 400))
+        ratings[winner_id]['rating'] += current_k * (1 - expected_winner)
+        ratings[loser_id]['rating'] += current_k * (0 - expected_loser)
+
+    return ratings
+
+
+def backfill_ratings(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    Card = apps.get_model('core', 'Card')
+    Duel = apps.get_model('core', 'Duel')
+    CardRating = apps.get_model('core', 'CardRating')
+    JudgeVoteCount = apps.get_model('core', 'JudgeVoteCount')
+
+    for profile in Profile.objects.all():
+        cards = Card.objects.filter(profile=profile)
+        duels = Duel.objects.filter(winner__profile=profile).order_by('created_at', 'id')
+        ratings = calculate_elo(cards, duels)
+        CardRating.objects.bulk_create([
+            CardRating(card_id=card_id, profile=profile, rating=r['rating'], won=r['won'], lost=r['lost'])
+            for card_id, r in ratings.items()
+        ])
+        judge_counts = duels.filter(judge__isnull=False).order_by().values_list('judge_id').annotate(votes=Count('id'))
+        JudgeVoteCount.objects.bulk_create([
+            JudgeVoteCount(judge_id=judge_id, profile=profile, votes=votes)
+            for judge_id, votes in judge_counts
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_profile_random_prompts_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardRating',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='core.card')),
+                ('rating', models.FloatField(default=1200.0)),
+                ('won', models.PositiveIntegerField(default=0)),
+                ('lost', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_ratings', to='core.profile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JudgeVoteCount',
+            fields=[
+                ('judge', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vote_count', serialize=False, to='core.participant')),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='judge_vote_counts', to='core.profile')),
+            ],
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
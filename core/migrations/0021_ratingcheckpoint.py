@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_cardrating_judgevotecount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duel_count', models.PositiveIntegerField()),
+                ('last_duel_id', models.PositiveBigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('state', models.BinaryField()),
+                ('trace', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_checkpoints', to='core.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'duel_count')},
+            },
+        ),
+    ]
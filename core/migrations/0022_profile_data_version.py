@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_ratingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text="Bumped on every write to the profile's cards, duels and participants."),
+        ),
+    ]
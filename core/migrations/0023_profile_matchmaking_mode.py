@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_profile_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='matchmaking_mode',
+            field=models.CharField(choices=[('win_rate', 'Vinnerandel'), ('information', 'Informasjonsgevinst')], default='win_rate', help_text='How ranking pairs are picked. Information gain reaches a stable ranking with fewer votes.', max_length=20),
+        ),
+    ]
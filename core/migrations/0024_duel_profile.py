@@ -0,0 +1,55 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_duel_profile(apps, schema_editor):
+    Card = apps.get_model('core', 'Card')
+    Duel = apps.get_model('core', 'Duel')
+    Duel.objects.filter(profile__isnull=True).update(
+        profile_id=Subquery(Card.objects.filter(id=OuterRef('winner_id')).values('profile_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_profile_matchmaking_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='duel',
+            name='profile',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='duels', to='core.profile'),
+        ),
+        migrations.RunPython(backfill_duel_profile, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='duel',
+            name='loser',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='lost_duels', to='core.card'),
+        ),
+        migrations.AlterField(
+            model_name='duel',
+            name='winner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='won_duels', to='core.card'),
+        ),
+        migrations.AddIndex(
+            model_name='duel',
+            index=models.Index(fields=['profile', 'created_at'], name='core_duel_profile_4b6899_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duel',
+            index=models.Index(fields=['profile', 'judge'], name='core_duel_profile_b5ec62_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duel',
+            index=models.Index(fields=['winner', 'created_at'], name='core_duel_winner__217e0f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duel',
+            index=models.Index(fields=['loser', 'created_at'], name='core_duel_loser_i_0ea709_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_duel_profile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cardrating',
+            index=models.Index(fields=['profile', 'rating'], name='core_cardra_profile_fd73a4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cardrating',
+            index=models.Index(fields=['profile', 'won'], name='core_cardra_profile_06cd3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cardrating',
+            index=models.Index(fields=['profile', 'lost'], name='core_cardra_profile_43087b_idx'),
+        ),
+    ]
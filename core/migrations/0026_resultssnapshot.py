@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_cardrating_leaderboard_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(help_text="'all', 'men', 'women' or a participant id.", max_length=20)),
+                ('data_version', models.PositiveBigIntegerField(help_text='Profile data version the snapshot was built from.')),
+                ('entries', models.JSONField(default=list, help_text='[card_id, rating] pairs in display order.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results_snapshots', to='core.profile')),
+            ],
+            options={
+                'unique_together': {('profile', 'segment')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_resultssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prompt_assignments', to='core.participant')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prompt_assignments', to='core.profile')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='core.prompt')),
+            ],
+        ),
+    ]
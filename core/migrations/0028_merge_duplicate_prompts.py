@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:52
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_prompts(apps, schema_editor):
+    """
+    Keeps the oldest of each set of prompts with the same text and points the
+    cards and assignments of the others at it, so the unique index can be built.
+    """
+    Card = apps.get_model('core', 'Card')
+    Prompt = apps.get_model('core', 'Prompt')
+    PromptAssignment = apps.get_model('core', 'PromptAssignment')
+    duplicates = Prompt.objects.values('text').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for row in duplicates:
+        others = Prompt.objects.filter(text=row['text']).exclude(id=row['keep'])
+        Card.objects.filter(prompt__in=others).update(prompt_id=row['keep'])
+        PromptAssignment.objects.filter(prompt__in=others).update(prompt_id=row['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_promptassignment'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_prompts, migrations.RunPython.noop),
+    ]
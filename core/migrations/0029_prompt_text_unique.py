@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_merge_duplicate_prompts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='prompt',
+            name='text',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_prompt_text_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='processing_status',
+            field=models.CharField(choices=[('ready', 'Klar'), ('pending', 'Behandles'), ('failed', 'Feilet')], default='ready', help_text='Uploads needing conversion (HEIC) are pending until the media queue has processed them.', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='MediaJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('convert_heic', 'HEIC til JPEG')], max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'I kø'), ('running', 'Kjører'), ('done', 'Ferdig'), ('failed', 'Feilet')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_jobs', to='core.card')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='core_mediaj_status_c78256_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_media_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, help_text="Resized copies of the image by name ('thumb', 'medium', 'large'): width and WebP/JPEG file names."),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='kind',
+            field=models.CharField(choices=[('convert_heic', 'HEIC til JPEG'), ('renditions', 'Miniatyrer og størrelser')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_card_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='poster',
+            field=models.ImageField(blank=True, help_text='A frame of the video, shown until it is played.', null=True, upload_to='card_posters/'),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='kind',
+            field=models.CharField(choices=[('convert_heic', 'HEIC til JPEG'), ('renditions', 'Miniatyrer og størrelser'), ('poster', 'Forhåndsbilde av video')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:02
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_card_poster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('field', models.CharField(choices=[('image', 'Bilde'), ('video', 'Video')], max_length=10)),
+                ('file_name', models.CharField(help_text='Storage name of the file the chunks are written to.', max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('offset', models.PositiveBigIntegerField(default=0, help_text='Bytes received so far.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to='core.profile')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to='core.participant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='core_chunke_updated_31d63d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, help_text="The profile's earlier card with exactly the same upload.", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='core.card'),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='upload_digest',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the image or video as uploaded.', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['profile', 'upload_digest'], name='core_card_profile_02d3cf_idx'),
+        ),
+    ]
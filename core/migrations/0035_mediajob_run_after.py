@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediajob',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_mediajob_run_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='card',
+            field=models.ForeignKey(blank=True, help_text='The card created by finishing the upload.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.card'),
+        ),
+    ]
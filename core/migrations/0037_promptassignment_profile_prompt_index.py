@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_chunkedupload_card'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='promptassignment',
+            index=models.Index(fields=['profile', 'prompt'], name='core_prompt_profile_22c599_idx'),
+        ),
+    ]
@@ -1,32 +1,54 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 import random
 import string
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
+import uuid
 import pillow_heif
 
+# Lets Pillow open HEIC uploads, both when forms validate them and in core.media
 pillow_heif.register_heif_opener()
 
 class Prompt(models.Model):
-    text = models.CharField(max_length=255)
+    text = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.text
 
 class Profile(models.Model):
+    MATCHMAKING_CHOICES = [
+        ('win_rate', 'Vinnerandel'),
+        ('information', 'Informasjonsgevinst'),
+    ]
     name = models.CharField(max_length=100)
     password = models.CharField(max_length=128, blank=True, help_text="Leave blank to auto-generate an 8-letter password.") 
     results_available = models.BooleanField(default=False, help_text="Check this to reveal the results buttons to users.")
     voting_enabled = models.BooleanField(default=True, help_text="Check this to enable voting and card submission for this profile.")
     random_prompts_mode = models.BooleanField(default=False, help_text="If checked, participants will be assigned a random prompt instead of choosing.")
+    matchmaking_mode = models.CharField(max_length=20, choices=MATCHMAKING_CHOICES, default='win_rate', help_text="How ranking pairs are picked. Information gain reaches a stable ranking with fewer votes.")
+    data_version = models.PositiveBigIntegerField(default=0, editable=False, help_text="Bumped on every write to the profile's cards, duels and participants.")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
         if not self.password:
             self.password = ''.join(random.choices(string.ascii_lowercase, k=8))
+        if self._state.adding or 'update_fields' in kwargs:
+            super().save(*args, **kwargs)
+            return
+        revealed = self.results_available and Profile.objects.filter(pk=self.pk, results_available=False).exists()
+        # Never write back a stale data_version; count the edit as a change instead
+        kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'data_version']
         super().save(*args, **kwargs)
+        Profile.bump_data_version(self.pk)
+        if revealed:
+            # Materialize the results before the guests open them
+            from .results import refresh_snapshots
+            transaction.on_commit(lambda: refresh_snapshots(self.pk))
+
+    @staticmethod
+    def bump_data_version(profile_id):
+        if profile_id is not None:
+            Profile.objects.filter(pk=profile_id).update(data_version=models.F('data_version') + 1)
 
     def __str__(self):
         return self.name
@@ -49,33 +71,335 @@ class Participant(models.Model):
         return f"{self.name} ({self.profile.name})"
 
 class Card(models.Model):
+    PROCESSING_CHOICES = [
+        ('ready', 'Klar'),
+        ('pending', 'Behandles'),
+        ('failed', 'Feilet'),
+    ]
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='cards', null=True)
     uploader = models.ForeignKey(Participant, on_delete=models.SET_NULL, null=True, blank=True, related_name='cards')
     image = models.ImageField(upload_to='card_images/', blank=True, null=True)
     video = models.FileField(upload_to='card_videos/', blank=True, null=True)
+    poster = models.ImageField(upload_to='card_posters/', blank=True, null=True, help_text="A frame of the video, shown until it is played.")
     prompt = models.ForeignKey(Prompt, on_delete=models.SET_NULL, null=True, blank=True)
     answer = models.TextField(blank=True, null=True)
+    renditions = models.JSONField(default=dict, blank=True, help_text="Resized copies of the image by name ('thumb', 'medium', 'large'): width and WebP/JPEG file names.")
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='ready', help_text="Uploads needing conversion (HEIC) are pending until the media queue has processed them.")
+    upload_digest = models.CharField(max_length=64, blank=True, editable=False, help_text="SHA-256 of the image or video as uploaded.")
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates', help_text="The profile's earlier card with exactly the same upload.")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', 'upload_digest']),
+        ]
+
     def save(self, *args, **kwargs):
-        if self.image and self.image.name.lower().endswith('.heic'):
-            image = Image.open(self.image)
-            image = image.convert('RGB')
-            buffer = BytesIO()
-            image.save(buffer, format="JPEG")
-            new_name = self.image.name.lower().replace('.heic', '.jpg')
-            self.image.save(new_name, ContentFile(buffer.getvalue()), save=False)
-        super().save(*args, **kwargs)
+        from .media import enqueue, needs_conversion, upload_jobs
+
+        adding = self._state.adding
+        # HEIC conversion and resizing happen in the background (core.media); the upload is stored as is
+        convert = adding and needs_conversion(self)
+        if convert:
+            self.processing_status = 'pending'
+        # Hashing and copying the upload happen before the transaction, which
+        # holds the SQLite write lock (see settings.py)
+        stored = self.store_upload() if adding else None
+        try:
+            with transaction.atomic():
+                if adding:
+                    self.find_duplicate()
+                super().save(*args, **kwargs)
+                if adding and self.profile_id:
+                    CardRating.objects.get_or_create(card=self, defaults={'profile_id': self.profile_id})
+                if adding:
+                    for kind in upload_jobs(self):
+                        enqueue(self, kind)
+        except BaseException:
+            if stored:
+                # No card refers to the stored file; a blob no other card uses is deleted
+                (self.image or self.video).storage.delete(stored)
+            raise
+
+    def store_upload(self):
+        """
+        Stores the uploaded file ahead of the row, as saving would, and records
+        its digest (the storage names files by it, see core.storage). Returns
+        the name stored under, or None when there was nothing new to store.
+        """
+        from .storage import digest_of
+
+        upload = self.image or self.video
+        if not upload:
+            return None
+        stored = None
+        if not upload._committed:
+            upload.save(upload.name, upload.file, save=False)
+            stored = upload.name
+        self.upload_digest = digest_of(upload.name)
+        return stored
+
+    def find_duplicate(self):
+        """
+        Flags the card as a duplicate when the profile already has a card with
+        the same content.
+        """
+        if self.upload_digest and self.profile_id and self.duplicate_of_id is None:
+            self.duplicate_of_id = Card.objects.filter(
+                profile_id=self.profile_id, upload_digest=self.upload_digest
+            ).order_by('id').values_list('id', flat=True).first()
+
+    @property
+    def media_ready(self):
+        return self.processing_status == 'ready'
+
+    def media_files(self):
+        """
+        Names of every stored file of the card: the original, its renditions and the video poster.
+        """
+        files = [field.name for field in (self.image, self.video, self.poster) if field]
+        for rendition in self.renditions.values():
+            files += [rendition['webp'], rendition['jpeg']]
+        return files
+
+    def rendition_url(self, name, file_format='jpeg'):
+        """
+        URL of a rendition ('thumb', 'medium' or 'large'), or of the original
+        image while the renditions have not been made.
+        """
+        rendition = self.renditions.get(name)
+        if rendition is None:
+            return self.image.url if self.image else None
+        return self.image.storage.url(rendition[file_format])
+
+    def srcset(self, file_format='jpeg'):
+        widths = {}
+        for rendition in self.renditions.values():
+            # Small originals give several renditions of the same width
+            widths.setdefault(rendition['width'], rendition[file_format])
+        return ', '.join(f'{self.image.storage.url(path)} {width}w' for width, path in sorted(widths.items()))
+
+    @property
+    def thumb_url(self):
+        return self.rendition_url('thumb')
+
+    @property
+    def medium_url(self):
+        return self.rendition_url('medium')
+
+    @property
+    def large_url(self):
+        return self.rendition_url('large')
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset('jpeg')
+
+    @property
+    def webp_srcset(self):
+        return self.srcset('webp')
 
     def __str__(self):
         prompt_text = self.prompt.text if self.prompt else "No Prompt"
-        return f"{self.uploader.name} - {prompt_text}: {self.answer}"
+        uploader_name = self.uploader.name if self.uploader else "Anonym"
+        return f"{uploader_name} - {prompt_text}: {self.answer}"
 
 class Duel(models.Model):
-    winner = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='won_duels')
-    loser = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='lost_duels')
+    # Denormalized from winner.profile so per-profile queries skip the join through Card.
+    # Profile, winner and loser are indexed by the composite indexes below.
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='duels', null=True, editable=False, db_index=False)
+    winner = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='won_duels', db_index=False)
+    loser = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='lost_duels', db_index=False)
     judge = models.ForeignKey(Participant, on_delete=models.SET_NULL, null=True, blank=True, related_name='judged_duels')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', 'created_at']),
+            models.Index(fields=['profile', 'judge']),
+            models.Index(fields=['winner', 'created_at']),
+            models.Index(fields=['loser', 'created_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .ratings import record_duel
+
+        adding = self._state.adding
+        if self.profile_id is None:
+            self.profile_id = self.winner.profile_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                record_duel(self)
+
     def __str__(self):
         return f"Winner: {self.winner.id} vs Loser: {self.loser.id}"
+
+class CardRating(models.Model):
+    """
+    Persisted ELO state of a card, kept up to date by Duel.save.
+    Rebuild with `manage.py rebuild_ratings` when the weighting rules change.
+    """
+    card = models.OneToOneField(Card, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='card_ratings')
+    rating = models.FloatField(default=1200.0)
+    won = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Leaderboard orders (see core.leaderboard)
+        indexes = [
+            models.Index(fields=['profile', 'rating']),
+            models.Index(fields=['profile', 'won']),
+            models.Index(fields=['profile', 'lost']),
+        ]
+
+    def __str__(self):
+        return f"{self.card_id}: {self.rating:.0f} ({self.won}-{self.lost})"
+
+class JudgeVoteCount(models.Model):
+    """
+    Number of votes a participant has cast, used for Vote Volume Normalization.
+    """
+    judge = models.OneToOneField(Participant, on_delete=models.CASCADE, primary_key=True, related_name='vote_count')
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='judge_vote_counts')
+    votes = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.judge_id}: {self.votes}"
+
+class RatingCheckpoint(models.Model):
+    """
+    Rating state of a profile after its first `duel_count` duels, so replays only
+    have to process the duels after it. Written and read by core.checkpoints.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='rating_checkpoints')
+    duel_count = models.PositiveIntegerField()
+    last_duel_id = models.PositiveBigIntegerField()
+    last_created_at = models.DateTimeField()
+    state = models.BinaryField()
+    trace = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('profile', 'duel_count')
+
+    def __str__(self):
+        return f"{self.profile_id} @ {self.duel_count}"
+
+class ResultsSnapshot(models.Model):
+    """
+    Materialized final_results list of one filter segment, built by core.results
+    when the results are revealed and refreshed while votes keep arriving.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='results_snapshots')
+    segment = models.CharField(max_length=20, help_text="'all', 'men', 'women' or a participant id.")
+    data_version = models.PositiveBigIntegerField(help_text="Profile data version the snapshot was built from.")
+    entries = models.JSONField(default=list, help_text="[card_id, rating] pairs in display order.")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('profile', 'segment')
+
+    def __str__(self):
+        return f"{self.profile_id} ({self.segment}) @ {self.data_version}"
+
+class PromptAssignment(models.Model):
+    """
+    A prompt handed to a participant in random prompts mode. The unanswered one
+    is shown on GET and answered on POST; all of them together are the prompts
+    the participant and the profile have used. Managed by core.prompts.
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='prompt_assignments')
+    participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='prompt_assignments')
+    prompt = models.ForeignKey(Prompt, on_delete=models.CASCADE, related_name='assignments')
+    answered_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Whether a drawn prompt is used in the profile (see core.prompts)
+        indexes = [
+            models.Index(fields=['profile', 'prompt']),
+        ]
+
+    def __str__(self):
+        return f"{self.participant_id}: {self.prompt_id}"
+
+class MediaJob(models.Model):
+    """
+    A queued media processing step for a card, run by the background workers in
+    core.media. Jobs left running by a crashed process are requeued.
+    """
+    KIND_CHOICES = [
+        ('convert_heic', 'HEIC til JPEG'),
+        ('renditions', 'Miniatyrer og størrelser'),
+        ('poster', 'Forhåndsbilde av video'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'I kø'),
+        ('running', 'Kjører'),
+        ('done', 'Ferdig'),
+        ('failed', 'Feilet'),
+    ]
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='media_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # A failed attempt is retried no earlier than this
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for card {self.card_id} ({self.status})"
+
+class Blob(models.Model):
+    """
+    A file of the content-addressed media storage (core.storage), stored once
+    under the digest of its content. refcount counts the saves referencing it;
+    the file is deleted when it drops to zero.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload (see core.uploads). Chunks are appended to file_name,
+    which becomes the card's file once the upload is finished; the finished
+    upload keeps pointing to its card, so a retried finish gets the same card.
+    Uploads idle for longer than core.uploads.UPLOAD_EXPIRY are deleted with their file.
+    """
+    FIELD_CHOICES = [
+        ('image', 'Bilde'),
+        ('video', 'Video'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='chunked_uploads')
+    uploader = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='chunked_uploads')
+    field = models.CharField(max_length=10, choices=FIELD_CHOICES)
+    file_name = models.CharField(max_length=255, help_text="Storage name of the file the chunks are written to.")
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0, help_text="Bytes received so far.")
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, null=True, blank=True, related_name='+', help_text="The card created by finishing the upload.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name}: {self.offset}/{self.size}"
@@ -0,0 +1,103 @@
+"""
+Random prompt assignment for profiles in random prompts mode.
+
+Draws pick uniformly from a cached array of all prompt ids, so they cost O(1)
+instead of loading the prompt table. The drawn prompt is persisted as the
+participant's PromptAssignment, so the POST answers the prompt the GET showed.
+Draws avoid prompts already handed out in the profile, then prompts the
+participant has had, by rejection sampling with an indexed lookup per drawn
+prompt; only when most prompts are used up are the used prompts loaded and the
+array scanned for the remaining ones.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Prompt, PromptAssignment
+import random
+
+PROMPT_IDS_CACHE_KEY = 'prompt-ids'
+
+# Random draws tried before falling back to scanning for unused prompts
+REJECTION_TRIES = 16
+
+
+def prompt_ids():
+    """
+    Ids of all prompts, cached until a prompt is added or deleted (see core.signals).
+    """
+    ids = cache.get(PROMPT_IDS_CACHE_KEY)
+    if ids is None:
+        ids = list(Prompt.objects.order_by('id').values_list('id', flat=True))
+        cache.set(PROMPT_IDS_CACHE_KEY, ids, None)
+    return ids
+
+
+def invalidate_prompt_ids():
+    cache.delete(PROMPT_IDS_CACHE_KEY)
+
+
+def draw_prompt_id(ids, is_used, used_ids, rng=random):
+    """
+    A uniformly random id of `ids` for which `is_used(id)` is false, or None.
+    Random ids are tried first; only when they keep hitting used ones is
+    `used_ids()` called for the whole set, to scan the ids for the rest.
+    """
+    for _ in range(REJECTION_TRIES):
+        prompt_id = rng.choice(ids)
+        if not is_used(prompt_id):
+            return prompt_id
+    used = used_ids()
+    remaining = [prompt_id for prompt_id in ids if prompt_id not in used]
+    if remaining:
+        return rng.choice(remaining)
+    return None
+
+
+def assign_prompt(profile, participant, rng=random):
+    """
+    The participant's unanswered assignment, or a newly drawn one. Returns
+    None when there are no prompts.
+    """
+    assignment = (
+        PromptAssignment.objects
+        .filter(participant=participant, answered_at__isnull=True)
+        .select_related('prompt')
+        .order_by('-created_at')
+        .first()
+    )
+    if assignment is not None:
+        return assignment
+
+    ids = prompt_ids()
+    if not ids:
+        return None
+
+    # Candidates are checked one at a time against the (profile, prompt) index
+    used_in_profile = PromptAssignment.objects.filter(profile=profile)
+    used_by_participant = used_in_profile.filter(participant=participant)
+    prompt_id = draw_prompt_id(
+        ids,
+        lambda prompt_id: used_in_profile.filter(prompt_id=prompt_id).exists(),
+        lambda: set(used_in_profile.values_list('prompt_id', flat=True)),
+        rng,
+    )
+    if prompt_id is None:
+        prompt_id = draw_prompt_id(
+            ids,
+            lambda prompt_id: used_by_participant.filter(prompt_id=prompt_id).exists(),
+            lambda: set(used_by_participant.values_list('prompt_id', flat=True)),
+            rng,
+        )
+    if prompt_id is None:
+        prompt_id = rng.choice(ids)
+
+    prompt = Prompt.objects.filter(id=prompt_id).first()
+    if prompt is None:
+        # Deleted since the ids were cached
+        invalidate_prompt_ids()
+        return assign_prompt(profile, participant, rng)
+    return PromptAssignment.objects.create(profile=profile, participant=participant, prompt=prompt)
+
+
+def mark_answered(assignment):
+    assignment.answered_at = timezone.now()
+    assignment.save(update_fields=['answered_at'])
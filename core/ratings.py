@@ -0,0 +1,166 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .elo import replay_segments
+from .models import Card, CardRating, Duel, JudgeVoteCount, Profile, RatingCheckpoint
+from .singleflight import single_flight
+from .utils import calculate_elo, elo_delta, judge_weight, INITIAL_RATING, K_FACTOR
+
+SEGMENT_CACHE_TIMEOUT = 60 * 60
+
+
+def get_ratings(profile):
+    """
+    Reads the persisted ratings of a profile with a single query.
+    Returns a dictionary: {card_id: {'rating': float, 'won': int, 'lost': int}}
+    """
+    rows = CardRating.objects.filter(profile=profile).values_list('card_id', 'rating', 'won', 'lost')
+    return {
+        card_id: {'rating': rating, 'won': won, 'lost': lost}
+        for card_id, rating, won, lost in rows
+    }
+
+def get_rating(card):
+    """
+    Persisted rating state of a single card, falling back to an unrated card.
+    """
+    row = CardRating.objects.filter(card=card).values('rating', 'won', 'lost').first()
+    return row or {'rating': INITIAL_RATING, 'won': 0, 'lost': 0}
+
+def record_duel(duel):
+    """
+    Applies a newly created duel to the persisted ratings.
+    Called from Duel.save inside the transaction that inserts the duel, so the
+    duel and the rating update are committed together.
+    """
+    record_duels([duel])
+
+def record_duels(duels):
+    """
+    Applies newly created duels, in order, to the persisted ratings with a
+    fixed number of queries. Must run inside the transaction that inserts them.
+    Gives the same ratings as recording the duels one by one.
+    """
+    card_ids = {card_id for duel in duels for card_id in (duel.winner_id, duel.loser_id)}
+    judge_ids = {duel.judge_id for duel in duels if duel.judge_id}
+    profile_ids = {duel.profile_id for duel in duels}
+
+    states = {
+        state.card_id: state
+        for state in CardRating.objects.select_for_update().filter(card_id__in=card_ids)
+    }
+    counters = {
+        counter.judge_id: counter
+        for counter in JudgeVoteCount.objects.select_for_update().filter(judge_id__in=judge_ids)
+    }
+    totals = {profile_id: [0, 0] for profile_id in profile_ids}
+    rows = (
+        JudgeVoteCount.objects.filter(profile_id__in=profile_ids)
+        .values_list('profile_id').annotate(total_votes=Sum('votes'), judge_total=Count('pk'))
+    )
+    for profile_id, total_votes, judge_total in rows:
+        totals[profile_id] = [total_votes, judge_total]
+
+    new_states = []
+    new_counters = []
+    for duel in duels:
+        # Calculate Dynamic K-Factor from the votes seen so far
+        current_k = K_FACTOR
+        if duel.judge_id:
+            counter = counters.get(duel.judge_id)
+            if counter is None:
+                counter = counters[duel.judge_id] = JudgeVoteCount(judge_id=duel.judge_id, profile_id=duel.profile_id)
+                new_counters.append(counter)
+                totals[duel.profile_id][1] += 1
+            counter.votes += 1
+            totals[duel.profile_id][0] += 1
+            total_votes, judge_total = totals[duel.profile_id]
+            current_k = K_FACTOR * judge_weight(counter.votes, total_votes, judge_total)
+
+        for card_id in (duel.winner_id, duel.loser_id):
+            if card_id not in states:
+                states[card_id] = CardRating(card_id=card_id, profile_id=duel.profile_id)
+                new_states.append(states[card_id])
+
+        winner = states[duel.winner_id]
+        loser = states[duel.loser_id]
+
+        winner.won += 1
+        loser.lost += 1
+
+        w_delta, l_delta = elo_delta(winner.rating, loser.rating, current_k)
+        winner.rating += w_delta
+        loser.rating += l_delta
+
+    now = timezone.now()
+    for state in states.values():
+        state.updated_at = now
+    CardRating.objects.bulk_update([s for s in states.values() if not s._state.adding], ['rating', 'won', 'lost', 'updated_at'])
+    CardRating.objects.bulk_create(new_states)
+    JudgeVoteCount.objects.bulk_update([c for c in counters.values() if not c._state.adding], ['votes'])
+    JudgeVoteCount.objects.bulk_create(new_counters)
+
+@transaction.atomic
+def rebuild_profile_ratings(profile):
+    """
+    Replays every duel of a profile from scratch and replaces its persisted state,
+    dropping any rating checkpoints and bumping the profile's data version.
+    Needed after cards (and their duels) are deleted or the weighting rules change.
+    """
+    cards = list(Card.objects.filter(profile=profile).only('id'))
+    duels = Duel.objects.filter(profile=profile).only('winner_id', 'loser_id', 'judge_id').order_by('created_at', 'id')
+    ratings = calculate_elo(cards, duels.iterator())
+
+    judge_counts = (
+        Duel.objects.filter(profile=profile, judge__isnull=False)
+        .values_list('judge_id')
+        .annotate(votes=Count('id'))
+    )
+
+    CardRating.objects.filter(profile=profile).delete()
+    JudgeVoteCount.objects.filter(profile=profile).delete()
+    RatingCheckpoint.objects.filter(profile=profile).delete()
+
+    CardRating.objects.bulk_create([
+        CardRating(card_id=card_id, profile=profile, rating=r['rating'], won=r['won'], lost=r['lost'])
+        for card_id, r in ratings.items()
+    ])
+    JudgeVoteCount.objects.bulk_create([
+        JudgeVoteCount(judge_id=judge_id, profile=profile, votes=votes)
+        for judge_id, votes in judge_counts
+    ])
+    Profile.bump_data_version(profile.id)
+    return ratings
+
+def get_segment_ratings(profile):
+    """
+    Ratings for every judge segment of a profile ('all', 'men', 'women' and one
+    per judge id), from a single replay cached per profile data version.
+    """
+    def replay():
+        card_ids = Card.objects.filter(profile=profile).values_list('id', flat=True)
+        duels = (
+            Duel.objects.filter(profile=profile)
+            .order_by('created_at', 'id')
+            .values_list('winner_id', 'loser_id', 'judge_id', 'judge__gender')
+        )
+        return replay_segments(card_ids, duels)
+
+    # Concurrent cache misses (e.g. when the results are revealed) share one replay
+    return single_flight(f'elo-segments:{profile.id}:{profile.data_version}', replay, SEGMENT_CACHE_TIMEOUT)
+
+def get_filtered_ratings(profile, segment):
+    """
+    Ratings of one judge segment from the cached segment replay.
+    Segments without duels leave every card at the initial rating.
+    Returns a dictionary: {card_id: {'rating': float, 'won': int, 'lost': int}}
+    """
+    segments = get_segment_ratings(profile)
+    if segment not in segments.segments:
+        return {card_id: {'rating': INITIAL_RATING, 'won': 0, 'lost': 0} for card_id in segments.card_ids}
+
+    ratings, won, lost = segments.segments[segment]
+    return {
+        card_id: {'rating': ratings[i], 'won': won[i], 'lost': lost[i]}
+        for i, card_id in enumerate(segments.card_ids)
+    }
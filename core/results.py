@@ -0,0 +1,92 @@
+"""
+Materialized final results.
+
+The final results list (top cards interleaved by RESULTS_PATTERN, one card per
+prompt) is stored per filter segment in ResultsSnapshot. All snapshots are
+built when an admin reveals the results, so the burst of guests opening the
+page at once only reads them. While votes keep arriving a stale snapshot is
+served for at most REFRESH_INTERVAL before the next reader rebuilds it.
+"""
+from datetime import timedelta
+from django.utils import timezone
+from .models import Card, Profile, ResultsSnapshot
+from .ratings import get_filtered_ratings, get_ratings
+from .utils import INITIAL_RATING
+
+# Defined pattern: 1. photo, 2. prompt, 3. photo, 4. photo, 5. prompt, 6. photo, 7. prompt, 8. photo
+RESULTS_PATTERN = ['image', 'prompt', 'image', 'image', 'prompt', 'image', 'prompt', 'image']
+
+# How long a snapshot older than the profile's data is served before a rebuild
+REFRESH_INTERVAL = timedelta(seconds=15)
+
+
+def final_list(profile, segment):
+    """
+    [card_id, rating] pairs of the final results of a segment ('all', 'men',
+    'women' or a participant id), in display order.
+    """
+    ratings = get_ratings(profile) if segment == 'all' else get_filtered_ratings(profile, segment)
+    cards = [
+        (card_id, prompt_id, ratings.get(card_id, {}).get('rating', INITIAL_RATING))
+        for card_id, prompt_id in Card.objects.filter(profile=profile).order_by('id').values_list('id', 'prompt_id')
+    ]
+    cards.sort(key=lambda card: card[2], reverse=True)
+
+    images = [(card_id, rating) for card_id, prompt_id, rating in cards if prompt_id is None]
+
+    # Filter unique prompts (highest rated only)
+    seen_prompts = set()
+    prompts = []
+    for card_id, prompt_id, rating in cards:
+        if prompt_id is not None and prompt_id not in seen_prompts:
+            prompts.append((card_id, rating))
+            seen_prompts.add(prompt_id)
+
+    queues = {'image': iter(images), 'prompt': iter(prompts)}
+    entries = []
+    for item_type in RESULTS_PATTERN:
+        entry = next(queues[item_type], None)
+        if entry is not None:
+            entries.append([entry[0], float(entry[1])])
+    return entries
+
+
+def refresh_snapshot(profile, segment):
+    """
+    Rebuilds the snapshot of one segment from the current ratings.
+    """
+    # Record the version before reading the ratings, so duels arriving
+    # meanwhile leave the snapshot marked stale rather than fresh
+    profile = Profile.objects.get(pk=profile.pk)
+    snapshot, _ = ResultsSnapshot.objects.update_or_create(
+        profile=profile,
+        segment=str(segment),
+        defaults={'data_version': profile.data_version, 'entries': final_list(profile, segment)},
+    )
+    return snapshot
+
+
+def refresh_snapshots(profile_id):
+    """
+    Rebuilds the snapshots of every segment of a profile: all votes, men,
+    women and each participant.
+    """
+    profile = Profile.objects.filter(pk=profile_id).first()
+    if profile is None:
+        return
+    segments = ['all', 'men', 'women'] + list(profile.participants.values_list('id', flat=True))
+    for segment in segments:
+        refresh_snapshot(profile, segment)
+
+
+def get_snapshot(profile, segment):
+    """
+    The snapshot of a segment, built if missing and rebuilt if it is behind the
+    profile's data and older than REFRESH_INTERVAL.
+    """
+    snapshot = ResultsSnapshot.objects.filter(profile=profile, segment=str(segment)).first()
+    if snapshot is None:
+        return refresh_snapshot(profile, segment)
+    if snapshot.data_version != profile.data_version and timezone.now() - snapshot.updated_at > REFRESH_INTERVAL:
+        return refresh_snapshot(profile, segment)
+    return snapshot
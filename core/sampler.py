@@ -0,0 +1,289 @@
+"""
+Weighted card pair sampling for the ranking page.
+
+Two strategies, chosen per profile with Profile.matchmaking_mode:
+
+- 'win_rate' draws cards with the Laplace-smoothed win rate (won + 1) / (total + 2)
+  as weight, so weak cards show up less often.
+- 'information' draws the first card by rating uncertainty, then its opponent
+  among the cards closest in rating, by the expected information of the duel.
+  Votes go to pairs whose outcome is still open, and new uploads get played in.
+
+Each profile keeps one CardPool per pool ('image' and 'prompt') in process
+memory: a vote, an upload or a removal updates a card in O(log n) (plus a
+memmove in the rating ladder), and a pair of distinct cards is drawn in
+O(log n), whatever the size of the event's history.
+
+The trees are tagged with the Profile.data_version they reflect. Writes made
+by this process advance the tag as their transaction commits (see
+core.signals); any other change, e.g. from another process or a rating
+rebuild, leaves the tag behind and the trees are rebuilt from CardRating with
+a single query on the next draw.
+"""
+from .models import CardRating
+import bisect
+import random
+import threading
+
+# Number of cards on each side of the first card, by rating, considered as its opponent
+NEIGHBOURHOOD = 8
+
+
+def card_weight(won, lost):
+    return (won + 1) / (won + lost + 2)
+
+def card_variance(won, lost):
+    """
+    Rating uncertainty of a card, as the variance of a posterior that every
+    duel narrows by the same amount of information.
+    """
+    return 1 / (won + lost + 1)
+
+def duel_information(rating_a, rating_b, variance_a, variance_b):
+    """
+    Expected information of a duel: the outcome variance p(1 - p) of the ELO
+    model, scaled by how uncertain both ratings still are.
+    """
+    p = 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+    return p * (1 - p) * (variance_a + variance_b)
+
+def pool_name(prompt_id):
+    return 'image' if prompt_id is None else 'prompt'
+
+
+class WeightedPool:
+    """
+    Fenwick tree of card weights supporting O(log n) add, update, remove and
+    weighted draws. Slots are kept dense: a removed card's slot is taken over
+    by the last card.
+    """
+    def __init__(self):
+        self.card_ids = []
+        self.weights = []
+        self.slots = {}
+        self.tree = [0.0]
+
+    def __len__(self):
+        return len(self.card_ids)
+
+    def __contains__(self, card_id):
+        return card_id in self.slots
+
+    def _prefix(self, i):
+        """
+        Sum of the weights in slots [0, i).
+        """
+        total = 0.0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _add(self, slot, delta):
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        return self._prefix(len(self.card_ids))
+
+    def set(self, card_id, weight):
+        slot = self.slots.get(card_id)
+        if slot is None:
+            # Appending slot i covers (i - lowbit(i), i], part of which is already summed
+            i = len(self.card_ids) + 1
+            self.slots[card_id] = i - 1
+            self.card_ids.append(card_id)
+            self.weights.append(weight)
+            self.tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+            return
+        self._add(slot, weight - self.weights[slot])
+        self.weights[slot] = weight
+
+    def remove(self, card_id):
+        slot = self.slots.pop(card_id, None)
+        if slot is None:
+            return
+        last = len(self.card_ids) - 1
+        last_id, last_weight = self.card_ids[last], self.weights[last]
+
+        self._add(last, -last_weight)
+        self.tree.pop()
+        self.card_ids.pop()
+        self.weights.pop()
+        if slot != last:
+            self._add(slot, last_weight - self.weights[slot])
+            self.card_ids[slot] = last_id
+            self.weights[slot] = last_weight
+            self.slots[last_id] = slot
+
+    def _find(self, u):
+        """
+        Slot whose cumulative weight range contains u.
+        """
+        pos = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= u:
+                pos = nxt
+                u -= self.tree[nxt]
+            step >>= 1
+        return min(pos, len(self.card_ids) - 1)
+
+    def draw(self, rng=random):
+        return self.card_ids[self._find(rng.random() * self.total())]
+
+    def draw_pair(self, rng=random):
+        """
+        Draws two distinct card ids, weighted, without replacement.
+        Returns None with fewer than two cards.
+        """
+        if len(self.card_ids) < 2:
+            return None
+        first = self._find(rng.random() * self.total())
+
+        # Draw over the remaining weight and step over the first card's range
+        u = rng.random() * (self.total() - self.weights[first])
+        if u >= self._prefix(first):
+            u += self.weights[first]
+        second = self._find(u)
+        if second == first:
+            # Float rounding at the edge of the range
+            second = first + 1 if first + 1 < len(self.card_ids) else first - 1
+        return self.card_ids[first], self.card_ids[second]
+
+
+class CardPool:
+    """
+    The cards of one pool, indexed for both matchmaking strategies.
+    """
+    def __init__(self):
+        self.by_win_rate = WeightedPool()
+        self.by_variance = WeightedPool()
+        self.ratings = {}
+        # (rating, card_id), sorted
+        self.ladder = []
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def set(self, card_id, rating, won, lost):
+        if card_id in self.ratings:
+            self.ladder.pop(bisect.bisect_left(self.ladder, (self.ratings[card_id], card_id)))
+        bisect.insort(self.ladder, (rating, card_id))
+        self.ratings[card_id] = rating
+        self.by_win_rate.set(card_id, card_weight(won, lost))
+        self.by_variance.set(card_id, card_variance(won, lost))
+
+    def remove(self, card_id):
+        rating = self.ratings.pop(card_id, None)
+        if rating is None:
+            return
+        self.ladder.pop(bisect.bisect_left(self.ladder, (rating, card_id)))
+        self.by_win_rate.remove(card_id)
+        self.by_variance.remove(card_id)
+
+    def _variance(self, card_id):
+        return self.by_variance.weights[self.by_variance.slots[card_id]]
+
+    def draw_pair(self, strategy='win_rate', rng=random):
+        """
+        Two distinct card ids picked by the given strategy, or None with fewer than two cards.
+        """
+        if len(self.ratings) < 2:
+            return None
+        if strategy != 'information':
+            return self.by_win_rate.draw_pair(rng)
+
+        first = self.by_variance.draw(rng)
+        rating, variance = self.ratings[first], self._variance(first)
+        position = bisect.bisect_left(self.ladder, (rating, first))
+        neighbours = (
+            self.ladder[max(position - NEIGHBOURHOOD, 0):position] +
+            self.ladder[position + 1:position + 1 + NEIGHBOURHOOD]
+        )
+        scores = [
+            duel_information(rating, other_rating, variance, self._variance(other))
+            for other_rating, other in neighbours
+        ]
+        second = rng.choices(neighbours, weights=scores)[0][1]
+        return first, second
+
+
+class ProfileSampler:
+    def __init__(self, version):
+        self.version = version
+        self.lock = threading.Lock()
+        self.pools = {'image': CardPool(), 'prompt': CardPool()}
+
+    def set(self, card_id, prompt_id, rating, won, lost):
+        self.pools[pool_name(prompt_id)].set(card_id, rating, won, lost)
+
+    def remove(self, card_id):
+        for pool in self.pools.values():
+            pool.remove(card_id)
+
+
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+
+def _build(profile):
+    sampler = ProfileSampler(profile.data_version)
+    # Cards whose media is still being processed are left out until they are ready
+    rows = (
+        CardRating.objects.filter(profile=profile, card__processing_status='ready')
+        .values_list('card_id', 'card__prompt_id', 'rating', 'won', 'lost')
+    )
+    for row in rows:
+        sampler.set(*row)
+    return sampler
+
+def get_sampler(profile):
+    """
+    Sampler of a profile, rebuilt when it does not match the profile's data version.
+    """
+    sampler = _samplers.get(profile.id)
+    if sampler is None or sampler.version != profile.data_version:
+        sampler = _build(profile)
+        with _samplers_lock:
+            _samplers[profile.id] = sampler
+    return sampler
+
+def draw_pair(profile, card_type):
+    """
+    Two distinct card ids from the 'image' or 'prompt' pool of a profile, picked
+    by the profile's matchmaking mode, or None when the pool has fewer than two cards.
+    """
+    sampler = get_sampler(profile)
+    with sampler.lock:
+        return sampler.pools[card_type].draw_pair(profile.matchmaking_mode)
+
+def invalidate(profile_id):
+    with _samplers_lock:
+        _samplers.pop(profile_id, None)
+
+def apply_change(profile_id, card_ids=(), removed=()):
+    """
+    Applies one committed data_version bump made by this process: re-reads the
+    weights of card_ids and drops the removed card ids. The read happens under
+    the sampler lock, so concurrent commits cannot apply older weights last.
+    """
+    sampler = _samplers.get(profile_id)
+    if sampler is None:
+        return
+    with sampler.lock:
+        if card_ids:
+            rows = list(
+                CardRating.objects.filter(card_id__in=card_ids, card__processing_status='ready')
+                .values_list('card_id', 'card__prompt_id', 'rating', 'won', 'lost')
+            )
+            for row in rows:
+                sampler.set(*row)
+            # Cards that are (again) not ready leave the pools
+            removed = set(removed) | (set(card_ids) - {row[0] for row in rows})
+        for card_id in removed:
+            sampler.remove(card_id)
+        sampler.version += 1
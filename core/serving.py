@@ -0,0 +1,142 @@
+"""
+Serving uploaded media.
+
+serve_media answers GET and HEAD for files under MEDIA_ROOT with ETag and
+Last-Modified validators, long-lived immutable caching (uploads are never
+changed in place; a new file gets a new name) and byte-range requests, so
+browsers can seek in videos and fetch their first frames. Files still being
+written (chunked uploads, storage temporaries) are not served.
+
+With settings.MEDIA_SERVE_MODE set to 'x-accel-redirect' (nginx) or
+'x-sendfile' (Apache, lighttpd) the view only checks the request and lets the
+web server send the bytes, ranges included:
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+from .storage import TEMP_DIR
+from .uploads import PARTIAL_DIR
+from urllib.parse import quote
+import mimetypes
+import os
+import re
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Statuses that carry (or, for 304, confirm) the file, and so may be cached as immutable
+CACHEABLE_STATUSES = (200, 206, 304)
+
+# Media directories of files that are not final yet
+INTERNAL_DIRS = (PARTIAL_DIR, TEMP_DIR)
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single-range Range header, both inclusive; None when the
+    header is absent or not a single byte range (the whole file is sent);
+    False when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Fant ikke filen.")
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404("Fant ikke filen.")
+    if not os.path.isfile(full_path):
+        raise Http404("Fant ikke filen.")
+    if os.path.relpath(full_path, settings.MEDIA_ROOT).split(os.sep)[0] in INTERNAL_DIRS:
+        raise Http404("Fant ikke filen.")
+
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, full_path, stat.st_size, etag)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if response.status_code in CACHEABLE_STATUSES:
+        response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def _file_response(request, path, full_path, size, etag):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    mode = getattr(settings, 'MEDIA_SERVE_MODE', 'django')
+
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + quote(path)
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+
+    byte_range = parse_range(request.headers.get('Range'), size)
+    # A range only applies to the representation the client already has part of
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag:
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(full_path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,129 @@
+from django.db import transaction
+from django.db.models import Min, Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .checkpoints import invalidate_checkpoints
+from .events import publish_update
+from .models import Card, Duel, Participant, Profile, Prompt
+from .prompts import invalidate_prompt_ids
+from .ratings import rebuild_profile_ratings
+from . import sampler
+
+class RatingsRebuild:
+    """
+    An on_commit callback that replays a profile's duels into its persisted
+    ratings. A bulk delete sends a signal per row, so the callback is only
+    registered once per profile and transaction.
+    """
+    def __init__(self, profile_id):
+        self.profile_id = profile_id
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        profile = Profile.objects.filter(id=self.profile_id).first()
+        # Gone when the deletes came from deleting the whole profile
+        if profile is not None:
+            rebuild_profile_ratings(profile)
+
+def rebuild_ratings_on_commit(profile_id):
+    connection = transaction.get_connection()
+    # Pending callbacks are (savepoint ids, callback, robust); the list is
+    # emptied on commit and rollback, but tests run callbacks without committing
+    for _, callback, *_ in connection.run_on_commit:
+        if isinstance(callback, RatingsRebuild) and callback.profile_id == profile_id and not callback.done:
+            return
+    transaction.on_commit(RatingsRebuild(profile_id))
+
+@receiver(pre_delete, sender=Card)
+def card_deleting(sender, instance, **kwargs):
+    # The card's duels are deleted in bulk with it, without signals of their own
+    since = Duel.objects.filter(Q(winner=instance) | Q(loser=instance)).aggregate(since=Min('created_at'))['since']
+    if since is not None:
+        invalidate_checkpoints(instance.profile_id, since)
+
+@receiver(post_delete, sender=Card)
+def card_deleted(sender, instance, **kwargs):
+    Profile.bump_data_version(instance.profile_id)
+    # Django clears the pk once the delete finishes, so capture it now
+    card_id = instance.id
+    transaction.on_commit(lambda: sampler.apply_change(instance.profile_id, removed=[card_id]))
+    transaction.on_commit(lambda: publish_update(instance.profile_id))
+    # The card's duels are gone with it, so every other rating has to be replayed
+    rebuild_ratings_on_commit(instance.profile_id)
+    # Releases the card's references; blobs no other card uses are deleted once committed
+    for name in instance.media_files():
+        instance.image.storage.delete(name)
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, created, **kwargs):
+    Profile.bump_data_version(instance.profile_id)
+    if created:
+        transaction.on_commit(lambda: sampler.apply_change(instance.profile_id, card_ids=[instance.id]))
+        transaction.on_commit(lambda: publish_update(instance.profile_id))
+
+@receiver(post_save, sender=Duel)
+def duel_saved(sender, instance, created, **kwargs):
+    if created:
+        duels_created([instance])
+    else:
+        Profile.bump_data_version(instance.profile_id)
+
+def duels_created(duels, on_commit=transaction.on_commit):
+    """
+    Bumps the data version once per profile for newly inserted duels and, once
+    committed, updates the pair sampler and the live dashboards. Also called by
+    core.writer, whose bulk inserts send no post_save; it passes its own
+    on_commit to run those updates after answering the votes.
+    """
+    by_profile = {}
+    for duel in duels:
+        by_profile.setdefault(duel.profile_id, []).append(duel)
+
+    for profile_id, profile_duels in by_profile.items():
+        card_ids = {card_id for duel in profile_duels for card_id in (duel.winner_id, duel.loser_id)}
+        Profile.bump_data_version(profile_id)
+        on_commit(lambda profile_id=profile_id, card_ids=card_ids: sampler.apply_change(profile_id, card_ids=card_ids))
+        on_commit(lambda profile_id=profile_id, profile_duels=profile_duels: publish_update(profile_id, duels=profile_duels))
+
+def duels_deleted(duels):
+    """
+    Invalidates the rating checkpoints from the earliest deleted duel, bumps
+    the data version and rebuilds the persisted ratings once per profile. There is no post_delete receiver on
+    Duel, since one would stop Django from deleting a card's duels in bulk;
+    duels deleted with their card are handled by card_deleting, and any other
+    deletion of duels has to call this.
+    """
+    earliest = {}
+    for profile_id, created_at in duels:
+        if profile_id not in earliest or created_at < earliest[profile_id]:
+            earliest[profile_id] = created_at
+
+    for profile_id, since in earliest.items():
+        invalidate_checkpoints(profile_id, since)
+        # Every later rating changes; the pair sampler rebuilds once it sees the new version
+        Profile.bump_data_version(profile_id)
+        rebuild_ratings_on_commit(profile_id)
+
+@receiver(pre_delete, sender=Participant)
+def participant_deleting(sender, instance, **kwargs):
+    # Deleting a judge clears Duel.judge without sending signals for the duels,
+    # which changes the weights of every vote after the judge's first one
+    since = instance.judged_duels.aggregate(since=Min('created_at'))['since']
+    if since is not None:
+        invalidate_checkpoints(instance.profile_id, since)
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def participant_changed(sender, instance, signal, **kwargs):
+    Profile.bump_data_version(instance.profile_id)
+    transaction.on_commit(lambda: sampler.apply_change(instance.profile_id))
+    if signal is post_delete:
+        # The judge's duels are now anonymous, which changes the vote weights
+        rebuild_ratings_on_commit(instance.profile_id)
+
+@receiver(post_save, sender=Prompt)
+@receiver(post_delete, sender=Prompt)
+def prompt_changed(sender, instance, **kwargs):
+    # Refresh the cached prompt id array used for random prompt draws
+    transaction.on_commit(invalidate_prompt_ids)
@@ -0,0 +1,128 @@
+"""
+Single-flight coalescing of identical expensive computations.
+
+When the results are revealed every guest opens the same pages within a few
+seconds, and each request would otherwise replay the same duels. single_flight
+runs a computation once per key while it is in flight and hands its result to
+every concurrent caller:
+
+- Threads of one process wait on the leader's event.
+- Processes coordinate through a lock file in SINGLE_FLIGHT_LOCK_DIR: the
+  leader creates it exclusively and stores its result in the cache, which
+  must be shared between the processes (see CACHES in settings.py); the others
+  poll the cache for it.
+
+A waiter that gets no result within LOCK_TIMEOUT computes for itself, so when
+a computation takes longer than that every waiting request computes at once.
+This is logged; raise LOCK_TIMEOUT if it shows up.
+"""
+from django.conf import settings
+from django.core.cache import cache
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a computation may hold the lock before others give up waiting
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, compute, timeout):
+    """
+    Returns the value cached under `key`, or computes it once for all
+    concurrent callers and caches it for `timeout` seconds. A compute()
+    returning None is not cached or shared with other processes, so their
+    callers compute for themselves.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(LOCK_TIMEOUT):
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        logger.warning("Gave up waiting for %s after %s seconds; computing it again", key, LOCK_TIMEOUT)
+        return compute()
+
+    try:
+        flight.value = _across_processes(key, compute, timeout)
+        return flight.value
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _lock_path(key):
+    lock_dir = getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None) or os.path.join(tempfile.gettempdir(), 'single-flight')
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, hashlib.sha256(key.encode()).hexdigest() + '.lock')
+
+def _acquire(path):
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        pass
+    # A process that died while computing leaves its lock behind
+    try:
+        if time.time() - os.path.getmtime(path) > LOCK_TIMEOUT:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    return False
+
+def _across_processes(key, compute, timeout):
+    lock_path = _lock_path(key)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not _acquire(lock_path):
+        # Another process is computing; wait for its result. If it finishes
+        # without one, its lock is gone and the next attempt succeeds.
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if time.monotonic() > deadline:
+            logger.warning("Gave up waiting for %s after %s seconds; computing it again", key, LOCK_TIMEOUT)
+            return compute()
+
+    try:
+        # The previous holder may have finished between our get and the lock
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                cache.set(key, value, timeout)
+        return value
+    finally:
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,139 @@
+"""
+Content-addressed media storage.
+
+Guests upload the same photo twice (through both upload flows, or again after
+a failed attempt), and identical renditions come out of identical originals.
+ContentAddressedStorage hashes every file while streaming it to disk and
+stores it once, as <directory>/<aa>/<sha256><extension>, where <aa> is the
+first two hex digits. A file name thereby identifies its content, so the
+immutable caching of core.serving holds forever.
+
+Each save of a file counts as a reference to it (a Blob row), and each
+delete() releases one; the file is removed once the last reference is
+released and the transaction has committed. Files without a Blob row (stored
+before this storage, or partial chunked uploads) are deleted once the
+transaction has committed.
+"""
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import uuid
+
+TEMP_DIR = 'tmp'
+READ_SIZE = 1024 * 1024
+
+DIGEST_NAME_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def digest_of(name):
+    """
+    The SHA-256 a content-addressed file name was stored under, or '' for other names.
+    """
+    stem = os.path.splitext(posixpath.basename(name or ''))[0]
+    return stem if DIGEST_NAME_RE.match(stem) else ''
+
+
+def retain(name, size):
+    from .models import Blob
+
+    if Blob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(name=name, size=size, refcount=1)
+    except IntegrityError:
+        # Created concurrently
+        Blob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The name is chosen from the content in _save; equal names are the same file
+        return name
+
+    def _save(self, name, content):
+        temp_dir = self.path(TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp:
+            try:
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    temp.write(chunk)
+            except BaseException:
+                temp.close()
+                os.remove(temp.name)
+                raise
+        return self._store(temp.name, hasher.hexdigest(), name)
+
+    def store_file(self, path, name):
+        """
+        Moves the local file at `path` (written in place, like a chunked
+        upload) into the storage. `name` gives the directory and extension;
+        returns the name stored under.
+        """
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as file:
+            while data := file.read(READ_SIZE):
+                hasher.update(data)
+        return self._store(path, hasher.hexdigest(), name)
+
+    def _store(self, path, digest, name):
+        directory = posixpath.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        full_path = self.path(name)
+        retain(name, os.path.getsize(path))
+        try:
+            if os.path.exists(full_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except FileNotFoundError:
+            # Moved away concurrently (see core.uploads); release the reference
+            self.delete(name)
+            raise
+        return name
+
+    def delete(self, name):
+        from .models import Blob
+
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        if not Blob.objects.filter(name=name).exists():
+            remove = super().delete
+            transaction.on_commit(lambda: remove(name))
+            return
+        Blob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+        # A rolled back delete keeps the file; a save in between keeps it referenced
+        transaction.on_commit(lambda: self._collect(name))
+
+    def _collect(self, name):
+        from .models import Blob
+
+        # The file is moved aside before its Blob row is deleted. A concurrent
+        # _store that retains the name after that finds no file and puts its
+        # own in place, and one that retained it before keeps the row, so the
+        # file is moved back.
+        aside = os.path.join(self.path(TEMP_DIR), uuid.uuid4().hex)
+        os.makedirs(os.path.dirname(aside), exist_ok=True)
+        try:
+            os.replace(self.path(name), aside)
+        except FileNotFoundError:
+            # Collected concurrently, or already gone
+            Blob.objects.filter(name=name, refcount=0).delete()
+            return
+        deleted, _ = Blob.objects.filter(name=name, refcount=0).delete()
+        if deleted:
+            os.remove(aside)
+        else:
+            # Same content as any file a concurrent _store put there
+            os.replace(aside, self.path(name))
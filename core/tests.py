@@ -1,3 +1,1555 @@
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.conf import settings
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+import asyncio
+import gzip
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+import random
+from PIL import Image as PILImage
 
-# Create your tests here.
+from . import checkpoints, elo, events, leaderboard, media, prompts, results, sampler, serving, signals, singleflight, uploads, urls, views, writer
+from .leaderboard import leaderboard_page
+from .management.commands import import_prompts
+from .middleware import QueryRecorder
+from .models import Blob, Card, CardRating, ChunkedUpload, Duel, JudgeVoteCount, MediaJob, Participant, Profile, Prompt, PromptAssignment, RatingCheckpoint, ResultsSnapshot
+from .ratings import get_filtered_ratings, get_ratings, rebuild_profile_ratings
+from .signals import RatingsRebuild
+from .utils import calculate_elo, calculate_elo_history, downsample_lttb, replay_elo
+
+
+def synthetic_duels(n, cards=20, judges=6, seed=0):
+    rng = random.Random(seed)
+    card_ids = list(range(1, cards + 1))
+    judge_ids = list(range(1, judges + 1)) + [None]
+    rows = []
+    for _ in range(n):
+        winner_id, loser_id = rng.sample(card_ids, 2)
+        rows.append((winner_id, loser_id, rng.choice(judge_ids)))
+    return card_ids, rows
+
+
+class RatingsTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i)) for i in range(8)]
+        self.judges = [
+            Participant.objects.create(profile=self.profile, name=f'Judge {i}', gender='MF'[i % 2])
+            for i in range(4)
+        ]
+
+    def vote(self, winner, loser, judge):
+        Duel.objects.create(winner=self.cards[winner], loser=self.cards[loser], judge=judge)
+
+    def vote_randomly(self, n, seed=0):
+        rng = random.Random(seed)
+        for _ in range(n):
+            winner, loser = rng.sample(range(len(self.cards)), 2)
+            # A few anonymous votes, and judges with very different volumes
+            judge = rng.choice([None] + self.judges[:1] * 6 + self.judges)
+            self.vote(winner, loser, judge)
+
+    def replayed(self):
+        duels = Duel.objects.filter(profile=self.profile).order_by('created_at', 'id')
+        return calculate_elo(self.cards, duels)
+
+    def test_incremental_ratings_match_full_replay(self):
+        self.vote_randomly(150)
+        self.assertEqual(get_ratings(self.profile), self.replayed())
+        votes = dict(JudgeVoteCount.objects.filter(profile=self.profile).values_list('judge_id', 'votes'))
+        expected = Counter(Duel.objects.filter(profile=self.profile, judge__isnull=False).values_list('judge_id', flat=True))
+        self.assertEqual(votes, dict(expected))
+
+    def test_rebuild_is_idempotent(self):
+        self.vote_randomly(100)
+        incremental = get_ratings(self.profile)
+        rebuild_profile_ratings(self.profile)
+        first = get_ratings(self.profile)
+        rebuild_profile_ratings(self.profile)
+        self.assertEqual(get_ratings(self.profile), first)
+        self.assertEqual(first, incremental)
+
+    def test_votes_are_weighted_by_counts_so_far(self):
+        # Judge 0 votes once, then judge 1 votes three times. With end-of-event
+        # totals judge 0 would weigh twice the average (K = 64); with the counts
+        # known when the vote is cast both judges are average at that point.
+        self.vote(0, 1, self.judges[0])
+        for _ in range(3):
+            self.vote(2, 3, self.judges[1])
+        self.assertEqual(get_ratings(self.profile)[self.cards[0].id]['rating'], 1216.0)
+        self.assertEqual(self.replayed()[self.cards[0].id]['rating'], 1216.0)
+        history = calculate_elo_history(self.cards, Duel.objects.filter(profile=self.profile).order_by('created_at', 'id'))
+        self.assertEqual(history[self.cards[0].id], [{'x': 1, 'y': 1216.0}])
+
+    def test_segment_all_matches_persisted_ratings_with_equal_timestamps(self):
+        self.vote_randomly(60, seed=2)
+        # Bulk inserts share one timestamp; every replay breaks the tie by id
+        Duel.objects.filter(profile=self.profile).update(created_at=timezone.now())
+        rebuild_profile_ratings(self.profile)
+        self.profile.refresh_from_db()
+        self.assertEqual(get_filtered_ratings(self.profile, 'all'), get_ratings(self.profile))
+
+    def test_deletes_rebuild_persisted_ratings(self):
+        self.vote_randomly(80, seed=3)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Card.objects.filter(id__in=[self.cards[0].id, self.cards[1].id]).delete()
+        # Once per profile, not once per deleted card
+        self.assertEqual(sum(isinstance(callback, RatingsRebuild) for callback in callbacks), 1)
+        self.cards = self.cards[2:]
+        self.assertEqual(get_ratings(self.profile), self.replayed())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.judges[0].delete()
+        self.assertEqual(get_ratings(self.profile), self.replayed())
+        votes = dict(JudgeVoteCount.objects.filter(profile=self.profile).values_list('judge_id', 'votes'))
+        self.assertNotIn(self.judges[0].id, votes)
+
+    def test_migration_backfill_matches_incremental_ratings(self):
+        self.vote_randomly(120, seed=1)
+        incremental = get_ratings(self.profile)
+        CardRating.objects.all().delete()
+        JudgeVoteCount.objects.all().delete()
+        migration = importlib.import_module('core.migrations.0020_cardrating_judgevotecount')
+        migration.backfill_ratings(django_apps, None)
+        self.assertEqual(get_ratings(self.profile), incremental)
+
+
+class EloArraysTests(SimpleTestCase):
+    def setUp(self):
+        self.card_ids, self.rows = synthetic_duels(2000)
+        # Leave one card out so skipped duels are covered too
+        self.cards = [SimpleNamespace(id=card_id) for card_id in self.card_ids[1:]]
+        self.duels = [SimpleNamespace(winner_id=w, loser_id=l, judge_id=j) for w, l, j in self.rows]
+
+    def test_ratings_match_calculate_elo(self):
+        expected = calculate_elo(self.cards, self.duels)
+        self.assertEqual(elo.calculate_elo_arrays(self.card_ids[1:], self.rows), expected)
+
+    def test_history_matches_calculate_elo_history(self):
+        expected = calculate_elo_history(self.cards, self.duels)
+        self.assertEqual(elo.calculate_elo_history_arrays(self.card_ids[1:], self.rows), expected)
+
+    def test_pure_python_fallback(self):
+        expected = calculate_elo(self.cards, self.duels)
+        with mock.patch.object(elo, 'np', None):
+            self.assertEqual(elo.calculate_elo_arrays(self.card_ids[1:], self.rows), expected)
+
+    def test_replay_elo_tracks_requested_cards_only(self):
+        ratings, history = replay_elo(self.card_ids[1:], self.rows, history_for=[5, 999])
+        self.assertEqual(ratings, calculate_elo(self.cards, self.duels))
+        self.assertEqual(list(history), [5])
+        expected = calculate_elo_history(self.cards, self.duels)[5]
+        self.assertEqual(history[5], [{'x': 0, 'y': 1200.0}] + expected)
+
+    def test_segments_match_filtered_calculate_elo(self):
+        genders = {1: 'M', 2: 'F', 3: 'M', 4: 'O', 5: 'F', 6: 'M'}
+        rows = [(w, l, j, genders.get(j)) for w, l, j in self.rows]
+        result = elo.replay_segments(self.card_ids[1:], rows)
+
+        filters = {
+            'all': lambda d: True,
+            'men': lambda d: d.judge_id and genders[d.judge_id] == 'M',
+            'women': lambda d: d.judge_id and genders[d.judge_id] == 'F',
+            4: lambda d: d.judge_id == 4,
+        }
+        for key, keep in filters.items():
+            expected = calculate_elo(self.cards, [d for d in self.duels if keep(d)])
+            ratings, won, lost = result.segments[key]
+            actual = {
+                card_id: {'rating': ratings[i], 'won': won[i], 'lost': lost[i]}
+                for i, card_id in enumerate(result.card_ids)
+            }
+            self.assertEqual(actual, expected, key)
+
+
+class DownsampleTests(SimpleTestCase):
+    def test_lttb_keeps_endpoints_and_peak(self):
+        xs = list(range(1000))
+        ys = [0.0] * 1000
+        ys[500] = 100.0
+        sampled_x, sampled_y = downsample_lttb(xs, ys, 50)
+        self.assertEqual(len(sampled_x), 50)
+        self.assertEqual((sampled_x[0], sampled_x[-1]), (0, 999))
+        self.assertIn(500, sampled_x)
+
+    def test_lttb_short_series_unchanged(self):
+        self.assertEqual(downsample_lttb([1, 2, 3], [4, 5, 6], 10), ([1, 2, 3], [4, 5, 6]))
+
+
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        judges = [Participant.objects.create(profile=self.profile, name=f'Judge {i}') for i in range(4)]
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i)) for i in range(8)]
+
+        rng = random.Random(1)
+        start = timezone.now() - timedelta(hours=1)
+        duels = []
+        for i in range(230):
+            winner, loser = rng.sample(self.cards, 2)
+            duels.append(Duel(profile=self.profile, winner=winner, loser=loser, judge=rng.choice(judges + [None])))
+        Duel.objects.bulk_create(duels)
+        for i, duel in enumerate(Duel.objects.order_by('id')):
+            Duel.objects.filter(id=duel.id).update(created_at=start + timedelta(seconds=i))
+
+    def expected(self, history_for):
+        card_ids = Card.objects.filter(profile=self.profile).order_by('id').values_list('id', flat=True)
+        duels = Duel.objects.filter(profile=self.profile).order_by('created_at', 'id')
+        return replay_elo(card_ids, duels.values_list('winner_id', 'loser_id', 'judge_id'), history_for=history_for)
+
+    @mock.patch.object(checkpoints, 'CHECKPOINT_INTERVAL', 50)
+    def test_resume_matches_full_replay(self):
+        tracked = [self.cards[0].id, self.cards[3].id]
+        self.assertEqual(checkpoints.replay_profile(self.profile, history_for=tracked), self.expected(tracked))
+        self.assertEqual(RatingCheckpoint.objects.filter(profile=self.profile).count(), 4)
+
+        # Second run resumes from the checkpoints
+        self.assertEqual(checkpoints.replay_profile(self.profile, history_for=tracked), self.expected(tracked))
+        self.assertEqual(checkpoints.replay_profile(self.profile), self.expected(None))
+
+    @mock.patch.object(checkpoints, 'CHECKPOINT_INTERVAL', 50)
+    def test_deleting_card_invalidates_checkpoints(self):
+        checkpoints.replay_profile(self.profile)
+        self.cards[5].delete()
+        self.assertFalse(RatingCheckpoint.objects.filter(profile=self.profile).exists())
+
+        tracked = [self.cards[0].id]
+        self.assertEqual(checkpoints.replay_profile(self.profile, history_for=tracked), self.expected(tracked))
+
+    def test_deleting_card_deletes_its_duels_in_bulk(self):
+        card = self.cards[5]
+        card_id = card.id
+        self.assertGreater(Duel.objects.filter(winner=card).count(), 10)
+        with CaptureQueriesContext(connection) as queries:
+            card.delete()
+        self.assertLess(len(queries), 20)
+        self.assertFalse(Duel.objects.filter(winner_id=card_id).exists())
+
+    @mock.patch.object(checkpoints, 'CHECKPOINT_INTERVAL', 50)
+    def test_deleting_judge_invalidates_checkpoints(self):
+        checkpoints.replay_profile(self.profile)
+        Participant.objects.filter(profile=self.profile).first().delete()
+        self.assertFalse(RatingCheckpoint.objects.filter(profile=self.profile).exists())
+
+        tracked = [self.cards[0].id]
+        self.assertEqual(checkpoints.replay_profile(self.profile, history_for=tracked), self.expected(tracked))
+
+
+class EventBrokerTests(SimpleTestCase):
+    def test_publish_from_thread_reaches_subscribers(self):
+        broker = events.Broker()
+
+        async def run():
+            first = broker.subscribe(1)
+            second = broker.subscribe(1)
+            other = broker.subscribe(2)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, broker.publish, 1, 'update', {'duel_count': 3})
+            received = [await asyncio.wait_for(s.get(), timeout=1) for s in (first, second)]
+            self.assertTrue(other.queue.empty())
+            for s in (first, second, other):
+                s.close()
+            return received
+
+        self.assertEqual(asyncio.run(run()), [('update', {'duel_count': 3})] * 2)
+        self.assertFalse(broker.has_subscribers(1))
+
+
+class DashboardPushTests(TestCase):
+    def test_duel_publishes_one_update(self):
+        profile = Profile.objects.create(name='Test')
+        judge = Participant.objects.create(profile=profile, name='Judge')
+        winner = Card.objects.create(profile=profile, answer='a', uploader=judge)
+        loser = Card.objects.create(profile=profile, answer='b', uploader=judge)
+
+        with mock.patch.object(events.broker, 'has_subscribers', return_value=True), \
+                mock.patch.object(events.broker, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                Duel.objects.create(winner=winner, loser=loser, judge=judge)
+
+        publish.assert_called_once()
+        profile_id, event, data = publish.call_args.args
+        self.assertEqual((profile_id, event), (profile.id, 'update'))
+        self.assertEqual(data['duel_count'], 1)
+        self.assertEqual(data['image_count'] + data['prompt_count'], 2)
+        self.assertEqual({point['id'] for point in data['points']}, {winner.id, loser.id})
+
+    def test_stream_answers_204_under_wsgi(self):
+        profile = Profile.objects.create(name='Test')
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        # The stream would never flush, so the client has to keep polling
+        response = self.client.get(reverse('live_dashboard_stream', args=[profile.id]))
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_under_asgi(self):
+        profile = await Profile.objects.acreate(name='Test')
+        await self.async_client.aforce_login(await User.objects.acreate(username='staff', is_staff=True))
+        response = await self.async_client.get(reverse('live_dashboard_stream', args=[profile.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        await stream.aclose()
+
+
+class VersionedResponseTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judge = Participant.objects.create(profile=self.profile, name='Judge')
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i), uploader=self.judge) for i in range(2)]
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+        self.url = reverse('stats', args=[self.profile.id])
+
+    def test_unchanged_profile_answers_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with self.assertNumQueries(2):  # session + data version
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Another filter is another representation
+        response = self.client.get(self.url, {'filter_by': 'men'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_duel_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Duel.objects.create(winner=self.cards[0], loser=self.cards[1], judge=self.judge)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(name='Test')
+        cls.judges = [
+            Participant.objects.create(profile=cls.profile, name=f'Judge {i}', gender='MF'[i % 2])
+            for i in range(4)
+        ]
+        prompt = Prompt.objects.create(text='Prompt')
+        cls.images = [Card.objects.create(profile=cls.profile, answer=f'Image {i}') for i in range(60)]
+        cls.prompt_cards = [Card.objects.create(profile=cls.profile, prompt=prompt, answer=f'Answer {i}') for i in range(5)]
+        rng = random.Random(2)
+        writer.write_duels([
+            Duel(profile=cls.profile, winner=winner, loser=loser, judge=rng.choice(cls.judges))
+            for winner, loser in (rng.sample(cls.images, 2) for _ in range(400))
+        ])
+
+    def setUp(self):
+        cache.clear()
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+
+    def walk(self, segment, sort):
+        cards, cursor = leaderboard.leaderboard_page(self.profile, 'image', segment, sort)
+        pages = 1
+        while cursor:
+            page, cursor = leaderboard.leaderboard_page(self.profile, 'image', segment, sort, cursor)
+            cards += page
+            pages += 1
+        return cards, pages
+
+    def test_pages_follow_full_sort(self):
+        for segment in ('all', 'men', self.judges[0].id):
+            ratings = get_ratings(self.profile) if segment == 'all' else get_filtered_ratings(self.profile, segment)
+            for sort in leaderboard.SORTS:
+                with self.subTest(segment=segment, sort=sort):
+                    cards, pages = self.walk(segment, sort)
+                    self.assertEqual(pages, 3)
+                    self.assertEqual([card.rank for card in cards], list(range(1, 61)))
+
+                    def key(card_id):
+                        r = ratings[card_id]
+                        return {
+                            'rating': r['rating'],
+                            'won': r['won'],
+                            'lost': r['lost'],
+                            'weight': (r['won'] + 1) / (r['won'] + r['lost'] + 2),
+                        }[sort]
+                    expected = sorted((card.id for card in self.images), key=lambda card_id: (-key(card_id), card_id))
+                    self.assertEqual([card.id for card in cards], expected)
+
+    def test_page_queries_do_not_grow_with_depth(self):
+        _, cursor = leaderboard.leaderboard_page(self.profile, 'image', 'all', 'weight')
+        _, cursor = leaderboard.leaderboard_page(self.profile, 'image', 'all', 'weight', cursor)
+        with self.assertNumQueries(1):
+            cards, cursor = leaderboard.leaderboard_page(self.profile, 'image', 'all', 'weight', cursor)
+        self.assertEqual((len(cards), cursor), (10, None))
+
+    def test_rows_fragment_links_next_page(self):
+        response = self.client.get(reverse('stats', args=[self.profile.id]), {'sort': 'won'})
+        self.assertEqual(len(response.context['image_cards']), leaderboard.PAGE_SIZE)
+        self.assertEqual(len(response.context['prompt_cards']), 5)
+        self.assertIsNone(response.context['prompt_next'])
+
+        url = reverse('stats_rows', args=[self.profile.id, 'image'])
+        response = self.client.get(url, {'sort': 'won', 'after': response.context['image_next']})
+        self.assertEqual([card.rank for card in response.context['cards']], list(range(26, 51)))
+        self.assertContains(response, 'class="stats-more"')
+
+        response = self.client.get(url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('stats_rows', args=[self.profile.id, 'video']))
+        self.assertEqual(response.status_code, 404)
+
+
+class ResultsSnapshotTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judges = [Participant.objects.create(profile=self.profile, name=f'Judge {i}', gender='MF'[i]) for i in range(2)]
+        prompts = [Prompt.objects.create(text=f'Prompt {i}') for i in range(2)]
+        self.images = [Card.objects.create(profile=self.profile, answer=f'Image {i}') for i in range(6)]
+        self.prompt_cards = [
+            Card.objects.create(profile=self.profile, prompt=prompts[i % 2], answer=f'Answer {i}') for i in range(4)
+        ]
+        for loser in self.images[1:]:
+            Duel.objects.create(winner=self.images[0], loser=loser, judge=self.judges[0])
+        Duel.objects.create(winner=self.prompt_cards[3], loser=self.prompt_cards[1], judge=self.judges[1])
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+        self.url = reverse('final_results', args=[self.profile.id])
+
+    def reveal(self):
+        self.profile.results_available = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+
+    def test_reveal_builds_every_segment(self):
+        self.reveal()
+        snapshots = {snapshot.segment: snapshot for snapshot in ResultsSnapshot.objects.filter(profile=self.profile)}
+        self.assertEqual(set(snapshots), {'all', 'men', 'women'} | {str(judge.id) for judge in self.judges})
+
+        # Pattern image, prompt, image, image, prompt, image, prompt, image with one card per prompt
+        entries = snapshots['all'].entries
+        self.assertEqual(entries[0][0], self.images[0].id)
+        self.assertEqual(entries[1][0], self.prompt_cards[3].id)
+        self.assertEqual(len(entries), 5 + 2)
+        self.assertEqual(len({card_id for card_id, _ in entries}), len(entries))
+
+        # Saving again without flipping the flag rebuilds nothing
+        ResultsSnapshot.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        self.assertFalse(ResultsSnapshot.objects.exists())
+
+    def test_page_renders_from_snapshot(self):
+        self.reveal()
+        cache.clear()
+        with self.assertNumQueries(6):  # profile, session, data version, snapshot, cards, participants
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['final_list'][0], self.images[0])
+        self.assertEqual(response.context['filter_label'], 'Alle rangeringer')
+
+    def test_stale_snapshot_refreshes_after_interval(self):
+        self.reveal()
+        for _ in range(4):
+            Duel.objects.create(winner=self.images[5], loser=self.images[0], judge=self.judges[0])
+        old = ResultsSnapshot.objects.get(profile=self.profile, segment='all')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['final_list'][0].elo_rating, old.entries[0][1])
+        # The stale page is neither cached nor tagged as the current version
+        self.assertFalse(response.has_header('ETag'))
+
+        ResultsSnapshot.objects.update(updated_at=timezone.now() - results.REFRESH_INTERVAL * 2)
+        response = self.client.get(self.url)
+        snapshot = ResultsSnapshot.objects.get(profile=self.profile, segment='all')
+        self.assertGreater(snapshot.data_version, old.data_version)
+        self.assertLess(response.context['final_list'][0].elo_rating, old.entries[0][1])
+        self.assertTrue(response.has_header('ETag'))
+
+
+class SingleFlightTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_concurrently(self, target, count=100):
+        start = threading.Barrier(count)
+        results = []
+
+        def run():
+            start.wait()
+            try:
+                results.append(target())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_tests_keep_out_of_the_project_cache(self):
+        project_cache = str(settings.BASE_DIR / 'cache')
+        self.assertNotEqual(str(settings.CACHES['default']['LOCATION']), project_cache)
+        self.assertFalse(str(settings.SINGLE_FLIGHT_LOCK_DIR).startswith(project_cache))
+
+    def test_concurrent_callers_share_one_computation(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'value': len(calls)}
+
+        results = self.run_concurrently(lambda: singleflight.single_flight('test-key', compute, 60))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 100)
+
+    def test_waits_for_computation_in_other_process(self):
+        # Another process holds the lock and stores its result after a while
+        lock_path = singleflight._lock_path('test-key')
+        self.assertTrue(singleflight._acquire(lock_path))
+        self.addCleanup(os.remove, lock_path)
+        threading.Timer(0.2, lambda: cache.set('test-key', 'theirs')).start()
+        compute = mock.Mock(return_value='ours')
+        self.assertEqual(singleflight.single_flight('test-key', compute, 60), 'theirs')
+        compute.assert_not_called()
+
+    def test_lock_of_dead_process_expires(self):
+        lock_path = singleflight._lock_path('test-key')
+        self.assertTrue(singleflight._acquire(lock_path))
+        self.assertFalse(singleflight._acquire(lock_path))
+        expired = time.time() - singleflight.LOCK_TIMEOUT - 1
+        os.utime(lock_path, (expired, expired))
+        self.assertEqual(singleflight.single_flight('test-key', lambda: 'ours', 60), 'ours')
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_100_concurrent_requests_render_once(self):
+        profile = Profile.objects.create(name='Test')
+        judge = Participant.objects.create(profile=profile, name='Judge')
+        cards = [Card.objects.create(profile=profile, answer=str(i), uploader=judge) for i in range(4)]
+        Duel.objects.create(winner=cards[0], loser=cards[1], judge=judge)
+        factory = RequestFactory()
+
+        def request():
+            request = factory.get(reverse('stats', args=[profile.id]))
+            request.session = {'profile_id': profile.id}
+            return views.stats(request, profile.id)
+
+        def slow_page(*args, **kwargs):
+            time.sleep(0.2)
+            return leaderboard_page(*args, **kwargs)
+
+        with mock.patch.object(views, 'leaderboard_page', side_effect=slow_page) as page:
+            responses = self.run_concurrently(request)
+        # One render computes the image and the prompt leaderboard
+        self.assertEqual(page.call_count, 2)
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.content for response in responses}), 1)
+
+
+class PromptAssignmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = Profile.objects.create(name='Test', random_prompts_mode=True)
+        self.judges = [Participant.objects.create(profile=self.profile, name=f'Judge {i}') for i in range(2)]
+        self.prompts = [Prompt.objects.create(text=f'Prompt {i}') for i in range(5)]
+        self.url = reverse('upload_prompt_card', args=[self.profile.id])
+
+    def login(self, participant):
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session['participant_id'] = participant.id
+        session.save()
+
+    def test_post_answers_prompt_shown_on_get(self):
+        self.login(self.judges[0])
+        shown = self.client.get(self.url).context['assigned_prompt']
+        self.assertEqual(self.client.get(self.url).context['assigned_prompt'], shown)
+
+        other = next(prompt for prompt in self.prompts if prompt != shown)
+        response = self.client.post(self.url, {'prompt': other.id, 'answer': 'Svar'})
+        self.assertRedirects(response, reverse('profile_home', args=[self.profile.id]), fetch_redirect_response=False)
+        card = Card.objects.get(uploader=self.judges[0])
+        self.assertEqual(card.prompt, shown)
+
+        self.assertNotEqual(self.client.get(self.url).context['assigned_prompt'], shown)
+
+    def test_draws_avoid_used_prompts(self):
+        rng = random.Random(1)
+        drawn = []
+        for i in range(5):
+            assignment = prompts.assign_prompt(self.profile, self.judges[i % 2], rng)
+            prompts.mark_answered(assignment)
+            drawn.append(assignment.prompt_id)
+        self.assertEqual(sorted(drawn), [prompt.id for prompt in self.prompts])
+
+        # With every prompt used in the profile, a participant still gets one they have not had
+        assignment = prompts.assign_prompt(self.profile, self.judges[0], rng)
+        self.assertIn(assignment.prompt_id, drawn[1::2])
+
+    def test_draw_does_not_load_prompt_table(self):
+        prompts.prompt_ids()
+        # Used prompts are not loaded, the drawn one is looked up with the index
+        for prompt in self.prompts[:2]:
+            PromptAssignment.objects.create(profile=self.profile, participant=self.judges[1], prompt=prompt, answered_at=timezone.now())
+        with self.assertNumQueries(4) as queries:  # pending assignment, drawn prompt used, prompt, insert
+            prompts.assign_prompt(self.profile, self.judges[0], random.Random(0))
+        self.assertIn('LIMIT 1', queries.captured_queries[1]['sql'])
+
+    def test_new_prompt_refreshes_cached_ids(self):
+        prompts.prompt_ids()
+        with self.captureOnCommitCallbacks(execute=True):
+            prompt = Prompt.objects.create(text='New')
+        self.assertIn(prompt.id, prompts.prompt_ids())
+
+
+class ImportPromptsTests(TestCase):
+    def write(self, content, compress=False):
+        data = content.encode()
+        if compress:
+            data = gzip.compress(data)
+        handle = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
+        handle.write(data)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def run_command(self, *args, stdin=None):
+        out = io.StringIO()
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_prompts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_imports_new_unique_prompts(self):
+        Prompt.objects.create(text='Old')
+        path = self.write('Old\nNew 1\n\n  New 2  \nNew 1\n' + 'x' * 300 + '\n')
+        output = self.run_command(path)
+        self.assertEqual(sorted(Prompt.objects.values_list('text', flat=True)), ['New 1', 'New 2', 'Old'])
+        self.assertIn('2 prompts created, 1 already existed, 1 duplicate lines, 1 blank lines, 1 longer', output)
+
+    def test_prompts_added_meanwhile_are_not_counted_as_created(self):
+        path = self.write('New 1\nNew 2\n')
+        insert = import_prompts.Command.insert
+
+        def insert_after_someone_else(command, texts, *args):
+            Prompt.objects.create(text='New 1')
+            return insert(command, texts, *args)
+
+        with mock.patch.object(import_prompts.Command, 'insert', insert_after_someone_else):
+            output = self.run_command(path)
+        self.assertEqual(Prompt.objects.count(), 2)
+        self.assertIn('1 prompts created, 1 already existed', output)
+
+    def test_large_import_inserts_in_chunks(self):
+        path = self.write(''.join(f'Prompt {i}\n' for i in range(2500)), compress=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.run_command(path, '--chunk-size', '1000')
+        self.assertEqual(Prompt.objects.count(), 2500)
+        # A handful of bulk inserts (SQLite caps the rows per statement), not one per line
+        self.assertLess(len(queries.captured_queries), 15)
+
+    def test_stdin_and_dry_run(self):
+        stdin = io.TextIOWrapper(io.BytesIO(gzip.compress('A\nB\nA\n'.encode())))
+        output = self.run_command('-', '--dry-run', stdin=stdin)
+        self.assertIn('2 prompts would be created', output)
+        self.assertFalse(Prompt.objects.exists())
+
+
+def fake_poster(path):
+    """
+    Poster extractor for tests: a grey JPEG the size of a phone video frame.
+    """
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (1080, 1920), 'grey').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def broken_poster(path):
+    raise ValueError('No frame could be read.')
+
+
+class MediaProcessingTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.profile = Profile.objects.create(name='Test')
+
+    def upload(self, name, content=None):
+        if content is None:
+            buffer = io.BytesIO()
+            # Pillow picks the decoder from the content, so a PNG stands in for HEIC
+            PILImage.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+            content = buffer.getvalue()
+        return Card.objects.create(profile=self.profile, image=SimpleUploadedFile(name, content))
+
+    def test_heic_upload_is_converted_in_background(self):
+        card = self.upload('photo.HEIC')
+        self.assertEqual(card.processing_status, 'pending')
+        self.assertTrue(card.image.name.endswith('.heic'))
+        job = MediaJob.objects.get(card=card)
+        self.assertEqual((job.kind, job.status), ('convert_heic', 'queued'))
+        raw_path = card.image.path
+
+        # Conversion, then the renditions of the converted image; the raw file goes once committed
+        with mock.patch.object(media.processor, 'wake'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(media.process_pending(), 2)
+        card.refresh_from_db()
+        self.assertEqual(card.processing_status, 'ready')
+        self.assertTrue(card.image.name.endswith('.jpg'))
+        with PILImage.open(card.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+        self.assertFalse(os.path.exists(raw_path))
+        self.assertEqual(set(MediaJob.objects.filter(card=card).values_list('kind', 'status')), {('convert_heic', 'done'), ('renditions', 'done')})
+        self.assertEqual(set(card.renditions), {'thumb', 'medium', 'large'})
+
+    def test_other_uploads_are_ready_at_once(self):
+        card = self.upload('photo.png')
+        self.assertEqual(card.processing_status, 'ready')
+        self.assertEqual(list(MediaJob.objects.values_list('kind', flat=True)), ['renditions'])
+
+    def test_renditions_are_resized(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (2000, 1000), 'blue').save(buffer, format='JPEG')
+        card = self.upload('photo.jpg', buffer.getvalue())
+        self.assertEqual(card.thumb_url, card.image.url)  # original until rendered
+        media.process_pending()
+        card.refresh_from_db()
+
+        self.assertEqual({name: r['width'] for name, r in card.renditions.items()}, {'thumb': 160, 'medium': 800, 'large': 1600})
+        for rendition in card.renditions.values():
+            self.assertTrue(rendition['webp'].startswith('card_images/'))
+            with PILImage.open(card.image.storage.path(rendition['webp'])) as image:
+                self.assertEqual((image.format, image.size), ('WEBP', (rendition['width'], rendition['width'] // 2)))
+            with PILImage.open(card.image.storage.path(rendition['jpeg'])) as image:
+                self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(card.thumb_url, card.image.storage.url(card.renditions['thumb']['jpeg']))
+        self.assertRegex(card.webp_srcset, r'^\S+\.webp 160w, \S+\.webp 800w, \S+\.webp 1600w$')
+
+    def test_backfill_command_renders_missing_renditions(self):
+        cards = [self.upload(f'photo{i}.png') for i in range(3)]
+        MediaJob.objects.all().delete()
+        out = io.StringIO()
+        call_command('backfill_renditions', '--workers', '1', stdout=out)
+        self.assertIn('3 cards rendered, 0 failed', out.getvalue())
+        for card in cards:
+            card.refresh_from_db()
+            self.assertEqual(card.renditions['thumb']['width'], 8)
+        out = io.StringIO()
+        call_command('backfill_renditions', '--workers', '1', stdout=out)
+        self.assertIn('No cards need renditions', out.getvalue())
+
+    @mock.patch.object(media, 'RETRY_DELAY', timedelta(0))
+    def test_broken_upload_fails_after_retries(self):
+        card = self.upload('photo.heic', b'not an image')
+        with mock.patch.object(media.processor, 'wake_later'):
+            self.assertEqual(media.process_pending(), media.MAX_ATTEMPTS)
+        card.refresh_from_db()
+        self.assertEqual(card.processing_status, 'failed')
+        job = MediaJob.objects.get(card=card)
+        self.assertEqual((job.status, job.attempts), ('failed', media.MAX_ATTEMPTS))
+
+    def test_failed_job_is_retried_after_backoff(self):
+        card = self.upload('photo.heic', b'not an image')
+        with mock.patch.object(media.processor, 'wake_later') as wake_later:
+            self.assertEqual(media.process_pending(), 1)
+            wake_later.assert_called_once_with(media.RETRY_DELAY)
+        job = MediaJob.objects.get(card=card)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIsNone(media.claim_next())
+
+        MediaJob.objects.update(run_after=timezone.now())
+        with mock.patch.object(media.processor, 'wake_later') as wake_later:
+            self.assertEqual(media.process_pending(), 1)
+            wake_later.assert_called_once_with(media.RETRY_DELAY * 2)
+
+    def test_database_error_requeues_job_and_drops_its_files(self):
+        card = self.upload('photo.png')
+        with mock.patch.object(Card, 'save', side_effect=OperationalError('database is locked')), \
+                mock.patch.object(media.processor, 'wake_later'):
+            self.assertEqual(media.process_pending(), 1)
+        job = MediaJob.objects.get(card=card)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('database is locked', job.error)
+        self.assertEqual(set(Blob.objects.filter(refcount__gt=0).values_list('name', flat=True)), {card.image.name})
+
+    def test_job_deleted_after_claim_is_skipped(self):
+        card = self.upload('photo.png')
+        get_job = MediaJob.objects.select_related
+
+        def deleted_meanwhile(*fields):
+            card.delete()
+            return get_job(*fields)
+
+        with mock.patch.object(MediaJob.objects, 'select_related', side_effect=deleted_meanwhile):
+            self.assertIsNone(media.claim_next())
+
+    def test_stale_running_job_is_requeued(self):
+        card = self.upload('photo.heic')
+        MediaJob.objects.update(status='running', updated_at=timezone.now() - media.STALE_AFTER * 2)
+        self.assertIsNone(media.claim_next())
+        self.assertEqual(media.requeue_stale(), 1)
+        self.assertEqual(media.claim_next().card, card)
+
+    def test_pending_cards_stay_out_of_ranking_and_show_placeholder(self):
+        ready = [Card.objects.create(profile=self.profile, answer=str(i)) for i in range(2)]
+        pending = self.upload('photo.heic')
+        sampler.invalidate(self.profile.id)
+        drawn = {card_id for _ in range(30) for card_id in sampler.draw_pair(self.profile, 'image')}
+        self.assertEqual(drawn, {card.id for card in ready})
+
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+        response = self.client.get(reverse('card_detail', args=[self.profile.id, pending.id]))
+        self.assertContains(response, 'Bildet behandles')
+        self.assertNotContains(response, pending.image.url)
+
+    @override_settings(POSTER_EXTRACTOR='core.tests.fake_poster')
+    def test_video_upload_gets_poster_frame(self):
+        card = Card.objects.create(profile=self.profile, video=SimpleUploadedFile('clip.mp4', b'not really a video'))
+        self.assertEqual(card.processing_status, 'ready')
+        self.assertEqual(list(MediaJob.objects.values_list('kind', flat=True)), ['poster'])
+        self.assertEqual(media.process_pending(), 1)
+        card.refresh_from_db()
+        self.assertRegex(card.poster.name, r'^card_posters/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertIn(card.poster.name, card.media_files())
+
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+        response = self.client.get(reverse('card_detail', args=[self.profile.id, card.id]))
+        self.assertContains(response, f'preload="none" poster="{card.poster.url}"')
+
+    @override_settings(POSTER_EXTRACTOR='core.tests.broken_poster')
+    @mock.patch.object(media, 'RETRY_DELAY', timedelta(0))
+    def test_failed_poster_leaves_video_playable(self):
+        card = Card.objects.create(profile=self.profile, video=SimpleUploadedFile('clip.mp4', b'not really a video'))
+        with mock.patch.object(media.processor, 'wake_later'):
+            self.assertEqual(media.process_pending(), media.MAX_ATTEMPTS)
+        card.refresh_from_db()
+        self.assertEqual(card.processing_status, 'ready')
+        self.assertFalse(card.poster)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.profile = Profile.objects.create(name='Test')
+        self.participant = Participant.objects.create(profile=self.profile, name='Guest', gender='F')
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session['participant_id'] = self.participant.id
+        session.save()
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+        self.content = buffer.getvalue()
+
+    def upload(self, name='photo.png'):
+        with mock.patch.object(media.processor, 'wake'):
+            response = self.client.post(reverse('upload_media_card', args=[self.profile.id]), {'image': SimpleUploadedFile(name, self.content)}, follow=True)
+        return response, Card.objects.latest('id')
+
+    def test_same_content_is_stored_once_and_flagged(self):
+        response, first = self.upload()
+        self.assertNotContains(response, 'merket som duplikat')
+        self.assertEqual(first.upload_digest, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(first.image.name, f'card_images/{first.upload_digest[:2]}/{first.upload_digest}.png')
+
+        response, second = self.upload('IMG_0001.PNG')
+        self.assertContains(response, 'merket som duplikat')
+        self.assertEqual((second.image.name, second.duplicate_of), (first.image.name, first))
+        self.assertEqual(Blob.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'card_images', first.upload_digest[:2]))), 1)
+
+        other_profile = Profile.objects.create(name='Other')
+        other = Card.objects.create(profile=other_profile, image=SimpleUploadedFile('photo.png', self.content))
+        self.assertEqual(other.image.name, first.image.name)
+        self.assertIsNone(other.duplicate_of)
+
+    def test_blobs_are_deleted_with_their_last_reference(self):
+        _, first = self.upload()
+        _, second = self.upload()
+        with mock.patch.object(media.processor, 'wake'):
+            media.process_pending()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.renditions, second.renditions)
+        path = first.image.path
+        files = [os.path.join(self.media_root, name) for name in first.media_files()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_card', args=[self.profile.id, first.id]))
+        self.assertTrue(all(os.path.exists(file) for file in files))
+        self.assertEqual(Blob.objects.get(name=second.image.name).refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_card', args=[self.profile.id, second.id]))
+        self.assertFalse(any(os.path.exists(file) for file in files))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+
+
+    def test_upload_is_stored_before_the_transaction(self):
+        storage = Card._meta.get_field('image').storage
+        depth = len(connection.atomic_blocks)
+        store = storage._store
+
+        def store_outside_transaction(*args):
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            return store(*args)
+
+        with mock.patch.object(storage, '_store', side_effect=store_outside_transaction):
+            card = Card.objects.create(profile=self.profile, image=SimpleUploadedFile('photo.png', self.content))
+        self.assertEqual(Blob.objects.get(name=card.image.name).refcount, 1)
+
+        # A card that fails to insert releases the file it stored
+        name = card.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            card.delete()
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(Card, 'find_duplicate', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                Card.objects.create(profile=self.profile, image=SimpleUploadedFile('photo.png', self.content))
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(os.path.exists(storage.path(name)))
+
+    def test_collect_keeps_a_file_retained_again(self):
+        storage = Card._meta.get_field('image').storage
+        name = storage.save('card_images/photo.png', ContentFile(self.content))
+        path = storage.path(name)
+        # A concurrent save retained the name before the released reference was collected
+        Blob.objects.filter(name=name).update(refcount=1)
+        storage._collect(name)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(Blob.objects.filter(name=name).exists())
+        self.assertEqual(os.listdir(storage.path('tmp')), [])
+
+    def test_files_without_blob_are_deleted_on_commit(self):
+        storage = Card._meta.get_field('image').storage
+        path = storage.path('chunked_uploads/part.mp4')
+        os.makedirs(os.path.dirname(path))
+        open(path, 'wb').close()
+        with self.captureOnCommitCallbacks(execute=True):
+            storage.delete('chunked_uploads/part.mp4')
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_cached_pages_show_pending_messages(self):
+        _, card = self.upload()
+        url = reverse('card_detail', args=[self.profile.id, card.id])
+        with mock.patch.object(media.processor, 'wake'):
+            self.client.post(reverse('upload_media_card', args=[self.profile.id]), {'image': SimpleUploadedFile('again.png', self.content)})
+        self.assertContains(self.client.get(url), 'merket som duplikat')
+        # Shown once, and not cached with the page
+        self.assertNotContains(self.client.get(url), 'merket som duplikat')
+
+
+class MediaServingTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(media_root, 'card_videos'))
+        self.content = bytes(range(256)) * 40
+        with open(os.path.join(media_root, 'card_videos', 'clip.mp4'), 'wb') as file:
+            file.write(self.content)
+        self.url = '/media/card_videos/clip.mp4'
+
+    def test_whole_file_with_validators_and_immutable_caching(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['ETag'] and response['Last-Modified'])
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_byte_ranges(self):
+        size = len(self.content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size - 5}-')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        # A range of a changed file gets the whole new file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_offload_to_web_server(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/card_videos/clip.mp4')
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SERVE_MODE='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertTrue(response['X-Sendfile'].endswith(os.path.join('card_videos', 'clip.mp4')))
+
+    def test_paths_outside_media_root_are_not_served(self):
+        request = RequestFactory().get('/')
+        for path in ('../manage.py', '/etc/passwd'):
+            with self.assertRaises(Http404):
+                serving.serve_media(request, path)
+        self.assertEqual(self.client.get('/media/card_videos/missing.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/card_videos/').status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_files_being_written_are_not_served(self):
+        for directory in (uploads.PARTIAL_DIR, 'tmp'):
+            os.makedirs(os.path.join(settings.MEDIA_ROOT, directory))
+            with open(os.path.join(settings.MEDIA_ROOT, directory, 'part.mp4'), 'wb') as file:
+                file.write(self.content)
+            self.assertEqual(self.client.get(f'/media/{directory}/part.mp4').status_code, 404)
+            self.assertEqual(self.client.get(f'/media/card_videos/../{directory}/part.mp4').status_code, 404)
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.profile = Profile.objects.create(name='Test')
+        self.participant = Participant.objects.create(profile=self.profile, name='Guest', gender='F')
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session['participant_id'] = self.participant.id
+        session.save()
+        self.content = os.urandom(300_000)
+
+    def start(self, field='video', filename='clip.mp4', size=None):
+        size = len(self.content) if size is None else size
+        return self.client.post(reverse('upload_start', args=[self.profile.id]), {'field': field, 'filename': filename, 'size': size})
+
+    def put(self, url, offset, data):
+        return self.client.put(url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload_resumes_and_creates_card(self):
+        upload = self.start().json()
+        self.assertEqual(upload['offset'], 0)
+        chunk = 100_000
+        self.assertEqual(self.put(upload['url'], 0, self.content[:chunk]).json()['offset'], chunk)
+
+        # A retried chunk the server already has is refused with the offset to resume from
+        response = self.put(upload['url'], 0, self.content[:chunk])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, chunk))
+        self.assertEqual(self.client.get(upload['url']).json()['offset'], chunk)
+        self.assertEqual(self.client.post(upload['finish_url']).status_code, 409)
+
+        for offset in range(chunk, len(self.content), chunk):
+            self.put(upload['url'], offset, self.content[offset:offset + chunk])
+        response = self.client.post(upload['finish_url'])
+        self.assertEqual(response.status_code, 201)
+
+        card = Card.objects.get(id=response.json()['card'])
+        self.assertRegex(card.video.name, r'^card_videos/[0-9a-f]{2}/[0-9a-f]{64}\.mp4$')
+        with card.video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(card.uploader, self.participant)
+        self.assertEqual(list(card.media_jobs.values_list('kind', flat=True)), ['poster'])
+
+        # A retried finish whose first attempt got through gets the same card
+        retry = self.client.post(upload['finish_url'])
+        self.assertEqual((retry.status_code, retry.json()['card']), (200, card.id))
+        self.assertEqual(Card.objects.count(), 1)
+        self.assertEqual(ChunkedUpload.objects.get().card, card)
+
+    def test_finish_stores_the_file_before_the_transaction(self):
+        upload = self.start().json()
+        self.put(upload['url'], 0, self.content)
+        stale = ChunkedUpload.objects.get()
+        storage = Card._meta.get_field('video').storage
+        depth = len(connection.atomic_blocks)
+        store_file = storage.store_file
+
+        def store_outside_transaction(*args):
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            return store_file(*args)
+
+        with mock.patch.object(storage, 'store_file', side_effect=store_outside_transaction):
+            card = uploads.finish_upload(ChunkedUpload.objects.get())
+
+        # A finish that read the upload before the first one moved the file
+        # gets the card the first one created
+        self.assertEqual(uploads.finish_upload(stale), card)
+        # One that stored the file again releases it
+        stale.card_id = None
+        with open(storage.path(stale.file_name), 'wb') as file:
+            file.write(self.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(uploads.finish_upload(stale), card)
+        self.assertEqual(Blob.objects.get(name=card.video.name).refcount, 1)
+        self.assertEqual(Card.objects.count(), 1)
+
+    def test_chunk_for_purged_upload_is_gone(self):
+        upload = self.start().json()
+        partial = ChunkedUpload.objects.get()
+        os.remove(Card._meta.get_field('video').storage.path(partial.file_name))
+        response = self.put(upload['url'], 0, self.content[:100])
+        self.assertEqual(response.status_code, 410)
+
+    def test_chunks_must_stay_within_the_file(self):
+        upload = self.start().json()
+        self.assertEqual(self.put(upload['url'], 0, self.content + b'x').status_code, 400)
+        self.assertEqual(self.start(size=uploads.MAX_SIZES['video'] + 1).status_code, 400)
+        self.assertEqual(self.start(field='image', filename='notes.txt', size=10).status_code, 400)
+
+    def test_prompt_answer_and_invalid_image(self):
+        prompt = Prompt.objects.create(text='Beste ferie?')
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (8, 8), 'red').save(buffer, format='PNG')
+        upload = self.start(field='image', filename='ferie.png', size=len(buffer.getvalue())).json()
+        self.put(upload['url'], 0, buffer.getvalue())
+        self.assertEqual(self.client.post(upload['finish_url'], {'flow': 'prompt'}).status_code, 400)
+        response = self.client.post(upload['finish_url'], {'flow': 'prompt', 'prompt': prompt.id})
+        card = Card.objects.get(id=response.json()['card'])
+        self.assertEqual(card.prompt, prompt)
+        self.assertTrue(card.image.name.endswith('.png'))
+
+        upload = self.start(field='image', filename='fake.png', size=4).json()
+        self.put(upload['url'], 0, b'fake')
+        self.assertEqual(self.client.post(upload['finish_url']).status_code, 400)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'card_images', 'fake.png')))
+
+    def test_other_guests_cannot_touch_an_upload(self):
+        upload = self.start().json()
+        other = Participant.objects.create(profile=self.profile, name='Other', gender='M')
+        session = self.client.session
+        session['participant_id'] = other.id
+        session.save()
+        self.assertEqual(self.put(upload['url'], 0, b'x').status_code, 404)
+
+    def test_abandoned_uploads_are_purged(self):
+        upload = self.start().json()
+        upload = ChunkedUpload.objects.get(id=upload['id'])
+        path = os.path.join(settings.MEDIA_ROOT, upload.file_name)
+        self.assertTrue(os.path.exists(path))
+        ChunkedUpload.objects.update(updated_at=timezone.now() - uploads.UPLOAD_EXPIRY * 2)
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_uploads', stdout=out)
+        self.assertIn('1 abandoned uploads deleted', out.getvalue())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+class WeightedPoolTests(SimpleTestCase):
+    def test_tree_tracks_set_and_remove(self):
+        pool = sampler.WeightedPool()
+        weights = {card_id: (card_id % 7 + 1) / 8 for card_id in range(1, 40)}
+        for card_id, weight in weights.items():
+            pool.set(card_id, weight)
+        for card_id in (3, 39, 17):
+            pool.remove(card_id)
+            del weights[card_id]
+        pool.set(5, 0.9)
+        weights[5] = 0.9
+
+        self.assertEqual(len(pool), len(weights))
+        self.assertEqual(dict(zip(pool.card_ids, pool.weights)), weights)
+        for i in range(len(pool) + 1):
+            self.assertAlmostEqual(pool._prefix(i), sum(pool.weights[:i]))
+
+    def test_draws_are_distinct_and_weighted(self):
+        pool = sampler.WeightedPool()
+        pool.set('heavy', 0.9)
+        pool.set('light', 0.1)
+        pool.set('mid', 0.5)
+
+        rng = random.Random(0)
+        firsts = []
+        for _ in range(3000):
+            first, second = pool.draw_pair(rng)
+            self.assertNotEqual(first, second)
+            firsts.append(first)
+        self.assertAlmostEqual(firsts.count('heavy') / 3000, 0.9 / 1.5, delta=0.03)
+        self.assertAlmostEqual(firsts.count('light') / 3000, 0.1 / 1.5, delta=0.03)
+
+    def test_information_mode_favours_open_duels(self):
+        pool = sampler.CardPool()
+        for card_id in range(10):
+            pool.set(card_id, 1000 + 100 * card_id, 20, 20)
+        pool.set('new', 1450, 0, 0)
+
+        rng = random.Random(0)
+        pairs = [pool.draw_pair('information', rng) for _ in range(2000)]
+        self.assertTrue(all(first != second for first, second in pairs))
+        # The unplayed card is in most duels, mostly against cards close in rating
+        with_new = [pair for pair in pairs if 'new' in pair]
+        self.assertGreater(len(with_new), 1000)
+        opponents = [first if second == 'new' else second for first, second in with_new]
+        self.assertGreater(opponents.count(4) + opponents.count(5), 2 * (opponents.count(0) + opponents.count(9)))
+
+
+class PairSamplerTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judge = Participant.objects.create(profile=self.profile, name='Judge')
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i), uploader=self.judge) for i in range(3)]
+        sampler.invalidate(self.profile.id)
+
+    def test_writes_update_sampler_in_place(self):
+        self.profile.refresh_from_db()
+        pools = sampler.get_sampler(self.profile).pools
+        self.assertEqual(len(pools['image']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Duel.objects.create(winner=self.cards[0], loser=self.cards[1], judge=self.judge)
+        with self.captureOnCommitCallbacks(execute=True):
+            extra = Card.objects.create(profile=self.profile, answer='x', uploader=self.judge)
+
+        # Every write was applied in place, so the sampler matches the new version
+        self.profile.refresh_from_db()
+        with mock.patch.object(sampler, '_build') as build:
+            current = sampler.get_sampler(self.profile)
+        build.assert_not_called()
+
+        pool = current.pools['image'].by_win_rate
+        weights = dict(zip(pool.card_ids, pool.weights))
+        self.assertEqual(weights, {self.cards[0].id: 2 / 3, self.cards[1].id: 1 / 3, self.cards[2].id: 1 / 2, extra.id: 1 / 2})
+
+        # Deleting a card replays the ratings, after which the sampler is rebuilt
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cards[2].delete()
+        self.profile.refresh_from_db()
+        pool = sampler.get_sampler(self.profile).pools['image'].by_win_rate
+        self.assertNotIn(self.cards[2].id, pool.card_ids)
+
+    def test_foreign_write_triggers_rebuild(self):
+        self.profile.refresh_from_db()
+        sampler.get_sampler(self.profile)
+        Profile.bump_data_version(self.profile.id)
+
+        self.profile.refresh_from_db()
+        self.assertEqual(sampler.get_sampler(self.profile).version, self.profile.data_version)
+
+
+class VoteApiTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judge = Participant.objects.create(profile=self.profile, name='Judge')
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i), uploader=self.judge) for i in range(4)]
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session['participant_id'] = self.judge.id
+        session.save()
+
+    def test_vote_returns_next_pair_and_queue(self):
+        page = self.client.get(reverse('rank_cards', args=[self.profile.id, 'image']))
+        self.assertEqual(len(page.context['queue']), 2)
+        card1, card2 = page.context['card1'], page.context['card2']
+
+        response = self.client.post(reverse('vote', args=[self.profile.id, 'image']), {'winner': card1.id, 'loser': card2.id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        duel = Duel.objects.get()
+        self.assertEqual((duel.winner, duel.loser, duel.judge, duel.profile), (card1, card2, self.judge, self.profile))
+        # The page's queue moves up and gets topped up
+        self.assertEqual(data['pair'], page.context['queue'][0])
+        self.assertEqual(data['queue'][0], page.context['queue'][1])
+        self.assertEqual(len(data['queue']), 2)
+        self.assertEqual(set(data['pair'][0]), {'id', 'prompt', 'answer', 'image', 'srcset', 'webp_srcset', 'video', 'poster'})
+
+    def test_resubmitted_vote_is_counted_once(self):
+        page = self.client.get(reverse('rank_cards', args=[self.profile.id, 'image']))
+        vote = {'winner': page.context['card1'].id, 'loser': page.context['card2'].id}
+
+        first = self.client.post(reverse('vote', args=[self.profile.id, 'image']), vote).json()
+        # A retry after a lost response, then the form post fallback
+        again = self.client.post(reverse('vote', args=[self.profile.id, 'image']), vote).json()
+        response = self.client.post(reverse('rank_cards', args=[self.profile.id, 'image']), vote)
+
+        self.assertEqual(Duel.objects.count(), 1)
+        self.assertEqual(again['pair'], first['pair'])
+        self.assertRedirects(response, reverse('rank_cards', args=[self.profile.id, 'image']))
+
+    def test_vote_requires_participant(self):
+        session = self.client.session
+        del session['participant_id']
+        session.save()
+        response = self.client.post(reverse('vote', args=[self.profile.id, 'image']), {'winner': self.cards[0].id, 'loser': self.cards[1].id})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Duel.objects.exists())
+
+
+class DuelWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judges = [Participant.objects.create(profile=self.profile, name=f'Judge {i}') for i in range(3)]
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i)) for i in range(5)]
+
+    def expected(self):
+        duels = Duel.objects.filter(profile=self.profile).order_by('created_at', 'id')
+        return calculate_elo(self.cards, duels)
+
+    def test_batch_matches_single_writes(self):
+        rng = random.Random(2)
+        duels = []
+        for _ in range(40):
+            winner, loser = rng.sample(self.cards, 2)
+            duels.append(Duel(profile=self.profile, winner=winner, loser=loser, judge=rng.choice(self.judges + [None])))
+        writer.write_duels(duels[:25])
+        writer.write_duels(duels[25:])
+
+        self.assertEqual(get_ratings(self.profile), self.expected())
+        self.assertEqual(
+            sum(JudgeVoteCount.objects.filter(profile=self.profile).values_list('votes', flat=True)),
+            sum(1 for duel in duels if duel.judge)
+        )
+
+    def test_concurrent_votes_are_batched(self):
+        acknowledged = []
+        start = threading.Barrier(30)
+
+        def vote(i):
+            start.wait()
+            duel = writer.record_vote(self.profile, self.cards[i % 5], self.cards[(i + 1) % 5], self.judges[i % 3])
+            acknowledged.append(duel.pk)
+            connection.close()
+
+        with mock.patch.object(writer, 'write_duels', wraps=writer.write_duels) as write_duels:
+            threads = [threading.Thread(target=vote, args=(i,)) for i in range(30)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(set(acknowledged) - {None}), 30)
+        self.assertLess(write_duels.call_count, 30)
+        self.assertEqual(Duel.objects.filter(profile=self.profile).count(), 30)
+        self.assertEqual(get_ratings(self.profile), self.expected())
+
+    def test_votes_are_answered_before_commit_callbacks(self):
+        duel_writer = writer.DuelWriter()
+        future = None
+        published = threading.Event()
+        answered = []
+
+        def publish(profile_id, duels=None):
+            answered.append(future.done())
+            published.set()
+
+        with mock.patch.object(signals, 'publish_update', publish):
+            future = duel_writer.submit(Duel(profile=self.profile, winner=self.cards[0], loser=self.cards[1]))
+            self.assertEqual(future.result(timeout=5).winner, self.cards[0])
+            self.assertTrue(published.wait(5))
+        self.assertEqual(answered, [True])
+
+
+class CardDetailTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Test')
+        self.judges = [Participant.objects.create(profile=self.profile, name=f'Judge {i}') for i in range(3)]
+        self.cards = [Card.objects.create(profile=self.profile, answer=str(i)) for i in range(4)]
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session.save()
+        self.url = reverse('card_detail', args=[self.profile.id, self.cards[0].id])
+
+    def vote(self, winner, loser, judge):
+        Duel.objects.create(winner=self.cards[winner], loser=self.cards[loser], judge=judge)
+
+    def test_breakdown_and_head_to_head(self):
+        self.vote(0, 1, self.judges[0])
+        self.vote(0, 1, self.judges[0])
+        self.vote(2, 0, self.judges[0])
+        self.vote(1, 0, self.judges[1])
+        self.vote(0, 3, None)
+        self.vote(2, 3, self.judges[2])
+
+        response = self.client.get(self.url)
+        voters = [(v['name'], v['won'], v['lost'], v['total']) for v in response.context['voter_history']]
+        self.assertEqual(voters, [('Judge 0', 2, 1, 3), ('Judge 1', 0, 1, 1)])
+        head_to_head = [(row['opponent'], row['won'], row['lost'], row['total']) for row in response.context['head_to_head']]
+        self.assertEqual(head_to_head, [
+            (self.cards[1], 2, 1, 3),
+            (self.cards[2], 0, 1, 1),
+            (self.cards[3], 1, 0, 1),
+        ])
+
+    def test_query_count_does_not_grow_with_duels(self):
+        rng = random.Random(3)
+
+        def queries():
+            for _ in range(30):
+                other = rng.randrange(1, 4)
+                if rng.random() < 0.5:
+                    self.vote(0, other, rng.choice(self.judges))
+                else:
+                    self.vote(other, 0, rng.choice(self.judges))
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+            return len(context)
+
+        self.assertEqual(queries(), queries())
+
+
+class QueryBudgetTests(TestCase):
+    # Request method, expected status and the queries allowed per URL name on the
+    # seeded profile, which is large enough that one query per card or per duel
+    # blows the budget
+    BUDGETS = {
+        'index': ('get', 200, 0),
+        'join_profile': ('get', 200, 2),
+        'profile_home': ('get', 200, 4),
+        'upload_media_card': ('get', 200, 3),
+        'upload_prompt_card': ('get', 200, 4),
+        'upload_start': ('post', 201, 5),
+        'upload_chunk': ('put', 200, 5),
+        'upload_finish': ('post', 201, 21),
+        'rank_cards': ('get', 200, 7),
+        'vote': ('post', 200, 19),
+        'stats': ('get', 200, 6),
+        'stats_rows': ('get', 200, 4),
+        'final_results': ('get', 200, 6),
+        'card_detail': ('get', 200, 11),
+        'delete_card': ('post', 302, 24),
+        'live_dashboard': ('get', 200, 5),
+        'live_dashboard_data': ('get', 200, 6),
+        'live_dashboard_chart_data': ('get', 200, 8),
+        'live_dashboard_stream': ('get', 204, 2),
+    }
+    CARD_TYPES = ['image', 'prompt']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = Profile.objects.create(name='Test')
+        cls.judges = [
+            Participant.objects.create(profile=cls.profile, name=f'Judge {i}', gender='MFO'[i % 3])
+            for i in range(12)
+        ]
+        prompts = [Prompt.objects.create(text=f'Prompt {i}') for i in range(6)]
+        cls.cards = [
+            Card.objects.create(
+                profile=cls.profile, uploader=cls.judges[i % 12], answer=f'Card {i}',
+                prompt=prompts[i % 6] if i % 2 else None
+            )
+            for i in range(60)
+        ]
+        rng = random.Random(4)
+        duels = []
+        for _ in range(1500):
+            pool = rng.choice([cls.cards[0::2], cls.cards[1::2]])
+            winner, loser = rng.sample(pool, 2)
+            duels.append(Duel(profile=cls.profile, winner=winner, loser=loser, judge=rng.choice(cls.judges)))
+        writer.write_duels(duels)
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(self.staff)
+        session = self.client.session
+        session['profile_id'] = self.profile.id
+        session['participant_id'] = self.judges[0].id
+        session.save()
+        cache.clear()
+        sampler.invalidate(self.profile.id)
+
+    def requests(self, name, params):
+        """
+        Yields the URL and request arguments of every request to make to the URL
+        name. Each request is built fresh, so ones that change or delete what
+        they are given can be repeated.
+        """
+        kwargs = {'profile_id': self.profile.id} if 'profile_id' in params else {}
+        if name == 'upload_start':
+            yield reverse(name, kwargs=kwargs), {'data': {'field': 'video', 'filename': 'clip.mp4', 'size': 10}}
+        elif name in ('upload_chunk', 'upload_finish'):
+            upload = uploads.start_upload(self.profile, self.judges[0], 'video', 'clip.mp4', 10)
+            if name == 'upload_finish':
+                uploads.append_chunk(upload, 0, io.BytesIO(b'0123456789'), 10)
+                yield reverse(name, kwargs={**kwargs, 'upload_id': upload.id}), {}
+            else:
+                yield reverse(name, kwargs={**kwargs, 'upload_id': upload.id}), {
+                    'data': b'01234', 'content_type': 'application/octet-stream', 'HTTP_UPLOAD_OFFSET': '0',
+                }
+        elif name == 'delete_card':
+            card = Card.objects.create(profile=self.profile, uploader=self.judges[1], answer='Deleted')
+            writer.write_duels([Duel(profile=self.profile, winner=card, loser=self.cards[i], judge=self.judges[i]) for i in range(10)])
+            yield reverse(name, kwargs={**kwargs, 'card_id': card.id}), {}
+        elif name == 'vote':
+            for card_type in self.CARD_TYPES:
+                self.client.get(reverse('rank_cards', args=[self.profile.id, card_type]))
+                winner, loser = self.client.session[f'pair_queue_{self.profile.id}_{card_type}'][0]
+                yield reverse(name, kwargs={**kwargs, 'card_type': card_type}), {'data': {'winner': winner, 'loser': loser}}
+        elif 'card_type' in params:
+            for card_type in self.CARD_TYPES:
+                yield reverse(name, kwargs={**kwargs, 'card_type': card_type}), {}
+        elif 'card_id' in params:
+            yield reverse(name, kwargs={**kwargs, 'card_id': self.cards[0].id}), {}
+        else:
+            yield reverse(name, kwargs=kwargs), {}
+
+    def test_every_url_within_query_budget(self):
+        for pattern in urls.urlpatterns:
+            self.assertIn(pattern.name, self.BUDGETS, 'Give every URL a query budget')
+            method, status, budget = self.BUDGETS[pattern.name]
+            params = pattern.pattern.converters
+            # Warm up the per-process state (pair sampler) first
+            for url, arguments in self.requests(pattern.name, params):
+                cache.clear()
+                with self.captureOnCommitCallbacks(execute=True):
+                    getattr(self.client, method)(url, **arguments)
+            for url, arguments in self.requests(pattern.name, params):
+                with self.subTest(url=url):
+                    cache.clear()
+                    # Count the on_commit work too, which runs within the request
+                    # outside of tests
+                    with QueryRecorder() as recorder, self.captureOnCommitCallbacks(execute=True):
+                        response = getattr(self.client, method)(url, **arguments)
+                    self.assertEqual(response.status_code, status)
+                    self.assertLessEqual(recorder.queries, budget)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('stats', args=[self.profile.id]))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+, total;dur=[\d.]+$')
@@ -0,0 +1,201 @@
+"""
+Resumable chunked uploads.
+
+A phone video is hundreds of megabytes, and a single multipart POST over venue
+Wi-Fi that drops near the end has to start over. Instead the upload page
+starts an upload, appends the file in chunks at the offset the server has
+confirmed, resuming from the server's offset after a failure, and finishes
+it, which creates the Card. Request bodies are copied to a file in the media
+storage in COPY_BUFFER pieces, so memory use does not grow with the chunk or
+file size and nothing is spooled through temporary files. Finishing moves
+that file to its content-addressed name (see core.storage) without copying it.
+The finished upload is kept with its card, so finishing is idempotent: a
+retry whose first attempt got through gets the same card.
+
+Uploads idle for longer than UPLOAD_EXPIRY, finished or not, are deleted
+with their partial file by purge_abandoned, which runs when uploads are started and from
+`manage.py purge_uploads`.
+
+Chunks are written through storage.path(), so this needs a storage on the
+local file system (as the media processing does).
+"""
+from datetime import timedelta
+from django.core.files.base import ContentFile
+from django.core.validators import validate_image_file_extension
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from .models import Card, ChunkedUpload
+import os
+
+# Chunk size the client is told to use; a failed chunk costs at most this much
+CHUNK_SIZE = 4 * 1024 * 1024
+COPY_BUFFER = 64 * 1024
+
+MAX_SIZES = {
+    'image': 50 * 1024 * 1024,
+    'video': 1024 * 1024 * 1024,
+}
+
+UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Storage directory of the files being uploaded
+PARTIAL_DIR = 'chunked_uploads'
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def start_upload(profile, uploader, field, filename, size):
+    """
+    Creates a ChunkedUpload and an empty file in PARTIAL_DIR for its chunks.
+    """
+    if field not in MAX_SIZES:
+        raise UploadError("Ukjent filtype.")
+    if not 0 < size <= MAX_SIZES[field]:
+        raise UploadError(f"Filen må være mellom 1 byte og {MAX_SIZES[field] // (1024 * 1024)} MB.")
+    file_field = Card._meta.get_field(field)
+    if field == 'image':
+        try:
+            validate_image_file_extension(ContentFile(b'', name=filename))
+        except ValidationError as error:
+            raise UploadError(error.messages[0])
+
+    purge_abandoned()
+    upload = ChunkedUpload(profile=profile, uploader=uploader, field=field, size=size)
+    extension = os.path.splitext(filename)[1].lower()
+    upload.file_name = f'{PARTIAL_DIR}/{upload.id}{extension}'
+    path = file_field.storage.path(upload.file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'xb').close()
+    upload.save()
+    return upload
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Writes `length` bytes read from `stream` at `offset`, which must be the
+    offset received so far. Returns the new offset; a chunk cut short by a
+    dropped connection still counts with the bytes that arrived.
+    """
+    if offset != upload.offset:
+        raise UploadError("Feil posisjon i filen.", status=409)
+    if length is None or offset + length > upload.size:
+        raise UploadError("Delen går forbi slutten av filen.")
+
+    storage = Card._meta.get_field(upload.field).storage
+    written = 0
+    try:
+        file = open(storage.path(upload.file_name), 'r+b')
+    except FileNotFoundError:
+        # Purged as abandoned, or finished, since the upload was read
+        raise UploadError("Opplastingen finnes ikke lenger. Start på nytt.", status=410)
+    with file:
+        file.seek(offset)
+        while written < length:
+            data = stream.read(min(COPY_BUFFER, length - written))
+            if not data:
+                break
+            file.write(data)
+            written += len(data)
+
+    # Another request for the same offset may have finished first; it wrote the same bytes
+    updated = ChunkedUpload.objects.filter(id=upload.id, offset=offset).update(
+        offset=offset + written, updated_at=timezone.now()
+    )
+    if not updated:
+        upload.refresh_from_db(fields=['offset'])
+        raise UploadError("Feil posisjon i filen.", status=409)
+    upload.offset = offset + written
+    return upload.offset
+
+
+def finish_upload(upload, prompt=None):
+    """
+    Creates the card of a complete upload, with the uploaded file as its image
+    or video, and records it on the upload. An upload that is already finished
+    returns its card.
+
+    The file is verified and moved into the storage before the transaction,
+    which only creates the card, so the SQLite write lock is not held while a
+    large file is hashed.
+    """
+    if upload.card_id is not None:
+        return upload.card
+    if upload.offset != upload.size:
+        raise UploadError("Opplastingen er ikke ferdig.", status=409)
+    file_field = Card._meta.get_field(upload.field)
+    storage = file_field.storage
+    path = storage.path(upload.file_name)
+
+    if upload.field == 'image':
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except FileNotFoundError:
+            return finishing_elsewhere(upload)
+        except Exception:
+            delete_upload(upload)
+            raise UploadError("Filen er ikke et gyldig bilde.")
+
+    try:
+        name = storage.store_file(path, file_field.generate_filename(None, os.path.basename(upload.file_name)))
+    except FileNotFoundError:
+        return finishing_elsewhere(upload)
+
+    card = None
+    try:
+        with transaction.atomic():
+            # Locks the upload, so the card is only created once
+            current = ChunkedUpload.objects.select_for_update().select_related('card').filter(id=upload.id).first()
+            if current is not None and current.card_id is None:
+                card = Card(profile=upload.profile, uploader=upload.uploader, prompt=prompt)
+                # The file is already stored; assigning the name stores no copy
+                setattr(card, upload.field, name)
+                card.save()
+                ChunkedUpload.objects.filter(id=upload.id).update(card=card, updated_at=timezone.now())
+    finally:
+        if card is None:
+            # Failed, purged or finished by another request; release the stored file
+            storage.delete(name)
+    if current is None:
+        raise UploadError("Fant ikke opplastingen.", status=404)
+    if current.card_id is not None:
+        return current.card
+    upload.card = card
+    return card
+
+
+def finishing_elsewhere(upload):
+    """
+    The card of an upload whose file another request has already moved into
+    the storage, once that request has created it.
+    """
+    current = ChunkedUpload.objects.select_related('card').filter(id=upload.id).first()
+    if current is None:
+        raise UploadError("Opplastingen finnes ikke lenger. Start på nytt.", status=410)
+    if current.card_id is None:
+        raise UploadError("Opplastingen fullføres allerede. Prøv igjen om litt.", status=409)
+    upload.card = current.card
+    return current.card
+
+
+def delete_upload(upload):
+    Card._meta.get_field(upload.field).storage.delete(upload.file_name)
+    upload.delete()
+
+
+def purge_abandoned():
+    """
+    Deletes uploads idle for longer than UPLOAD_EXPIRY and their files.
+    Returns the number deleted.
+    """
+    abandoned = list(ChunkedUpload.objects.filter(updated_at__lt=timezone.now() - UPLOAD_EXPIRY))
+    for upload in abandoned:
+        delete_upload(upload)
+    return len(abandoned)
@@ -7,12 +7,18 @@ urlpatterns = [
     path('profile/<int:profile_id>/', views.profile_home, name='profile_home'),
     path('profile/<int:profile_id>/upload/media/', views.upload_media_card, name='upload_media_card'),
     path('profile/<int:profile_id>/upload/prompt/', views.upload_prompt_card, name='upload_prompt_card'),
+    path('profile/<int:profile_id>/upload/chunked/', views.upload_start, name='upload_start'),
+    path('profile/<int:profile_id>/upload/chunked/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('profile/<int:profile_id>/upload/chunked/<uuid:upload_id>/finish/', views.upload_finish, name='upload_finish'),
     path('profile/<int:profile_id>/rank/<str:card_type>/', views.rank_cards, name='rank_cards'),
+    path('profile/<int:profile_id>/rank/<str:card_type>/vote/', views.vote, name='vote'),
     path('profile/<int:profile_id>/stats/', views.stats, name='stats'),
+    path('profile/<int:profile_id>/stats/<str:card_type>/rows/', views.stats_rows, name='stats_rows'),
     path('profile/<int:profile_id>/results/', views.final_results, name='final_results'),
     path('profile/<int:profile_id>/card/<int:card_id>/', views.card_detail, name='card_detail'),
     path('profile/<int:profile_id>/card/<int:card_id>/delete/', views.delete_card, name='delete_card'),
     path('profile/<int:profile_id>/dashboard/', views.live_dashboard, name='live_dashboard'),
     path('profile/<int:profile_id>/dashboard/data/', views.live_dashboard_data, name='live_dashboard_data'),
     path('profile/<int:profile_id>/dashboard/chart-data/', views.live_dashboard_chart_data, name='live_dashboard_chart_data'),
+    path('profile/<int:profile_id>/dashboard/stream/', views.live_dashboard_stream, name='live_dashboard_stream'),
 ]
@@ -1,4 +1,32 @@
-def calculate_elo(cards, duels, initial_rating=1200.0, k_factor=32):
+INITIAL_RATING = 1200.0
+K_FACTOR = 32
+
+
+def judge_weight(judge_votes, total_votes, judge_total):
+    """
+    Vote Volume Normalization for a single vote: judges who vote more than the
+    average judge get less weight per vote.
+    The counts are the ones known when the vote is cast (including the vote
+    itself), so a vote keeps its weight once it is applied. This is what lets
+    the persisted ratings in core.ratings be updated one duel at a time.
+    """
+    avg_votes = total_votes / judge_total if judge_total else 1
+    # Weight is inverse to volume: more votes = less weight per vote
+    weight = avg_votes / judge_votes if judge_votes > 0 else 1
+    # Clamp weight to prevent extreme volatility (e.g., 0.5x to 2.5x)
+    return max(0.5, min(weight, 2.5))
+
+
+def elo_delta(w_curr, l_curr, k):
+    """
+    Returns the rating change (winner_delta, loser_delta) for a single duel.
+    """
+    expected_winner = 1 / (1 + 10 ** ((l_curr - w_curr) / 400))
+    expected_loser = 1 / (1 + 10 ** ((w_curr - l_curr) / 400))
+    return k * (1 - expected_winner), k * (0 - expected_loser)
+
+
+def calculate_elo(cards, duels, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
     """
     Calculates ELO ratings for a set of cards based on a specific list of duels.
     Implements Vote Volume Normalization: judges who vote more have less weight per vote.
@@ -12,20 +40,17 @@ def calculate_elo(cards, duels, initial_rating=1200.0, k_factor=32):
         } for card in cards
     }
 
-    # 1. Pre-calculate vote counts per judge
     judge_counts = {}
-    valid_judges_count = 0
-    for duel in duels:
-        if duel.judge:
-            jid = duel.judge.id
-            judge_counts[jid] = judge_counts.get(jid, 0) + 1
-    
-    if judge_counts:
-        avg_votes = sum(judge_counts.values()) / len(judge_counts)
-    else:
-        avg_votes = 1
+    total_votes = 0
 
     for duel in duels:
+        # Calculate Dynamic K-Factor from the votes seen so far
+        current_k = k_factor
+        if duel.judge_id:
+            judge_counts[duel.judge_id] = judge_counts.get(duel.judge_id, 0) + 1
+            total_votes += 1
+            current_k = k_factor * judge_weight(judge_counts[duel.judge_id], total_votes, len(judge_counts))
+
         winner_id = duel.winner_id
         loser_id = duel.loser_id
 
@@ -36,28 +61,13 @@ def calculate_elo(cards, duels, initial_rating=1200.0, k_factor=32):
         ratings[winner_id]['won'] += 1
         ratings[loser_id]['lost'] += 1
 
-        w_curr = ratings[winner_id]['rating']
-        l_curr = ratings[loser_id]['rating']
-
-        expected_winner = 1 / (1 + 10 ** ((l_curr - w_curr) / 400))
-        expected_loser = 1 / (1 + 10 ** ((w_curr - l_curr) / 400))
-
-        # Calculate Dynamic K-Factor
-        current_k = k_factor
-        if duel.judge:
-            user_votes = judge_counts.get(duel.judge.id, avg_votes)
-            # Weight is inverse to volume: more votes = less weight per vote
-            weight = avg_votes / user_votes if user_votes > 0 else 1
-            # Clamp weight to prevent extreme volatility (e.g., 0.5x to 2.5x)
-            weight = max(0.5, min(weight, 2.5))
-            current_k = k_factor * weight
-
-        ratings[winner_id]['rating'] += current_k * (1 - expected_winner)
-        ratings[loser_id]['rating'] += current_k * (0 - expected_loser)
+        w_delta, l_delta = elo_delta(ratings[winner_id]['rating'], ratings[loser_id]['rating'], current_k)
+        ratings[winner_id]['rating'] += w_delta
+        ratings[loser_id]['rating'] += l_delta
 
     return ratings
 
-def calculate_elo_history(cards, duels, initial_rating=1200.0, k_factor=32):
+def calculate_elo_history(cards, duels, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
     """
     Calculates ELO history for a set of cards.
     Implements Vote Volume Normalization.
@@ -65,49 +75,100 @@ def calculate_elo_history(cards, duels, initial_rating=1200.0, k_factor=32):
     """
     ratings = {card.id: initial_rating for card in cards}
     history = {card.id: [] for card in cards}
-    
-    # 1. Pre-calculate vote counts per judge
+
     judge_counts = {}
-    for duel in duels:
-        if duel.judge:
-            jid = duel.judge.id
-            judge_counts[jid] = judge_counts.get(jid, 0) + 1
-            
-    if judge_counts:
-        avg_votes = sum(judge_counts.values()) / len(judge_counts)
-    else:
-        avg_votes = 1
-    
+    total_votes = 0
+
     for i, duel in enumerate(duels):
+        current_k = k_factor
+        if duel.judge_id:
+            judge_counts[duel.judge_id] = judge_counts.get(duel.judge_id, 0) + 1
+            total_votes += 1
+            current_k = k_factor * judge_weight(judge_counts[duel.judge_id], total_votes, len(judge_counts))
+
         winner_id = duel.winner_id
         loser_id = duel.loser_id
 
         if winner_id not in ratings or loser_id not in ratings:
             continue
 
-        w_curr = ratings[winner_id]
-        l_curr = ratings[loser_id]
-
-        expected_winner = 1 / (1 + 10 ** ((l_curr - w_curr) / 400))
-        expected_loser = 1 / (1 + 10 ** ((w_curr - l_curr) / 400))
-
-        # Calculate Dynamic K-Factor
-        current_k = k_factor
-        if duel.judge:
-            user_votes = judge_counts.get(duel.judge.id, avg_votes)
-            weight = avg_votes / user_votes if user_votes > 0 else 1
-            weight = max(0.5, min(weight, 2.5))
-            current_k = k_factor * weight
-
         # Calculate new ratings
-        w_new = w_curr + current_k * (1 - expected_winner)
-        l_new = l_curr + current_k * (0 - expected_loser)
-        
-        ratings[winner_id] = w_new
-        ratings[loser_id] = l_new
-        
+        w_delta, l_delta = elo_delta(ratings[winner_id], ratings[loser_id], current_k)
+        ratings[winner_id] += w_delta
+        ratings[loser_id] += l_delta
+
         # Append to history with duel index
-        history[winner_id].append({'x': i + 1, 'y': w_new}) 
-        history[loser_id].append({'x': i + 1, 'y': l_new})
+        history[winner_id].append({'x': i + 1, 'y': ratings[winner_id]})
+        history[loser_id].append({'x': i + 1, 'y': ratings[loser_id]})
 
     return history
+
+def replay_elo(card_ids, duel_rows, history_for=None, initial_rating=INITIAL_RATING, k_factor=K_FACTOR):
+    """
+    Replays the duels once and returns (ratings, history).
+    duel_rows are (winner_id, loser_id, judge_id) tuples in duel order.
+    ratings: {card_id: {'rating': float, 'won': int, 'lost': int}} for every card.
+    history: {card_id: [{'x': duel_index, 'y': rating}, ...]} only for the card ids
+    in history_for, starting at the initial rating at duel 0. Memory for the
+    history grows with the requested cards only.
+    """
+    from .elo import build_duel_arrays, replay
+
+    card_ids = list(card_ids)
+    arrays = build_duel_arrays(card_ids, duel_rows, k_factor)
+
+    index = {card_id: i for i, card_id in enumerate(card_ids)}
+    tracked = {index[card_id]: card_id for card_id in (history_for or ()) if card_id in index}
+
+    ratings, won, lost, points = replay(arrays, initial_rating, history_for=tracked)
+
+    ratings = {
+        card_id: {'rating': ratings[i], 'won': won[i], 'lost': lost[i]}
+        for i, card_id in enumerate(card_ids)
+    }
+    history = {
+        card_id: [{'x': 0, 'y': initial_rating}] + [{'x': x, 'y': y} for x, y in points[i]]
+        for i, card_id in tracked.items()
+    }
+    return ratings, history
+
+def downsample_lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line to at most `threshold`
+    points. Keeps the first and last point and the visually significant ones in between.
+    Returns (xs, ys).
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+
+    sampled_x = [xs[0]]
+    sampled_y = [ys[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(ys[avg_start:avg_end]) / (avg_end - avg_start)
+
+        # Point of the current bucket forming the largest triangle with the previous pick and the average
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a_next = j
+
+        sampled_x.append(xs[a_next])
+        sampled_y.append(ys[a_next])
+        a = a_next
+
+    sampled_x.append(xs[-1])
+    sampled_y.append(ys[-1])
+    return sampled_x, sampled_y
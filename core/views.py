@@ -1,11 +1,22 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib import messages
 from django.forms import HiddenInput
-from .models import Profile, Card, Duel, Prompt, Participant
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from .models import Profile, Card, ChunkedUpload, Duel, Prompt, Participant
 from .forms import MediaCardForm, PromptCardForm
-import random
 from django.db.models import Count
-from .utils import calculate_elo, calculate_elo_history
-from django.db.models import Q
+from .caching import versioned_response
+from .checkpoints import replay_profile
+from .leaderboard import leaderboard_page, SORTS
+from .prompts import assign_prompt, mark_answered
+from .utils import downsample_lttb
+from .ratings import get_rating
+from .results import get_snapshot as get_results_snapshot
+from .uploads import CHUNK_SIZE, UploadError, append_chunk, finish_upload, start_upload
+from .sampler import draw_pair, invalidate as invalidate_sampler
+from .writer import record_vote
+from django.db.models import Case, F, Q, When
 
 def index(request):
     error = None
@@ -79,6 +90,10 @@ def profile_home(request, profile_id):
 
     return render(request, 'profile_home.html', {'profile': profile, 'participant': participant})
 
+def warn_duplicate(request, card):
+    if card.duplicate_of_id:
+        messages.warning(request, "Denne filen er allerede lastet opp i profilen, så kortet er merket som duplikat.")
+
 def upload_media_card(request, profile_id): # Renamed
     profile = get_object_or_404(Profile, id=profile_id)
     if request.session.get('profile_id') != profile.id:
@@ -96,6 +111,7 @@ def upload_media_card(request, profile_id): # Renamed
             card.profile = profile
             card.uploader = participant
             card.save()
+            warn_duplicate(request, card)
             return redirect('profile_home', profile_id=profile.id)
     else:
         form = MediaCardForm() # Changed form
@@ -112,34 +128,35 @@ def upload_prompt_card(request, profile_id):
         return redirect('join_profile', profile_id=profile.id)
     participant = get_object_or_404(Participant, id=participant_id)
 
-    assigned_prompt = None
+    assignment = None
     if profile.random_prompts_mode:
-        # Get a random prompt that has not been answered by this participant for this profile yet
-        # (or just a random prompt if we allow multiple answers to same prompt)
-        # For simplicity, let's just get a random prompt from all available.
-        available_prompts = Prompt.objects.all()
-        if available_prompts.exists():
-            assigned_prompt = random.choice(list(available_prompts))
-        else:
+        # The assignment persists until answered, so the POST answers the prompt the GET showed
+        assignment = assign_prompt(profile, participant)
+        if assignment is None:
             # Handle case with no prompts available
             return render(request, 'upload_card.html', {'form': None, 'profile': profile, 'title': 'Svar på en prompt', 'error': 'Ingen prompter tilgjengelig.'})
-
+    assigned_prompt = assignment.prompt if assignment else None
 
     if request.method == 'POST':
         form = PromptCardForm(request.POST, request.FILES)
+        if assigned_prompt:
+            form.fields['prompt'].widget = HiddenInput()
         if form.is_valid():
             card = form.save(commit=False)
             card.profile = profile
             card.uploader = participant
             
-            if profile.random_prompts_mode and assigned_prompt:
+            if assigned_prompt:
                 card.prompt = assigned_prompt # Assign the pre-selected random prompt
             
             card.save()
+            warn_duplicate(request, card)
+            if assignment:
+                mark_answered(assignment)
             return redirect('profile_home', profile_id=profile.id)
     else:
         # For GET request, if in random mode, pre-fill the form's prompt field
-        if profile.random_prompts_mode and assigned_prompt:
+        if assigned_prompt:
             form = PromptCardForm(initial={'prompt': assigned_prompt})
             form.fields['prompt'].widget = HiddenInput() # Hidden, but we'll show its text in template
         else:
@@ -153,6 +170,111 @@ def upload_prompt_card(request, profile_id):
         'assigned_prompt': assigned_prompt # Pass to template for display
     })
 
+def upload_participant(request, profile):
+    """
+    The participant uploading to the profile, or None when the session is not joined to it.
+    """
+    participant_id = request.session.get('participant_id')
+    if request.session.get('profile_id') != profile.id or not participant_id:
+        return None
+    return Participant.objects.filter(id=participant_id, profile=profile).first()
+
+def upload_state(upload):
+    return {
+        'id': str(upload.id),
+        'url': reverse('upload_chunk', args=[upload.profile_id, upload.id]),
+        'finish_url': reverse('upload_finish', args=[upload.profile_id, upload.id]),
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': CHUNK_SIZE,
+    }
+
+def upload_start(request, profile_id):
+    """
+    Starts a resumable upload of an image or video (see core.uploads) and
+    answers with its URLs and the chunk size to use.
+    """
+    profile = get_object_or_404(Profile, id=profile_id)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Bruk POST.'}, status=405)
+    participant = upload_participant(request, profile)
+    if participant is None:
+        return JsonResponse({'error': 'Ikke logget inn.'}, status=403)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Mangler filstørrelse.'}, status=400)
+    try:
+        upload = start_upload(profile, participant, request.POST.get('field'), request.POST.get('filename', ''), size)
+    except UploadError as error:
+        return JsonResponse({'error': error.message}, status=error.status)
+    return JsonResponse(upload_state(upload), status=201)
+
+def upload_chunk(request, profile_id, upload_id):
+    """
+    GET answers with the offset received so far, to resume from; PUT appends
+    the request body at the offset in the Upload-Offset header.
+    """
+    profile = get_object_or_404(Profile, id=profile_id)
+    participant = upload_participant(request, profile)
+    if participant is None:
+        return JsonResponse({'error': 'Ikke logget inn.'}, status=403)
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, profile=profile, uploader=participant)
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Mangler Upload-Offset.'}, status=400)
+        try:
+            append_chunk(upload, offset, request, length)
+        except UploadError as error:
+            return JsonResponse({'error': error.message, **upload_state(upload)}, status=error.status)
+    elif request.method != 'GET':
+        return JsonResponse({'error': 'Bruk GET eller PUT.'}, status=405)
+    return JsonResponse(upload_state(upload))
+
+def upload_finish(request, profile_id, upload_id):
+    """
+    Creates the card of a complete upload: a media card, or with
+    flow=prompt an answer to the posted (or the assigned random) prompt.
+    """
+    profile = get_object_or_404(Profile, id=profile_id)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Bruk POST.'}, status=405)
+    participant = upload_participant(request, profile)
+    if participant is None:
+        return JsonResponse({'error': 'Ikke logget inn.'}, status=403)
+    upload = get_object_or_404(ChunkedUpload.objects.select_related('card'), id=upload_id, profile=profile, uploader=participant)
+    if upload.card_id is not None:
+        # A retry of a finish that got through
+        return finished_upload(profile, upload.card, status=200)
+
+    prompt = assignment = None
+    if request.POST.get('flow') == 'prompt':
+        if profile.random_prompts_mode:
+            assignment = assign_prompt(profile, participant)
+            prompt = assignment.prompt if assignment else None
+        else:
+            prompt = Prompt.objects.filter(id=request.POST.get('prompt') or None).first()
+        if prompt is None:
+            return JsonResponse({'error': 'Velg en prompt.'}, status=400)
+    try:
+        card = finish_upload(upload, prompt)
+    except UploadError as error:
+        return JsonResponse({'error': error.message}, status=error.status)
+    if assignment:
+        mark_answered(assignment)
+    warn_duplicate(request, card)
+    return finished_upload(profile, card)
+
+def finished_upload(profile, card, status=201):
+    return JsonResponse({
+        'card': card.id,
+        'duplicate_of': card.duplicate_of_id,
+        'redirect': reverse('profile_home', args=[profile.id]),
+    }, status=status)
+
 def rank_cards(request, profile_id, card_type):
     profile = get_object_or_404(Profile, id=profile_id)
     if request.session.get('profile_id') != profile.id:
@@ -170,209 +292,258 @@ def rank_cards(request, profile_id, card_type):
         winner_id = request.POST.get('winner')
         loser_id = request.POST.get('loser')
         
-        winner = get_object_or_404(Card, id=winner_id)
-        loser = get_object_or_404(Card, id=loser_id)
+        winner = get_object_or_404(Card, id=winner_id, profile=profile)
+        loser = get_object_or_404(Card, id=loser_id, profile=profile)
         
-        # We just create the duel. ELO is calculated on the fly in stats view.
-        Duel.objects.create(winner=winner, loser=loser, judge=participant)
+        queue = take_issued_pair(request, profile, card_type, winner, loser)
+        if queue is not None:
+            # Batched with concurrent votes; returns once the duel and its rating update are committed.
+            record_vote(profile, winner, loser, participant)
+            request.session[pair_queue_key(profile, card_type)] = queue
         
         return redirect('rank_cards', profile_id=profile.id, card_type=card_type)
 
-    # Fetch 2 random cards
-    card1 = None
-    card2 = None
-    
-    # Fetch all data for weighting logic
-    # We prioritize cards with higher win rates using Laplace smoothing: (wins + 1) / (total + 2)
-    # This ensures bad cards (low win rate) appear less often.
-    
-    all_cards = list(Card.objects.filter(profile=profile).select_related('prompt'))
-    all_duels = list(Duel.objects.filter(winner__profile=profile))
-    
-    # Calculate current stats
-    stats = calculate_elo(all_cards, all_duels)
-    
-    candidates = []
-    
-    if card_type == 'image':
-        candidates = [c for c in all_cards if c.prompt is None]
-        
-        if len(candidates) >= 2:
-            # Calculate weights
-            weights = []
-            for c in candidates:
-                s = stats.get(c.id, {'won': 0, 'lost': 0})
-                w = (s['won'] + 1) / (s['won'] + s['lost'] + 2)
-                weights.append(w)
-            
-            # Weighted selection without replacement
-            card1 = random.choices(candidates, weights=weights, k=1)[0]
-            
-            idx = candidates.index(card1)
-            candidates.pop(idx)
-            weights.pop(idx)
-            
-            card2 = random.choices(candidates, weights=weights, k=1)[0]
-            
-    elif card_type == 'prompt':
-        # Pool ALL prompt cards and select two based on weights, allowing cross-prompt comparison
-        candidates = [c for c in all_cards if c.prompt]
-        
-        if len(candidates) >= 2:
-            # Calculate weights
-            weights = []
-            for c in candidates:
-                s = stats.get(c.id, {'won': 0, 'lost': 0})
-                w = (s['won'] + 1) / (s['won'] + s['lost'] + 2)
-                weights.append(w)
-            
-            # Weighted selection without replacement
-            card1 = random.choices(candidates, weights=weights, k=1)[0]
-            
-            idx = candidates.index(card1)
-            candidates.pop(idx)
-            weights.pop(idx)
-            
-            card2 = random.choices(candidates, weights=weights, k=1)[0]
-
-    if not card1 or not card2:
+    # Top up the issued queue of pairs: the first is shown, the rest are prefetched by the page
+    pairs = issue_pairs(request, profile, card_type, request.session.get(pair_queue_key(profile, card_type), []))
+    if not pairs:
         return render(request, 'rank.html', {'profile': profile, 'error': 'Ikke nok kort til å rangere!', 'card_type': card_type})
 
-    return render(request, 'rank.html', {'profile': profile, 'card1': card1, 'card2': card2, 'card_type': card_type})
+    card1, card2 = pairs[0]
+    return render(request, 'rank.html', {
+        'profile': profile,
+        'card1': card1,
+        'card2': card2,
+        # Each card with its opponent, for the vote forms
+        'pair': [(card1, card2), (card2, card1)],
+        'card_type': card_type,
+        'queue': [pair_payload(pair) for pair in pairs[1:]],
+    })
 
-def stats(request, profile_id):
+# Pairs handed out per vote: the next one plus the ones the client prefetches
+VOTE_QUEUE_SIZE = 3
+
+def card_payload(card):
+    return {
+        'id': card.id,
+        'prompt': card.prompt.text if card.prompt else None,
+        'answer': card.answer,
+        'image': card.medium_url if card.image else None,
+        'srcset': card.jpeg_srcset if card.image else '',
+        'webp_srcset': card.webp_srcset if card.image else '',
+        'video': card.video.url if card.video else None,
+        'poster': card.poster.url if card.poster else None,
+    }
+
+def pair_payload(pair):
+    return [card_payload(card) for card in pair]
+
+def pair_queue_key(profile, card_type):
+    return f'pair_queue_{profile.id}_{card_type}'
+
+def take_issued_pair(request, profile, card_type, winner, loser):
+    """
+    Returns the session's queue of issued pairs after the voted pair, or None
+    when the pair is not the one shown, at the head of the queue. A pair is
+    taken off the queue by its vote, so a vote that is submitted again (a retry
+    after a lost response, or the form post fallback) is not counted twice.
+    """
+    queue = request.session.get(pair_queue_key(profile, card_type), [])
+    if queue and set(queue[0]) == {winner.id, loser.id}:
+        return queue[1:]
+    return None
+
+def issue_pairs(request, profile, card_type, queue=()):
+    """
+    Tops a queue of upcoming [card1_id, card2_id] pairs up to VOTE_QUEUE_SIZE,
+    stores it in the session and returns it as (card1, card2) tuples.
+    Pairs whose cards have been deleted in the meantime are dropped.
+    """
+    queue = [list(pair) for pair in queue]
+    if card_type not in ('image', 'prompt'):
+        return []
+
+    # Draw 2 cards per pair by the profile's matchmaking mode: weighted by the Laplace-smoothed
+    # win rate (wins + 1) / (total + 2) so bad cards appear less often, or by expected
+    # information gain. Prompt cards are pooled across prompts, allowing cross-prompt comparison.
+    for attempt in range(2):
+        while len(queue) < VOTE_QUEUE_SIZE:
+            # Redraw a pair equal to the one before it, which would look like a repeated vote
+            for redraw in range(3):
+                pair = draw_pair(profile, card_type)
+                if not pair or not queue or set(pair) != set(queue[-1]):
+                    break
+            if not pair:
+                break
+            queue.append(list(pair))
+
+        cards = Card.objects.select_related('prompt').in_bulk({card_id for pair in queue for card_id in pair})
+        pairs = [(cards[a], cards[b]) for a, b in queue if a in cards and b in cards]
+        if len(pairs) == len(queue):
+            break
+        # Drawn from a sampler that missed a deletion in another process
+        invalidate_sampler(profile.id)
+        queue = [[a.id, b.id] for a, b in pairs]
+
+    request.session[pair_queue_key(profile, card_type)] = [[a.id, b.id] for a, b in pairs]
+    return pairs
+
+def vote(request, profile_id, card_type):
+    """
+    AJAX voting: records the duel and answers with the next pair and the queue
+    of upcoming pairs, so a vote takes one round trip and the client can
+    prefetch media while the guest decides.
+    """
     profile = get_object_or_404(Profile, id=profile_id)
-    if request.session.get('profile_id') != profile.id:
-        return redirect('index')
+    participant_id = request.session.get('participant_id')
+    if request.session.get('profile_id') != profile.id or not participant_id:
+        return JsonResponse({'error': 'Ikke logget inn.'}, status=403)
+    if not profile.voting_enabled:
+        return JsonResponse({'error': 'Avstemningen er stengt.'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Bruk POST.'}, status=405)
+    participant = get_object_or_404(Participant, id=participant_id)
 
-    filter_by = request.GET.get('filter_by', 'all')
-    
-    # Get all cards
-    cards = list(Card.objects.filter(profile=profile))
-    
-    # Get all duels relevant to this profile
-    all_duels = list(Duel.objects.filter(winner__profile=profile).select_related('judge').order_by('created_at'))
-    
-    # Apply filters
-    filtered_duels = []
-    filter_label = "Alle rangeringer"
-
-    if filter_by == 'all':
-        filtered_duels = all_duels
-    elif filter_by == 'men':
-        filtered_duels = [d for d in all_duels if d.judge and d.judge.gender == 'M']
-        filter_label = "Rangeringer (menn)"
-    elif filter_by == 'women':
-        filtered_duels = [d for d in all_duels if d.judge and d.judge.gender == 'F']
-        filter_label = "Rangeringer (kvinner)"
+    winner = get_object_or_404(Card, id=request.POST.get('winner'), profile=profile)
+    loser = get_object_or_404(Card, id=request.POST.get('loser'), profile=profile)
+
+    queue = take_issued_pair(request, profile, card_type, winner, loser)
+    if queue is None:
+        # Already counted, or never issued: answer with the current queue
+        queue = request.session.get(pair_queue_key(profile, card_type), [])
     else:
+        # Batched with concurrent votes; returns once the duel and its rating update are committed.
+        record_vote(profile, winner, loser, participant)
+
+    pairs = issue_pairs(request, profile, card_type, queue)
+    return JsonResponse({
+        'pair': pair_payload(pairs[0]) if pairs else None,
+        'queue': [pair_payload(pair) for pair in pairs[1:]],
+    })
+
+def rating_filter(filter_by):
+    """
+    Judge segment ('all', 'men', 'women' or a participant id) for the
+    stats/results filter dropdown, plus the label to show.
+    """
+    if filter_by == 'men':
+        return 'men', "Rangeringer (menn)"
+    elif filter_by == 'women':
+        return 'women', "Rangeringer (kvinner)"
+    elif filter_by != 'all':
         # Check if it's a participant ID
         try:
              p_id = int(filter_by)
              participant = get_object_or_404(Participant, id=p_id)
-             filtered_duels = [d for d in all_duels if d.judge and d.judge.id == p_id]
-             filter_label = f"{participant.name}s rangeringer"
+             return p_id, f"{participant.name}s rangeringer"
         except (ValueError, Participant.DoesNotExist):
              # Fallback
-             filtered_duels = all_duels
-    
-    # Calculate ELOs based on filtered duels
-    ratings = calculate_elo(cards, filtered_duels)
-    
-    # Attach stats to card objects
-    for card in cards:
-        r = ratings.get(card.id)
-        card.elo_rating = r['rating']
-        card.won_count = r['won']
-        card.lost_count = r['lost']
-        
-        # Calculate selection weight using Laplace smoothing
-        total_duels = r['won'] + r['lost']
-        card.selection_weight = ((r['won'] + 1) / (total_duels + 2)) * 100 # As percentage
-        
-    # Sort by ELO
-    cards.sort(key=lambda x: x.elo_rating, reverse=True)
+             pass
+
+    return 'all', "Alle rangeringer"
+
+@versioned_response('filter_by', 'sort')
+def stats(request, profile_id):
+    profile = get_object_or_404(Profile, id=profile_id)
+    if request.session.get('profile_id') != profile.id:
+        return redirect('index')
+
+    filter_by = request.GET.get('filter_by', 'all')
+    sort = request.GET.get('sort', 'rating')
+    if sort not in SORTS:
+        sort = 'rating'
+    segment, filter_label = rating_filter(filter_by)
+
+    # First page of each leaderboard; the rest is loaded while scrolling
+    image_cards, image_next = leaderboard_page(profile, 'image', segment, sort)
+    prompt_cards, prompt_next = leaderboard_page(profile, 'prompt', segment, sort)
 
-    image_cards = [c for c in cards if c.prompt is None]
-    prompt_cards = [c for c in cards if c.prompt is not None]
-    
     participants = profile.participants.all().order_by('name')
 
     return render(request, 'stats.html', {
         'profile': profile,
         'image_cards': image_cards,
+        'image_next': image_next,
         'prompt_cards': prompt_cards,
+        'prompt_next': prompt_next,
         'filter_by': filter_by,
         'filter_label': filter_label,
+        'sort': sort,
+        'sorts': SORTS,
         'participants': participants
     })
 
-def card_detail(request, profile_id, card_id):
+@versioned_response('filter_by', 'sort', 'after')
+def stats_rows(request, profile_id, card_type):
+    """
+    Table rows of the next leaderboard page after the `after` cursor, fetched
+    by the stats page as the user scrolls.
+    """
     profile = get_object_or_404(Profile, id=profile_id)
     if request.session.get('profile_id') != profile.id:
         return redirect('index')
-    
-    card = get_object_or_404(Card, id=card_id, profile=profile)
-    
-    # Calculate ELO to show current rating
-    cards = list(Card.objects.filter(profile=profile))
-    duels = list(Duel.objects.filter(winner__profile=profile).select_related('judge').order_by('created_at'))
-    ratings = calculate_elo(cards, duels)
-    
-    current_rating = ratings.get(card.id, {}).get('rating', 1200.0)
-    
-    # Calculate ELO history for this specific card
-    history = calculate_elo_history(cards, duels)
-    card_history = history.get(card.id, [])
-    
-    # Prepend initial state
-    if not card_history:
-         card_history = [{'x': 0, 'y': 1200.0}]
-    else:
-         card_history.insert(0, {'x': 0, 'y': 1200.0})
+    if card_type not in ('image', 'prompt'):
+        raise Http404("Ukjent korttype.")
 
-    # Aggregate voting history by participant
-    vote_stats = {}
-    
-    # Fetch all participants for this profile to initialize
-    participants = Participant.objects.filter(profile=profile)
-    for p in participants:
-        vote_stats[p.name] = {'won': 0, 'lost': 0}
-        
-    # Analyze duels involving this card
-    relevant_duels = Duel.objects.filter(Q(winner=card) | Q(loser=card)).select_related('judge', 'winner', 'loser')
-    
-    for duel in relevant_duels:
-        if duel.judge: # Only count if there was a judge (participant)
-            judge_name = duel.judge.name
-            if judge_name not in vote_stats:
-                vote_stats[judge_name] = {'won': 0, 'lost': 0}
-            
-            if duel.winner == card:
-                vote_stats[judge_name]['won'] += 1
-            else:
-                vote_stats[judge_name]['lost'] += 1
-    
-    # Convert to list for template
-    voter_history = []
-    for name, stats in vote_stats.items():
-        total = stats['won'] + stats['lost']
-        if total > 0: # Only include if they have voted on this card
-            voter_history.append({
-                'name': name,
-                'won': stats['won'],
-                'lost': stats['lost'],
-                'total': total
-            })
+    filter_by = request.GET.get('filter_by', 'all')
+    sort = request.GET.get('sort', 'rating')
+    segment, _ = rating_filter(filter_by)
+    cards, next_cursor = leaderboard_page(profile, card_type, segment, sort, request.GET.get('after'))
+
+    return render(request, 'stats_rows.html', {
+        'profile': profile,
+        'card_type': card_type,
+        'cards': cards,
+        'next_cursor': next_cursor,
+        'filter_by': filter_by,
+        'sort': sort,
+    })
+
+@versioned_response()
+def card_detail(request, profile_id, card_id):
+    profile = get_object_or_404(Profile, id=profile_id)
+    if request.session.get('profile_id') != profile.id:
+        return redirect('index')
     
-    voter_history.sort(key=lambda x: x['total'], reverse=True)
+    card = get_object_or_404(Card.objects.select_related('uploader', 'prompt'), id=card_id, profile=profile)
+    
+    # Current rating from the persisted state
+    current_rating = get_rating(card)['rating']
+    
+    # Calculate ELO history for this specific card only, resuming from the latest checkpoint
+    _, history = replay_profile(profile, history_for=[card.id])
+    card_history = history[card.id]
+
+    card_duels = Duel.objects.filter(Q(winner=card) | Q(loser=card))
+    won = Count('id', filter=Q(winner=card))
+    lost = Count('id', filter=Q(loser=card))
+
+    # Voting history by participant, only judges who have voted on this card
+    voter_history = list(
+        card_duels.filter(judge__isnull=False)
+        .values('judge_id', name=F('judge__name'))
+        .annotate(won=won, lost=lost, total=Count('id'))
+        .order_by('-total', 'name')
+    )
+
+    # Head-to-head record against every opponent
+    head_to_head = list(
+        card_duels
+        .annotate(opponent_id=Case(When(winner=card, then='loser_id'), default='winner_id'))
+        .values('opponent_id')
+        .annotate(won=won, lost=lost, total=Count('id'))
+        .order_by('-total', 'opponent_id')
+    )
+    opponents = Card.objects.select_related('prompt').in_bulk([row['opponent_id'] for row in head_to_head])
+    for row in head_to_head:
+        row['opponent'] = opponents[row['opponent_id']]
 
     return render(request, 'card_detail.html', {
         'profile': profile,
         'card': card,
         'elo_rating': current_rating,
         'elo_history': card_history,
-        'voter_history': voter_history
+        'voter_history': voter_history,
+        'head_to_head': head_to_head,
     })
 
 def delete_card(request, profile_id, card_id):
@@ -389,166 +560,158 @@ def delete_card(request, profile_id, card_id):
     return redirect('card_detail', profile_id=profile.id, card_id=card.id)
 
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404
+from .events import broker, dashboard_counts
+import asyncio
+import json
 
 @login_required
 def live_dashboard(request, profile_id):
     profile = get_object_or_404(Profile, id=profile_id)
     
     # Initial data
-    image_count = Card.objects.filter(profile=profile, prompt__isnull=True).count()
-    prompt_count = Card.objects.filter(profile=profile, prompt__isnull=False).count()
-    duel_count = Duel.objects.filter(winner__profile=profile).count()
-
     return render(request, 'live_dashboard.html', {
         'profile': profile,
-        'image_count': image_count,
-        'prompt_count': prompt_count,
-        'duel_count': duel_count
+        **dashboard_counts(profile.id)
     })
 
 @login_required
+@versioned_response(session_required=False)
 def live_dashboard_data(request, profile_id):
     profile = get_object_or_404(Profile, id=profile_id)
     
-    image_count = Card.objects.filter(profile=profile, prompt__isnull=True).count()
-    prompt_count = Card.objects.filter(profile=profile, prompt__isnull=False).count()
-    duel_count = Duel.objects.filter(winner__profile=profile).count()
-    
-    return JsonResponse({
-        'image_count': image_count,
-        'prompt_count': prompt_count,
-        'duel_count': duel_count
-    })
+    return JsonResponse(dashboard_counts(profile.id))
+
+STREAM_KEEPALIVE = 15
+
+@login_required
+async def live_dashboard_stream(request, profile_id):
+    """
+    Server-sent events with the dashboard updates of a profile, pushed by
+    core.events whenever a card or duel is written. Needs an ASGI server; under
+    WSGI the events would be buffered until the stream ends, so the client is
+    told to stop connecting (204) and keeps polling instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    profile = await aget_object_or_404(Profile, id=profile_id)
+
+    async def events():
+        subscription = broker.subscribe(profile.id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(subscription.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+CHART_POINT_BUDGET = 300
 
 @login_required
+@versioned_response('since', 'points', session_required=False)
 def live_dashboard_chart_data(request, profile_id):
+    """
+    Rating history of every card as columnar series ({'x': [...], 'y': [...]}),
+    downsampled to `points` points per series.
+    With ?since=<duel index> only the points after that duel are returned.
+    """
     profile = get_object_or_404(Profile, id=profile_id)
+
+    try:
+        since = int(request.GET['since'])
+    except (KeyError, ValueError):
+        since = None
+    try:
+        budget = max(3, min(int(request.GET.get('points', CHART_POINT_BUDGET)), CHART_POINT_BUDGET))
+    except ValueError:
+        budget = CHART_POINT_BUDGET
     
-    # Fetch all data
-    cards = list(Card.objects.filter(profile=profile))
-    duels = list(Duel.objects.filter(winner__profile=profile).order_by('created_at'))
+    # Fetch all data, with what str(card) reads for the labels
+    cards = list(Card.objects.filter(profile=profile).select_related('uploader', 'prompt'))
     
-    history = calculate_elo_history(cards, duels)
+    # Final ratings and history in a single replay, resuming from the latest checkpoint
+    final_ratings, history = replay_profile(profile, history_for=[card.id for card in cards], since=since)
     
-    # Determine top 10 cards to display based on FINAL rating
-    final_ratings = calculate_elo(cards, duels)
+    # Order series by FINAL rating
     for card in cards:
         card.elo_rating = final_ratings[card.id]['rating']
     cards.sort(key=lambda x: x.elo_rating, reverse=True)
-    # top_cards = cards[:10] # Top 10 - REMOVED limit
     
-    datasets = []
+    series = []
+    last = since or 0
     colors = [
         '#FF6384', '#36A2EB', '#FFCE56', '#4BC0C0', '#9966FF', 
         '#FF9F40', '#E7E9ED', '#767676', '#52D726', '#FF0000'
     ]
     
-    for i, card in enumerate(cards): # Iterate over all cards
+    for card in cards: # Iterate over all cards
+        data_points = history[card.id]
+        if not data_points:
+            continue
+        last = max(last, data_points[-1]['x'])
+
+        xs, ys = downsample_lttb([p['x'] for p in data_points], [p['y'] for p in data_points], budget)
+
         # Label: Truncate long prompts/answers
         label = str(card)
         if len(label) > 20:
             label = label[:20] + "..."
-            
-        data_points = history[card.id]
-        
-        # Ensure we have a starting point? 
-        # Actually calculate_elo_history only adds points on change.
-        # We can prepend the start.
-        if not data_points:
-             data_points = [{'x': 0, 'y': 1200.0}] # Start at duel 0
-        else:
-             # Prepend initial state at duel 0
-             data_points.insert(0, {'x': 0, 'y': 1200.0})
-             
-        datasets.append({
+
+        series.append({
+            'id': card.id,
             'label': label,
-            'data': data_points,
-            'borderColor': colors[card.id % len(colors)],
-            'fill': False,
-            'tension': 0.1
+            'color': colors[card.id % len(colors)],
+            'x': xs,
+            'y': [round(y, 1) for y in ys],
         })
         
     return JsonResponse({
-        'datasets': datasets
+        'since': since,
+        'last': last,
+        'series': series
     })
 
+@versioned_response('filter_by')
 def final_results(request, profile_id):
     profile = get_object_or_404(Profile, id=profile_id)
     if request.session.get('profile_id') != profile.id:
         return redirect('index')
 
     filter_by = request.GET.get('filter_by', 'all')
+    segment, filter_label = rating_filter(filter_by)
 
-    # Fetch all cards sorted by ELO
-    cards = list(Card.objects.filter(profile=profile))
-    all_duels = list(Duel.objects.filter(winner__profile=profile).select_related('judge').order_by('created_at'))
-    
-    # Apply filters
-    filtered_duels = []
-    filter_label = "Alle rangeringer"
-
-    if filter_by == 'all':
-        filtered_duels = all_duels
-    elif filter_by == 'men':
-        filtered_duels = [d for d in all_duels if d.judge and d.judge.gender == 'M']
-        filter_label = "Rangeringer (menn)"
-    elif filter_by == 'women':
-        filtered_duels = [d for d in all_duels if d.judge and d.judge.gender == 'F']
-        filter_label = "Rangeringer (kvinner)"
-    else:
-        # Check if it's a participant ID
-        try:
-             p_id = int(filter_by)
-             participant = get_object_or_404(Participant, id=p_id)
-             filtered_duels = [d for d in all_duels if d.judge and d.judge.id == p_id]
-             filter_label = f"{participant.name}s rangeringer"
-        except (ValueError, Participant.DoesNotExist):
-             # Fallback
-             filtered_duels = all_duels
-
-    ratings = calculate_elo(cards, filtered_duels)
-    
-    for card in cards:
-        card.elo_rating = ratings[card.id]['rating']
-        
-    cards.sort(key=lambda x: x.elo_rating, reverse=True)
-
-    # Separate
-    images = [c for c in cards if c.prompt is None]
-    all_prompts = [c for c in cards if c.prompt is not None]
-    
-    # Filter unique prompts (highest rated only)
-    seen_prompts = set()
-    prompts = []
-    for card in all_prompts:
-        if card.prompt.id not in seen_prompts:
-            prompts.append(card)
-            seen_prompts.add(card.prompt.id)
-
-    # Defined pattern: 1. photo, 2. prompt, 3. photo, 4. photo, 5. prompt, 6. photo, 7. prompt, 8. photo
-    pattern = ['image', 'prompt', 'image', 'image', 'prompt', 'image', 'prompt', 'image']
+    # The list is materialized when the results are revealed (see core.results)
+    snapshot = get_results_snapshot(profile, segment)
+    entries = snapshot.entries
+    cards = Card.objects.filter(profile=profile).select_related('prompt', 'uploader').in_bulk([card_id for card_id, _ in entries])
     final_list = []
+    for card_id, rating in entries:
+        if card_id in cards:
+            card = cards[card_id]
+            card.elo_rating = rating
+            final_list.append(card)
 
-    img_idx = 0
-    pmt_idx = 0
-
-    for item_type in pattern:
-        if item_type == 'image':
-            if img_idx < len(images):
-                final_list.append(images[img_idx])
-                img_idx += 1
-        elif item_type == 'prompt':
-            if pmt_idx < len(prompts):
-                final_list.append(prompts[pmt_idx])
-                pmt_idx += 1
-    
     participants = profile.participants.all().order_by('name')
 
-    return render(request, 'final_results.html', {
+    response = render(request, 'final_results.html', {
         'profile': profile, 
         'final_list': final_list,
         'participants': participants,
         'filter_by': filter_by,
         'filter_label': filter_label
     })
+    # A snapshot within its refresh interval may be behind; versioned_response won't cache it
+    response.data_version = snapshot.data_version
+    return response
@@ -0,0 +1,129 @@
+"""
+Batched duel writes.
+
+SQLite has a single write lock, so when many guests vote at once every
+separate Duel.objects.create queues up for it (and fails with "database is
+locked" once busy_timeout runs out). Votes are instead handed to one writer
+thread per process, which drains the queue every BATCH_WINDOW and writes the
+whole batch with one bulk_create and one rating update in a single
+transaction.
+
+Acknowledgement is durable: record_vote only returns once the transaction
+holding the vote has committed. With the synchronous=FULL pragma (see
+settings.py) a returned vote survives a crash or power loss; votes still in
+the queue when the process dies were never acknowledged.
+"""
+from concurrent.futures import Future
+from django.db import connection, transaction
+from .models import Duel
+from .ratings import record_duels
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long the writer keeps collecting votes after the first one of a batch
+BATCH_WINDOW = 0.005
+BATCH_SIZE = 500
+
+# How long a request waits for its vote to commit
+ACK_TIMEOUT = 30
+
+
+class DuelWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, duel):
+        """
+        Queues an unsaved duel. The returned future resolves to the saved duel
+        once its batch has committed, or to the exception that prevented it.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((duel, future))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='duel-writer', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            callbacks = []
+            try:
+                write_duels([duel for duel, _ in batch], callbacks.append)
+            except Exception:
+                # Write the votes one by one, so one bad vote (e.g. for a card
+                # deleted meanwhile) does not fail the rest of the batch
+                connection.close()
+                callbacks = []
+                for duel, future in batch:
+                    written = []
+                    try:
+                        write_duels([duel], written.append)
+                    except Exception as error:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(duel)
+                        callbacks.extend(written)
+            else:
+                for duel, future in batch:
+                    future.set_result(duel)
+            # The waiting requests are answered before the sampler and dashboard updates run
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Update after a committed duel batch failed")
+
+writer = DuelWriter()
+
+
+def write_duels(duels, on_commit=transaction.on_commit):
+    """
+    Inserts duels and applies them to the ratings in one transaction.
+    The work to run once committed is passed to on_commit; the writer thread
+    collects it to run after answering the votes.
+    """
+    from .signals import duels_created
+
+    with transaction.atomic():
+        for duel in duels:
+            duel._state.adding = True
+            duel.pk = None
+        Duel.objects.bulk_create(duels)
+        record_duels(duels)
+        duels_created(duels, on_commit)
+    return duels
+
+def record_vote(profile, winner, loser, judge):
+    """
+    Records a vote through the writer thread and returns the saved duel once
+    it has committed. Inside a transaction (e.g. in tests) the duel is written
+    inline instead, as the writer's connection could not see that transaction.
+    """
+    duel = Duel(profile=profile, winner=winner, loser=loser, judge=judge)
+    if connection.in_atomic_block:
+        return write_duels([duel])[0]
+    return writer.submit(duel).result(timeout=ACK_TIMEOUT)
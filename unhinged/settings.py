@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +52,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Report query count, SQL time and Python time per request in a Server-Timing header
+SERVER_TIMING = DEBUG
+
 ROOT_URLCONF = 'unhinged.urls'
 
 TEMPLATES = [
@@ -74,12 +78,48 @@ WSGI_APPLICATION = 'unhinged.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite pragmas applied on every new connection. WAL lets pages keep reading
+# while votes are written; busy_timeout (ms) makes a writer wait for the lock
+# instead of failing with "database is locked"; synchronous=FULL makes a
+# committed (acknowledged) vote survive power loss. See core/writer.py.
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_BUSY_TIMEOUT = 5000
+SQLITE_SYNCHRONOUS = 'FULL'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': (
+                f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE};'
+                f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT};'
+                f'PRAGMA synchronous={SQLITE_SYNCHRONOUS};'
+            ),
+            # Take the write lock when a transaction starts, so busy_timeout applies
+            # instead of failing on a deferred lock upgrade. Every atomic block takes
+            # it, read-only ones too, so keep transactions to blocks that write.
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# A cache on disk is shared by all worker processes on the host, so cached
+# responses and replays, and their invalidation (e.g. core.prompts), reach
+# every process. core.singleflight keeps its locks next to it, as the file
+# cache has no atomic add to lock with.
+CACHE_DIR = BASE_DIR / 'cache'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
     }
 }
+SINGLE_FLIGHT_LOCK_DIR = CACHE_DIR / 'locks'
+
+# Tests get their own cache and lock directory, see unhinged/test_runner.py
+TEST_RUNNER = 'unhinged.test_runner.TestRunner'
 
 
 # Password validation
@@ -119,3 +159,22 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Uploads are stored once per content, named by their SHA-256 (see core.storage)
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# How core.serving sends media files: 'django' streams them itself,
+# 'x-accel-redirect' (nginx, via the internal MEDIA_ACCEL_PREFIX location) and
+# 'x-sendfile' (Apache, lighttpd) leave the transfer to the web server
+MEDIA_SERVE_MODE = 'django'
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Function taking the path of an uploaded video and returning a JPEG poster frame (or None)
+POSTER_EXTRACTOR = 'core.media.ffmpeg_poster'
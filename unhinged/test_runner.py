@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+import copy
+import os
+import shutil
+import tempfile
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with the file cache and the single-flight lock files in a
+    temporary directory, since tests clear the cache and would otherwise wipe
+    the one of the development server.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='unhinged-cache-')
+        caches = copy.deepcopy(settings.CACHES)
+        caches['default']['LOCATION'] = self.cache_dir
+        self.cache_settings = override_settings(
+            CACHES=caches,
+            SINGLE_FLIGHT_LOCK_DIR=os.path.join(self.cache_dir, 'locks'),
+        )
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
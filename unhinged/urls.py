@@ -17,12 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from core.serving import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', serve_media, name='media'),
     path('', include('core.urls')),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)